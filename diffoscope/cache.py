@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import os
+import json
+import stat
+import fcntl
+import shutil
+import hashlib
+import logging
+import weakref
+import tempfile
+import threading
+import collections
+
+from . import VERSION, feeders
+from .exc import RequiredToolNotFound
+from .tools import find_executable
+from .config import Config
+from .executor import degradable, limit_processes
+from .difference import Difference, VisualDifference
+from .comparators.utils.file import digest_key, path_digest
+
+try:
+    import tlsh
+except ImportError:  # noqa
+    tlsh = None
+
+logger = logging.getLogger(__name__)
+
+# Config fields that affect the output of a comparison.
+CONFIG_KEYS = (
+    'max_diff_input_lines',
+    'max_diff_block_lines_saved',
+    'fuzzy_threshold',
+    'new_file',
+    'excludes',
+    'exclude_commands',
+    'exclude_directory_metadata',
+    'compute_visual_diffs',
+)
+
+# The output of commands up to this size is also kept in memory, so that
+# running the same command on the same file again in one run is free even
+# without a cache directory.
+MAX_MEMO_SIZE = 2 ** 20 # 1 MiB
+MAX_MEMO_TOTAL = 2 ** 24 # 16 MiB
+
+# The total size of the entries is kept in this file within the cache
+# directory, so that it need not be walked to find out.
+SIZE_INDEX = 'size'
+
+_lock = threading.Lock()
+_memo = collections.OrderedDict()
+_memo_size = 0
+
+# The key and shape of each Difference that was stored in, or loaded from,
+# the cache. The entry for a container refers to those of its members rather
+# than repeating them, unless they were modified afterwards.
+_keys = weakref.WeakKeyDictionary()
+
+
+def is_cacheable(file1, file2):
+    if Config().cache_dir is None:
+        return False
+
+    for x in (file1, file2):
+        if x.is_directory() or x.is_symlink() or x.is_device():
+            return False
+        if not os.path.isfile(x.path):
+            return False
+
+    return True
+
+
+def comparator_name(file):
+    # specialize() creates subclasses on the fly; use the first "real" class
+    for x in type(file).__mro__:
+        if x.__module__.startswith('diffoscope.'):
+            return '{}.{}'.format(x.__module__, x.__name__)
+    return type(file).__name__
+
+
+def cache_key(file1, file2, source=None):
+    # The maximum container depth only matters relative to how deeply
+    # nested we already are.
+    depth = 0
+    if file1.container is not None:
+        depth = file1.container.depth + 1
+
+    # Some members (eg. ELF sections) are not backed by their own content so
+    # also key on the name. Only use the basename so that results can be
+    # shared between, for example, different build directories.
+    config = Config()
+    material = json.dumps([
+        VERSION,
+        comparator_name(file1),
+        file1.digest,
+        file2.digest,
+        os.path.basename(file1.name),
+        os.path.basename(file2.name),
+        source,
+        config.max_container_depth - depth,
+        tlsh is not None,
+        [getattr(config, x) for x in CONFIG_KEYS],
+    ], sort_keys=True)
+
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def cache_path(key, suffix='.json'):
+    return os.path.join(Config().cache_dir, key[:2], key + suffix)
+
+
+def to_dict(difference, refer=None):
+    """
+    Serialise `difference`. If given, `refer` may return a replacement for
+    any of its details, such as a reference to where it is stored already.
+    """
+
+    unified_diff = difference.unified_diff
+    if unified_diff is not None:
+        unified_diff = str(unified_diff)
+
+    return {
+        'source1': difference.source1,
+        'source2': difference.source2,
+        'unified_diff': unified_diff,
+        'comments': difference.comments,
+        'has_internal_linenos': difference.has_internal_linenos,
+        'visuals': [
+            [x.data_type, x.content, x.source] for x in difference.visuals
+        ],
+        'details': [
+            (refer and refer(x)) or to_dict(x, refer)
+            for x in difference.details
+        ],
+    }
+
+
+def from_dict(raw, resolve=None):
+    """
+    The inverse of to_dict. Details replaced by `refer` are passed to
+    `resolve`.
+    """
+
+    difference = Difference(
+        raw['unified_diff'],
+        raw['source1'],
+        raw['source2'],
+        comment=raw['comments'],
+        has_internal_linenos=raw['has_internal_linenos'],
+        details=[
+            resolve(x) if 'ref' in x else from_dict(x, resolve)
+            for x in raw['details']
+        ],
+    )
+    difference.add_visuals([VisualDifference(*x) for x in raw['visuals']])
+
+    return difference
+
+
+def shape(difference):
+    return (
+        len(difference.comments),
+        len(difference.details),
+        len(difference.visuals),
+    )
+
+
+def remember(key, difference):
+    with _lock:
+        _keys[difference] = (key, shape(difference))
+
+
+def refer(difference):
+    with _lock:
+        key, expected = _keys.get(difference, (None, None))
+    if key is None or shape(difference) != expected:
+        return None
+
+    return {'ref': key, 'names': [difference.source1, difference.source2]}
+
+
+def load(key, names, exact=False):
+    """
+    Returns the difference stored under `key`, raising KeyError if there is
+    none. Top-level sources matching the names the entry was stored under are
+    replaced by `names`, as the same content may be compared under different
+    names. If `exact`, `names` are the sources to use regardless.
+    """
+
+    path = cache_path(key)
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            raw = json.load(f)
+        # Mark as recently used for the purposes of eviction
+        os.utime(path)
+    except (OSError, ValueError):
+        raise KeyError(key)
+
+    top = raw['difference']
+    if top is None:
+        return None
+
+    for name, x, new in zip(raw['names'], ('source1', 'source2'), names):
+        if exact or top[x] == name:
+            top[x] = new
+
+    difference = from_dict(top, resolve)
+    remember(key, difference)
+
+    return difference
+
+
+def resolve(raw):
+    # The entry is only complete if every member it refers to is still there
+    difference = load(raw['ref'], raw['names'], exact=True)
+    if difference is None:
+        raise KeyError(raw['ref'])
+
+    return difference
+
+
+def lookup(key, file1, file2):
+    """
+    Returns a tuple of (hit, difference).
+    """
+
+    try:
+        difference = load(key, (file1.name, file2.name))
+    except KeyError:
+        return False, None
+
+    logger.debug("Cache hit for %s and %s (%s)", file1.name, file2.name, key)
+
+    return True, difference
+
+
+def store(key, file1, file2, difference, degraded=lambda: False):
+    path = cache_path(key)
+    data = json.dumps({
+        'names': [file1.name, file2.name],
+        'difference': to_dict(difference, refer) if difference else None,
+    }).encode('utf-8')
+
+    # Only known now that any lazy details have been computed
+    if degraded():
+        logger.debug("Not caching degraded comparison as %s", key)
+        return
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write atomically as the cache may be shared between processes
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path),
+            suffix='.tmp',
+            delete=False,
+        ) as f:
+            f.write(data)
+        replaced = replace(f.name, path)
+    except OSError as e:
+        logger.warning("Unable to write to cache %s: %s", path, e)
+        return
+
+    logger.debug("Stored %d bytes in cache as %s", len(data), key)
+
+    if difference is not None:
+        remember(key, difference)
+
+    add_size(len(data) - replaced)
+
+
+def replace(src, dst):
+    """
+    Rename `src` to `dst`, returning the size of any entry that was there.
+    """
+
+    try:
+        size = os.path.getsize(dst)
+    except OSError:
+        size = 0
+    os.replace(src, dst)
+    return size
+
+
+def entries():
+    for dirpath, _, filenames in os.walk(Config().cache_dir):
+        for x in filenames:
+            if not x.endswith(('.json', '.out')):
+                continue
+            path = os.path.join(dirpath, x)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            yield st.st_mtime, st.st_size, path
+
+
+def add_size(size):
+    """
+    Account for `size` more bytes having just been written to the cache,
+    evicting the least recently used entries if it is now too large.
+    """
+
+    path = os.path.join(Config().cache_dir, SIZE_INDEX)
+
+    try:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    except OSError as e:
+        logger.warning("Unable to open cache index %s: %s", path, e)
+        return
+
+    with _lock, os.fdopen(fd, 'r+') as f:
+        # The cache may be shared between processes
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+        try:
+            total = int(f.read()) + size
+        except ValueError:
+            # A new index; the entry just written is already counted
+            total = sum(x[1] for x in entries())
+
+        total = evict(total)
+
+        f.seek(0)
+        f.truncate()
+        f.write('{}\n'.format(total))
+
+
+def evict(total):
+    max_size = Config().max_cache_size
+
+    if total <= max_size:
+        return total
+
+    # Evict least recently used entries until we are comfortably below the
+    # limit so that we don't need to do this on every store.
+    target = max_size * 0.9
+    logger.debug("Cache is %d bytes; evicting to %d", total, target)
+
+    for _, x, path in sorted(entries()):
+        if total <= target:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= x
+
+    return total
+
+
+def cached_compare(file1, file2, source=None):
+    if not is_cacheable(file1, file2):
+        return file1.compare(file2, source)
+
+    key = cache_key(file1, file2, source)
+    hit, difference = lookup(key, file1, file2)
+    if hit:
+        return difference
+
+    with degradable() as degraded:
+        difference = file1.compare(file2, source)
+        # Storing the outermost comparison when streaming would compute all
+        # its details up front and keep them in memory. Its members are
+        # still stored as they are compared.
+        if difference is not None and difference.has_lazy_details():
+            logger.debug("Not caching streamed comparison as %s", key)
+            return difference
+        store(key, file1, file2, difference, degraded)
+
+    return difference
+
+
+def command_material(command):
+    # Only use the basename of the input, as for comparisons. The tool's
+    # executable stands in for its version as not every tool can report one.
+    tool = find_executable(command.cmdline()[0])
+    if tool is None:
+        raise RequiredToolNotFound(command.cmdline()[0])
+    st = os.stat(tool)
+
+    return [
+        VERSION,
+        comparator_name(command),
+        command.shell_cmdline(),
+        os.path.basename(command.path),
+        [tool, st.st_size, st.st_mtime_ns],
+        Config().max_diff_input_lines,
+    ]
+
+
+def command_cache_key(command):
+    material = json.dumps(
+        command_material(command) + [path_digest(command.path)],
+    )
+
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def lookup_command(key):
+    """
+    Returns a tuple of (end_nl, stderr, file) for a cached command output,
+    with `file` positioned at the start of the output, or None.
+    """
+
+    path = cache_path(key, '.out')
+
+    try:
+        f = open(path, 'rb')
+    except OSError:
+        return None
+
+    try:
+        raw = json.loads(f.readline().decode('utf-8'))
+        os.utime(path)
+    except (OSError, ValueError):
+        f.close()
+        return None
+
+    logger.debug("Cache hit for command output %s", key)
+
+    return raw['end_nl'], raw['stderr'].encode('utf-8', 'surrogateescape'), f
+
+
+def memoize_command(memo_key, end_nl, stderr, data):
+    global _memo_size
+
+    with _lock:
+        if memo_key in _memo:
+            return
+        _memo[memo_key] = (end_nl, stderr, data)
+        _memo_size += len(data)
+        while _memo_size > MAX_MEMO_TOTAL:
+            _, (_, _, x) = _memo.popitem(last=False)
+            _memo_size -= len(x)
+
+
+def store_command(key, end_nl, stderr, spool):
+    path = cache_path(key, '.out')
+    header = json.dumps({
+        'end_nl': end_nl,
+        'stderr': stderr.decode('utf-8', 'surrogateescape'),
+    }).encode('utf-8') + b'\n'
+
+    spool.seek(0)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path),
+            suffix='.tmp',
+            delete=False,
+        ) as f:
+            f.write(header)
+            shutil.copyfileobj(spool, f, feeders.READ_BLOCK)
+            size = f.tell()
+        replaced = replace(f.name, path)
+    except OSError as e:
+        logger.warning("Unable to write to cache %s: %s", path, e)
+        return
+
+    logger.debug("Stored %d bytes of command output in cache as %s", size, key)
+
+    add_size(size - replaced)
+
+
+class CommandRecorder(object):
+    """
+    Passes output through to `out_file` while keeping a copy in `spool`,
+    giving up on the copy if it grows beyond `max_size`.
+    """
+
+    def __init__(self, out_file, spool, max_size=float('inf')):
+        self.out_file = out_file
+        self.spool = spool
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, data):
+        self.out_file.write(data)
+        if self.spool is None:
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.spool = None
+            return
+        self.spool.write(data)
+
+
+def replay(f, end_nl):
+    def feeder(out_file):
+        with f:
+            for buf in iter(lambda: f.read(feeders.READ_BLOCK), b''):
+                out_file.write(buf)
+        return end_nl
+    return feeder
+
+
+def command_feeder(command):
+    """
+    Returns a feeder for the output of `command`. If the same command was
+    already run on the same content, earlier in this run or in an earlier
+    one sharing the cache directory, its output is replayed rather than
+    running it again. Otherwise `command` is started and its output is
+    recorded as it is fed.
+    """
+
+    try:
+        st = os.stat(command.path)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        command.start()
+        return feeders.from_command(command)
+
+    memo_key = digest_key(command.path, st) + (
+        json.dumps(command_material(command)),
+    )
+    with _lock:
+        hit = _memo.get(memo_key)
+        if hit is not None:
+            _memo.move_to_end(memo_key)
+    if hit is not None:
+        end_nl, stderr, data = hit
+        command.replay(stderr)
+        return replay(io.BytesIO(data), end_nl)
+
+    key = None
+    if Config().cache_dir is not None:
+        key = command_cache_key(command)
+        hit = lookup_command(key)
+        if hit is not None:
+            end_nl, stderr, f = hit
+            command.replay(stderr)
+            return replay(f, end_nl)
+
+    command.start()
+    feeder = feeders.from_command(command)
+
+    def recording_feeder(out_file):
+        if key is None:
+            spool = io.BytesIO()
+            max_size = MAX_MEMO_SIZE
+        else:
+            spool = tempfile.SpooledTemporaryFile(MAX_MEMO_SIZE)
+            max_size = float('inf')
+
+        with spool:
+            recorder = CommandRecorder(out_file, spool, max_size)
+            end_nl = feeder(recorder)
+            if recorder.spool is None:
+                return end_nl
+
+            stderr = command.stderr.getvalue()
+            if recorder.size <= MAX_MEMO_SIZE:
+                spool.seek(0)
+                memoize_command(memo_key, end_nl, stderr, spool.read())
+            if key is not None:
+                store_command(key, end_nl, stderr, spool)
+
+        return end_nl
+
+    return recording_feeder
+
+
+def command_output(command):
+    """
+    Returns the output of `command` as it would be fed to diff, sharing
+    earlier or later runs of the same command through the cache.
+    """
+
+    buf = io.BytesIO()
+    with limit_processes(
+        1,
+        os.path.basename(command.cmdline()[0]),
+        command.MAX_PROCESSES,
+    ):
+        command_feeder(command)(buf)
+    return buf.getvalue()
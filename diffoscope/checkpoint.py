@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import logging
+import threading
+import contextlib
+
+from . import VERSION
+from .cache import CONFIG_KEYS, to_dict, from_dict
+from .config import Config
+from .executor import degradable
+
+CHECKPOINT_FORMAT_VERSION = 1
+CHECKPOINT_FORMAT_MAGIC = "diffoscope-checkpoint-version"
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_journal = None
+
+
+def identify(path):
+    # Changes deep within a directory are not noticed as that would mean
+    # reading all of it again.
+    st = os.stat(path)
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+def header(path1, path2):
+    config = Config()
+    return {
+        CHECKPOINT_FORMAT_MAGIC: CHECKPOINT_FORMAT_VERSION,
+        'version': VERSION,
+        'inputs': [identify(path1), identify(path2)],
+        'config': [getattr(config, x) for x in CONFIG_KEYS] +
+                  [config.max_container_depth],
+    }
+
+
+class Journal(object):
+    """
+    An append-only record of the results of comparing the members of the
+    outermost container, so that an interrupted comparison of the same
+    inputs can carry on from where it left off.
+
+    The file holds one JSON object per line. The first identifies the inputs
+    and the configuration; each of the rest is the (serialised) Difference
+    for one pair of members, or null if they did not differ.
+    """
+
+    def __init__(self, path, path1, path2):
+        self.path = path
+        self.claimed = False
+        self.done = {}
+        self.lock = threading.Lock()
+
+        expected = json.loads(json.dumps(header(path1, path2)))
+        offset = self.load(expected)
+
+        if offset:
+            logger.info(
+                "Resuming from checkpoint %s; %d member(s) already compared",
+                path,
+                len(self.done),
+            )
+            self.fileobj = open(path, 'r+b')
+            # Drop anything partially written when we were interrupted
+            self.fileobj.truncate(offset)
+            self.fileobj.seek(offset)
+        else:
+            self.fileobj = open(path, 'wb')
+            self.write(expected)
+
+    def load(self, expected):
+        """
+        Read the results of a previous run into `self.done`, returning the
+        offset just after the last complete entry, or 0 if the journal does
+        not exist or was for different inputs.
+        """
+
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return 0
+
+        with f:
+            try:
+                if json.loads(f.readline().decode('utf-8')) != expected:
+                    raise ValueError()
+            except ValueError:
+                logger.warning(
+                    "Ignoring checkpoint %s as it is for different inputs "
+                    "or settings",
+                    self.path,
+                )
+                return 0
+
+            offset = f.tell()
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    raw = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                self.done[tuple(raw['members'])] = raw['difference']
+                offset += len(line)
+
+        return offset
+
+    def write(self, raw):
+        data = (json.dumps(raw) + '\n').encode('utf-8')
+
+        with self.lock:
+            self.fileobj.write(data)
+            self.fileobj.flush()
+            # We are most likely to be needed after the machine goes away
+            os.fsync(self.fileobj.fileno())
+
+    def lookup(self, key):
+        """
+        Returns a tuple of (hit, difference).
+        """
+
+        try:
+            raw = self.done[key]
+        except KeyError:
+            return False, None
+
+        logger.debug("Checkpoint hit for %s", key)
+
+        if raw is None:
+            return True, None
+
+        return True, from_dict(raw)
+
+    def store(self, key, difference):
+        self.write({
+            'members': key,
+            'difference': to_dict(difference) if difference else None,
+        })
+
+    def close(self):
+        self.fileobj.close()
+
+
+@contextlib.contextmanager
+def journal(path1, path2):
+    """
+    Record the progress of comparing `path1` and `path2` in the file named
+    by Config().checkpoint, if any, resuming from it if possible.
+    """
+
+    global _journal
+
+    if Config().checkpoint is None:
+        yield
+        return
+
+    _journal = Journal(Config().checkpoint, path1, path2)
+    try:
+        yield
+    finally:
+        _journal.close()
+        _journal = None
+
+
+def journalled(compare_pair):
+    """
+    Wrap the `compare_pair` function of a Container.compare so that pairs of
+    members are looked up in and recorded to the checkpoint journal.
+
+    Only the first container to be compared, ie. the outermost one, uses
+    the journal; nested containers are compared as part of its members.
+    """
+
+    with _lock:
+        if _journal is None or _journal.claimed:
+            return compare_pair
+        _journal.claimed = True
+        journal = _journal
+
+    def fn(file1, file2, *args):
+        key = (file1.name, file2.name) + args
+
+        hit, difference = journal.lookup(key)
+        if hit:
+            return difference
+
+        with degradable() as degraded:
+            difference = compare_pair(file1, file2, *args)
+        if degraded():
+            logger.debug("Not journalling degraded comparison of %s", key)
+        else:
+            journal.store(key, difference)
+
+        return difference
+
+    return fn
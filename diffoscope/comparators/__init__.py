@@ -19,7 +19,10 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
+import sys
 import logging
+import threading
 import importlib
 
 logger = logging.getLogger(__name__)
@@ -90,19 +93,145 @@ class ComparatorManager(object):
         ('ogg.OggFile',),
     )
 
+    # What a file must look like for each of the above to recognize it, so
+    # that their modules are only imported once a file might match:
+    #
+    #   suffix:        the name ends with this
+    #   header_prefix: the first bytes of the file are these
+    #   file_type_re:  libmagic's description of the file matches this
+    #   if_imported:   the module was imported for another comparator
+    #
+    # As in File.recognizes, "suffix" must hold and then either of
+    # "header_prefix" or "file_type_re". These must agree with the
+    # FILE_EXTENSION_SUFFIX, FILE_TYPE_HEADER_PREFIX and FILE_TYPE_RE of the
+    # classes themselves. Comparators not listed here are imported as soon
+    # as specialize() needs to try them.
+    RECOGNIZES = {
+        'debian.DotChangesFile': {'suffix': '.changes'},
+        'debian.DotDscFile': {'suffix': '.dsc'},
+        'debian.DotBuildinfoFile': {'suffix': '.buildinfo'},
+        'deb.Md5sumsFile': {'if_imported': True},
+        'deb.DebDataTarFile': {'if_imported': True},
+        'elf.ElfSection': {'if_imported': True},
+        'ps.PsFile': {'file_type_re': r'^PostScript document\b'},
+        'javascript.JavaScriptFile': {'suffix': '.js'},
+        'json.JSONFile': {'suffix': '.json'},
+        'xml.XMLFile': {'suffix': '.xml'},
+        'text.TextFile': {'file_type_re': r'\btext\b'},
+        'bzip2.Bzip2File': {'file_type_re': r'^bzip2 compressed data\b'},
+        'cpio.CpioFile': {'file_type_re': r'\bcpio archive\b'},
+        'deb.DebFile': {'file_type_re': r'^Debian binary package'},
+        'dex.DexFile': {'file_type_re': r'^Dalvik dex file .*\b'},
+        'elf.ElfFile': {'file_type_re': r'^ELF '},
+        'macho.MachoFile': {'file_type_re': r'^Mach-O '},
+        'fsimage.FsImageFile': {'file_type_re': r'^(Linux.*filesystem data|BTRFS Filesystem).*'},
+        'elf.StaticLibFile': {'suffix': '.a', 'file_type_re': r'\bar archive\b'},
+        'llvm.LlvmBitCodeFile': {'file_type_re': r'^LLVM IR bitcode'},
+        'sqlite.Sqlite3Database': {'file_type_re': r'^SQLite 3.x database'},
+        'fonts.TtfFile': {'file_type_re': r'^(TrueType|OpenType) font data$'},
+        'fontconfig.FontconfigCacheFile': {'suffix': '-le64.cache-4', 'header_prefix': b'\x04\xfc'},
+        'gettext.MoFile': {'file_type_re': r'^GNU message catalog\b'},
+        'ipk.IpkFile': {'suffix': '.ipk', 'file_type_re': r'^gzip compressed data\b'},
+        'rust.RustObjectFile': {'suffix': '.deflate', 'header_prefix': b'RUST_OBJECT\x01\x00\x00\x00'},
+        'gzip.GzipFile': {'file_type_re': r'^gzip compressed data\b'},
+        'icc.IccFile': {'file_type_re': r'\bColorSync (ICC|color) [Pp]rofile'},
+        'java.ClassFile': {'file_type_re': r'^compiled Java class data\b'},
+        'mono.MonoExeFile': {'file_type_re': r'\bPE[0-9]+\b.*\bMono\b'},
+        'pdf.PdfFile': {'file_type_re': r'^PDF document\b'},
+        'png.PngFile': {'file_type_re': r'^PNG image data\b'},
+        'ppu.PpuFile': {'suffix': '.ppu'},
+        'rdata.RdbFile': {'suffix': '.rdb'},
+        'rdata.RdsFile': {'header_prefix': b'X\n\x00\x00\x00\x02\x00\x03'},
+        'rpm.RpmFile': {'file_type_re': r'^RPM\s'},
+        'squashfs.SquashfsFile': {'file_type_re': r'^Squashfs filesystem\b'},
+        'ar.ArFile': {'file_type_re': r'\bar archive\b'},
+        'tar.TarFile': {'file_type_re': r'\btar archive\b'},
+        'xz.XzFile': {'file_type_re': r'^XZ compressed data$'},
+        'apk.ApkFile': {'suffix': '.apk', 'header_prefix': b'PK\x03\x04', 'file_type_re': r'^(Java|Zip) archive data.*\b'},
+        'odt.OdtFile': {'file_type_re': r'^OpenDocument Text\b'},
+        'docx.DocxFile': {'file_type_re': r'^Microsoft Word 2007+\b'},
+        'zip.ZipFile': {'file_type_re': r'^(Zip archive|Java archive|EPUB document|OpenDocument (Text|Spreadsheet|Presentation|Drawing|Formula|Template|Text Template))\b'},
+        'image.JPEGImageFile': {'file_type_re': r'\bJPEG image data\b'},
+        'image.ICOImageFile': {'file_type_re': r'\bMS Windows icon resource\b'},
+        'git.GitIndexFile': {'file_type_re': r'^Git index'},
+        'openssh.PublicKeyFile': {'file_type_re': r'^OpenSSH \S+ public key'},
+        'gif.GifFile': {'file_type_re': r'^GIF image data\b'},
+        'pcap.PcapFile': {'file_type_re': r'^tcpdump capture file\b'},
+        'pgp.PgpFile': {'file_type_re': r'^PGP message\b'},
+        'dtb.DeviceTreeFile': {'file_type_re': r'^Device Tree Blob'},
+        'ogg.OggFile': {'file_type_re': r'^Ogg data'},
+    }
+
     _singleton = {}
+    _lock = threading.Lock()
 
     def __init__(self):
         self.__dict__ = self._singleton
 
-        if not self._singleton:
-            self.reload()
+        # Ensure other threads do not see a partially-populated list
+        with self._lock:
+            if not self._singleton:
+                self.reload()
 
     def reload(self):
-        self.classes = []
+        self.comparators = [
+            Comparator(xs, **self.RECOGNIZES.get(xs[0], {}))
+            for xs in self.COMPARATORS
+        ]
+
+    def load_all(self):
+        """
+        Imports the modules of all comparators, returning their classes.
+        """
+        classes = [x.load() for x in self.comparators]
+
+        logger.debug("Loaded %d comparator classes", len(classes))
+
+        return classes
+
+
+class Comparator(object):
+    """
+    A comparator class, whose module is only imported on demand.
+    """
+
+    def __init__(self, names, suffix=None, header_prefix=None,
+                 file_type_re=None, if_imported=False):
+        self.names = names
+        self.suffix = suffix
+        self.header_prefix = header_prefix
+        self.file_type_re = file_type_re and re.compile(file_type_re)
+        self.if_imported = if_imported
+        self.cls = None
+        self._exact = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Comparator %s>' % self.names[0]
 
-        for xs in self.COMPARATORS:
-            for x in xs:
+    @property
+    def indexed(self):
+        return bool(self.suffix or self.header_prefix or self.file_type_re)
+
+    def imported(self):
+        """
+        Returns the class if its module has already been imported, without
+        importing anything.
+        """
+        if self.cls is None:
+            package, klass_name = self.names[0].rsplit('.', 1)
+            mod = sys.modules.get('diffoscope.comparators.{}'.format(package))
+            # The module may still be being imported by another thread, in
+            # which case there cannot be any instances yet either.
+            self.cls = getattr(mod, klass_name, None)
+        return self.cls
+
+    def load(self):
+        with self._lock:
+            if self.cls is not None:
+                return self.cls
+
+            for x in self.names:
                 package, klass_name = x.rsplit('.', 1)
 
                 try:
@@ -112,11 +241,32 @@ class ComparatorManager(object):
                 except ImportError:
                     continue
 
-                self.classes.append(getattr(mod, klass_name))
+                self.cls = getattr(mod, klass_name)
                 break
             else:  # noqa
                 raise ImportError(
-                    "Could not import any of {}".format(', '.join(xs))
+                    "Could not import any of {}".format(', '.join(self.names))
                 )
 
-        logger.debug("Loaded %d comparator classes", len(self.classes))
+        return self.cls
+
+    @property
+    def exact(self):
+        """
+        Whether the class uses File.recognizes with exactly the tests we
+        describe, so that it need not be called once those have passed.
+        """
+        if self._exact is None:
+            from .utils.file import File
+
+            cls = self.load()
+
+            def pattern(x):
+                return x and (x.pattern, x.flags)
+
+            self._exact = getattr(cls.recognizes, '__func__', None) is \
+                File.recognizes.__func__ and \
+                cls.FILE_EXTENSION_SUFFIX == self.suffix and \
+                cls.FILE_TYPE_HEADER_PREFIX == self.header_prefix and \
+                pattern(cls.FILE_TYPE_RE) == pattern(self.file_type_re)
+        return self._exact
@@ -23,6 +23,7 @@ import logging
 import subprocess
 
 from diffoscope.tools import tool_required
+from diffoscope.executor import limit_processes
 from diffoscope.tempfiles import get_temporary_directory
 from diffoscope.difference import Difference
 
@@ -32,6 +33,9 @@ from .utils.compare import compare_files
 from .zip import Zipinfo, ZipinfoVerbose
 from .missing_file import MissingFile
 
+# apktool starts a JVM, so don't run many at once
+MAX_APKTOOL_PROCESSES = 2
+
 logger = logging.getLogger(__name__)
 
 
@@ -52,9 +56,10 @@ class ApkContainer(Archive):
 
         logger.debug("Extracting %s to %s", self.source.name, self._unpacked)
 
-        subprocess.check_call((
-            'apktool', 'd', '-k', '-m', '-o', self._unpacked, self.source.path,
-        ), shell=False, stderr=None, stdout=subprocess.PIPE)
+        with limit_processes(1, 'apktool', MAX_APKTOOL_PROCESSES):
+            subprocess.check_call((
+                'apktool', 'd', '-k', '-m', '-o', self._unpacked, self.source.path,
+            ), shell=False, stderr=None, stdout=subprocess.PIPE)
 
         for root, _, files in os.walk(self._unpacked):
             current_dir = []
@@ -24,20 +24,37 @@ from .utils.file import File
 
 
 class FilesystemFile(File):
-    def __init__(self, path, container=None):
+    def __init__(self, path, container=None, lstat=None):
         super().__init__(container=container)
         self._name = path
+        self._lstat = lstat
 
     @property
     def path(self):
         return self._name
 
+    def lstat(self):
+        """
+        os.lstat() of the file, remembered after the first call. A caller
+        that already knows it may pass it to the constructor.
+        """
+
+        if self._lstat is None:
+            self._lstat = os.lstat(self._name)
+        return self._lstat
+
     def is_directory(self):
-        return not os.path.islink(self._name) and os.path.isdir(self._name)
+        try:
+            return stat.S_ISDIR(self.lstat().st_mode)
+        except OSError:
+            return False
 
     def is_symlink(self):
-        return os.path.islink(self._name)
+        try:
+            return stat.S_ISLNK(self.lstat().st_mode)
+        except OSError:
+            return False
 
     def is_device(self):
-        mode = os.lstat(self._name).st_mode
+        mode = self.lstat().st_mode
         return stat.S_ISCHR(mode) or stat.S_ISBLK(mode)
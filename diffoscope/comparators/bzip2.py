@@ -23,6 +23,7 @@ import logging
 import subprocess
 
 from diffoscope.tools import tool_required
+from diffoscope.executor import check_call
 
 from .utils.file import File
 from .utils.archive import Archive
@@ -45,7 +46,7 @@ class Bzip2Container(Archive):
         dest_path = os.path.join(dest_dir, member_name)
         logger.debug('bzip2 extracting to %s', dest_path)
         with open(dest_path, 'wb') as fp:
-            subprocess.check_call(
+            check_call(
                 ["bzip2", "--decompress", "--stdout", self.source.path],
                 shell=False, stdout=fp, stderr=subprocess.PIPE)
         return dest_path
@@ -23,6 +23,7 @@ import logging
 import subprocess
 
 from diffoscope.tools import tool_required
+from diffoscope.executor import check_call
 
 from .utils.file import File
 from .utils.archive import Archive
@@ -48,7 +49,7 @@ class DexContainer(Archive):
     def extract(self, member_name, dest_dir):
         dest_path = os.path.join(dest_dir, member_name)
         logger.debug('dex extracting to %s', dest_path)
-        subprocess.check_call(['enjarify', '-o', dest_path, self.source.path],
+        check_call(['enjarify', '-o', dest_path, self.source.path],
             shell=False, stderr=None, stdout=subprocess.PIPE)
         return dest_path
 
@@ -18,88 +18,139 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
-import re
+import grp
+import pwd
+import sys
+import time
+import stat
+import fcntl
+import struct
 import logging
+import functools
 import subprocess
 import collections
-import itertools
 
 from diffoscope.exc import RequiredToolNotFound
 from diffoscope.tools import tool_required
 from diffoscope.config import Config
-from diffoscope.progress import Progress
+from diffoscope.checkpoint import journalled
 from diffoscope.difference import Difference
+from diffoscope.executor import check_output
 
 from .binary import FilesystemFile
 from .utils.command import Command
-from .utils.container import Container
+from .utils.container import Container, map_comparisons, \
+    claim_streaming, add_member_details, ComparisonsProgress
 
 logger = logging.getLogger(__name__)
 
 
+def join(*parts):
+    # Unlike os.path.join, an empty root does not add a trailing slash
+    return '/'.join(x for x in parts if x)
+
+
+class DirectoryWalk(object):
+    """
+    A single os.scandir() traversal of a directory tree, shared by the file
+    list, the progress sizes and the metadata of everything below it. The
+    lstat() result of each entry is kept so nothing is stat'd twice.
+
+    Directories are only scanned once something asks for their contents.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.realpath(path)
+        self._members = {}
+        self._stats = {}
+
+    def members(self, relpath=''):
+        """
+        The sorted names in the directory at `relpath`, which is relative to
+        the root of the walk.
+        """
+
+        try:
+            return self._members[relpath]
+        except KeyError:
+            pass
+
+        names = []
+        for entry in os.scandir(os.path.join(self.path, relpath)):
+            names.append(entry.name)
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            self._stats[join(relpath, entry.name)] = st
+        names.sort()
+
+        self._members[relpath] = names
+        return names
+
+    def stat(self, relpath=''):
+        try:
+            return self._stats[relpath]
+        except KeyError:
+            pass
+
+        st = os.lstat(os.path.join(self.path, relpath))
+        self._stats[relpath] = st
+        return st
+
+    def is_directory(self, relpath):
+        try:
+            return stat.S_ISDIR(self.stat(relpath).st_mode)
+        except OSError:
+            return False
+
+    def list_files(self, relpath=''):
+        """
+        Like list_files() below, for the directory at `relpath`.
+        """
+
+        all_files = []
+        pending = ['']
+        while pending:
+            root = pending.pop()
+            try:
+                names = self.members(join(relpath, root))
+            except OSError:
+                # Like os.walk, skip directories that cannot be read
+                continue
+            for name in names:
+                all_files.append(join(root, name))
+                if self.is_directory(join(relpath, root, name)):
+                    pending.append(join(root, name))
+        all_files.sort()
+        return all_files
+
+
 def list_files(path):
-    path = os.path.realpath(path)
-    all_files = []
-    for root, dirs, names in os.walk(path):
-        all_files.extend([os.path.join(root[len(path) + 1:], dir) for dir in dirs])
-        all_files.extend([os.path.join(root[len(path) + 1:], name) for name in names])
-    all_files.sort()
-    return all_files
-
-
-if os.uname()[0] == 'FreeBSD':
-    class Stat(Command):
-        @tool_required('stat')
-        def cmdline(self):
-            return [
-                'stat',
-                '-t', '%Y-%m-%d %H:%M:%S',
-                '-f', '%Sp %l %Su %Sg %z %Sm %k %b %#Xf',
-                self.path,
-            ]
-else:
-    class Stat(Command):
-        @tool_required('stat')
-        def cmdline(self):
-            return ['stat', self.path]
-
-        FILE_RE = re.compile(r'^\s*File:.*$')
-        DEVICE_RE = re.compile(r'Device: [0-9a-f]+h/[0-9]+d\s+')
-        INODE_RE = re.compile(r'Inode: [0-9]+\s+')
-        ACCESS_TIME_RE = re.compile(r'^Access: [0-9]{4}-[0-9]{2}-[0-9]{2}.*$')
-        CHANGE_TIME_RE = re.compile(r'^Change: [0-9]{4}-[0-9]{2}-[0-9]{2}.*$')
-
-        def filter(self, line):
-            line = line.decode('utf-8')
-            line = Stat.FILE_RE.sub('', line)
-            line = Stat.DEVICE_RE.sub('', line)
-            line = Stat.INODE_RE.sub('', line)
-            line = Stat.ACCESS_TIME_RE.sub('', line)
-            line = Stat.CHANGE_TIME_RE.sub('', line)
-            return line.encode('utf-8')
+    return DirectoryWalk(path).list_files()
 
 
-@tool_required('lsattr')
-def lsattr(path):
+class Stat(Command):
     """
-    NB. Difficult to replace with in-Python version. See
-    <https://stackoverflow.com/questions/35501249/python-get-linux-file-immutable-attribute/38092961#38092961>
+    Only used on FreeBSD; elsewhere see stat() below.
     """
 
-    try:
-        output = subprocess.check_output(
-            ['lsattr', '-d', path],
-            shell=False,
-            stderr=subprocess.STDOUT,
-        ).decode('utf-8')
-        return output.split()[0]
-    except subprocess.CalledProcessError as e:
-        if e.returncode == 1:
-            # filesystem doesn't support xattrs
-            return ''
+    @tool_required('stat')
+    def cmdline(self):
+        return [
+            'stat',
+            '-t', '%Y-%m-%d %H:%M:%S',
+            '-f', '%Sp %l %Su %Sg %z %Sm %k %b %#Xf',
+            self.path,
+        ]
 
 
 class Getfacl(Command):
+    """
+    Only used where ACLs cannot be read as extended attributes; elsewhere see
+    getfacl() below.
+    """
+
     @tool_required('getfacl')
     def cmdline(self):
         osname = os.uname()[0]
@@ -108,7 +159,288 @@ class Getfacl(Command):
         return ['getfacl', '-p', '-c', self.path]
 
 
-def compare_meta(path1, path2):
+@functools.lru_cache()
+def user_name(uid, default=None):
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid) if default is None else default
+
+
+@functools.lru_cache()
+def group_name(gid, default=None):
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid) if default is None else default
+
+
+def file_type(st):
+    # As printed by stat(1) for %F
+    if stat.S_ISREG(st.st_mode):
+        return 'regular empty file' if st.st_size == 0 else 'regular file'
+    for test, name in (
+        (stat.S_ISDIR, 'directory'),
+        (stat.S_ISLNK, 'symbolic link'),
+        (stat.S_ISBLK, 'block special file'),
+        (stat.S_ISCHR, 'character special file'),
+        (stat.S_ISFIFO, 'fifo'),
+        (stat.S_ISSOCK, 'socket'),
+    ):
+        if test(st.st_mode):
+            return name
+    return 'weird file'
+
+
+def format_time(ns):
+    t = time.localtime(ns // 10**9)
+    return '{}.{:09d} {}'.format(
+        time.strftime('%Y-%m-%d %H:%M:%S', t),
+        ns % 10**9,
+        time.strftime('%z', t),
+    )
+
+
+def stat_text(path, st=None):
+    """
+    The output of GNU stat(1), without the file name, device, inode, access
+    time and change time as these are expected to differ.
+    """
+
+    if st is None:
+        st = os.lstat(path)
+    mode = stat.filemode(st.st_mode)
+
+    links = 'Links: {}'.format(st.st_nlink)
+    if stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+        links = 'Links: {:<5} Device type: {:x},{:x}'.format(
+            st.st_nlink,
+            os.major(st.st_rdev),
+            os.minor(st.st_rdev),
+        )
+
+    return ''.join(x + '\n' for x in (
+        '',
+        '  Size: {:<10}\tBlocks: {:<10} IO Block: {:<6} {}'.format(
+            st.st_size,
+            st.st_blocks,
+            st.st_blksize,
+            file_type(st),
+        ),
+        links,
+        'Access: ({:04o}/{:10.10})  Uid: ({:5}/{:>8})   Gid: ({:5}/{:>8})'.format(
+            stat.S_IMODE(st.st_mode),
+            mode,
+            st.st_uid,
+            user_name(st.st_uid, 'UNKNOWN'),
+            st.st_gid,
+            group_name(st.st_gid, 'UNKNOWN'),
+        ),
+        '',
+        'Modify: {}'.format(format_time(st.st_mtime_ns)),
+        '',
+        ' Birth: -',
+    ))
+
+
+# Tags of entries in system.posix_acl_* extended attributes
+ACL_USER_OBJ, ACL_USER, ACL_GROUP_OBJ, ACL_GROUP, ACL_MASK, ACL_OTHER = \
+    0x01, 0x02, 0x04, 0x08, 0x10, 0x20
+ACL_TAG_NAMES = {
+    ACL_USER_OBJ: 'user',
+    ACL_USER: 'user',
+    ACL_GROUP_OBJ: 'group',
+    ACL_GROUP: 'group',
+    ACL_MASK: 'mask',
+    ACL_OTHER: 'other',
+}
+
+
+def read_acl(path, name):
+    """
+    Returns the (tag, perm, id) entries of an ACL stored in extended
+    attribute `name`, or None if there is no such ACL.
+    """
+
+    try:
+        data = os.getxattr(path, name)
+    except OSError:
+        return None
+
+    return list(struct.iter_unpack('<HHI', data[4:]))
+
+
+def format_perm(perm):
+    return ''.join(y if perm & x else '-' for x, y in ((4, 'r'), (2, 'w'), (1, 'x')))
+
+
+def format_acl(entries, prefix=''):
+    # As acl_to_any_text(3) with TEXT_SOME_EFFECTIVE | TEXT_SMART_INDENT
+    mask = None
+    for tag, perm, _ in entries:
+        if tag == ACL_MASK:
+            mask = perm
+
+    for tag, perm, id_ in entries:
+        qualifier = ''
+        if tag == ACL_USER:
+            qualifier = user_name(id_)
+        elif tag == ACL_GROUP:
+            qualifier = group_name(id_)
+
+        line = '{}{}:{}:{}'.format(
+            prefix,
+            ACL_TAG_NAMES[tag],
+            qualifier,
+            format_perm(perm),
+        )
+
+        if mask is not None and tag in (ACL_USER, ACL_GROUP_OBJ, ACL_GROUP) \
+                and perm & ~mask & 0o7:
+            col = len(line)
+            while True:
+                line += '\t'
+                col = (col + 8) & ~7
+                if col >= 32:
+                    break
+            line += '#effective:{}'.format(format_perm(perm & mask))
+
+        yield line
+
+
+def getfacl_text(path, st=None):
+    """
+    The output of `getfacl -p -c`, read from the system.posix_acl_* extended
+    attributes.
+    """
+
+    if st is None:
+        st = os.lstat(path)
+
+    entries = read_acl(path, 'system.posix_acl_access')
+    if entries is None:
+        # Without an ACL, getfacl shows what the permission bits imply
+        mode = st.st_mode
+        entries = [
+            (ACL_USER_OBJ, (mode >> 6) & 0o7, None),
+            (ACL_GROUP_OBJ, (mode >> 3) & 0o7, None),
+            (ACL_OTHER, mode & 0o7, None),
+        ]
+
+    lines = list(format_acl(entries))
+
+    if stat.S_ISDIR(st.st_mode):
+        entries = read_acl(path, 'system.posix_acl_default')
+        if entries:
+            lines.extend(format_acl(entries, 'default:'))
+
+    return ''.join(x + '\n' for x in lines) + '\n'
+
+
+def ioc_read(type_, nr, size):
+    """
+    The request number _IOR(type_, nr, size) from <linux/ioctl.h> for this
+    architecture, or None if we don't know how it is encoded here.
+    """
+
+    machine = os.uname().machine
+    if machine.startswith(('ppc', 'powerpc', 'mips', 'sparc', 'alpha')):
+        size_bits = 13
+    elif machine.startswith(('x86_64', 'i386', 'i486', 'i586', 'i686',
+                             'aarch64', 'arm', 's390', 'riscv', 'loongarch',
+                             'ia64')):
+        size_bits = 14
+    else:
+        return None
+
+    # _IOC_READ is 2 on both of the above
+    return 2 << (16 + size_bits) | size << 16 | ord(type_) << 8 | nr
+
+
+# Declared as _IOR('f', 1, long), although the kernel only ever reads and
+# writes an int.
+FS_IOC_GETFLAGS = ioc_read('f', 1, struct.calcsize('l'))
+
+# In the order lsattr(1) prints them
+LSATTR_FLAGS = (
+    (0x00000001, 's'),
+    (0x00000002, 'u'),
+    (0x00000008, 'S'),
+    (0x00010000, 'D'),
+    (0x00000010, 'i'),
+    (0x00000020, 'a'),
+    (0x00000040, 'd'),
+    (0x00000080, 'A'),
+    (0x00000004, 'c'),
+    (0x00000800, 'E'),
+    (0x00004000, 'j'),
+    (0x00001000, 'I'),
+    (0x00008000, 't'),
+    (0x00020000, 'T'),
+    (0x00080000, 'e'),
+    (0x00800000, 'C'),
+    (0x02000000, 'x'),
+    (0x40000000, 'F'),
+    (0x10000000, 'N'),
+    (0x20000000, 'P'),
+    (0x00100000, 'V'),
+    (0x00000400, 'm'),
+)
+
+
+def lsattr(path, st=None):
+    """
+    The flags as shown by `lsattr -d`, read with the FS_IOC_GETFLAGS ioctl.
+    Returns an empty string where lsattr would fail, eg. for devices or on
+    filesystems without such flags.
+    """
+
+    if st is None:
+        st = os.lstat(path)
+    if not stat.S_ISREG(st.st_mode) and not stat.S_ISDIR(st.st_mode):
+        return ''
+
+    if FS_IOC_GETFLAGS is None:
+        return lsattr_command(path)
+
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK | os.O_NOFOLLOW)
+    except OSError:
+        return ''
+
+    try:
+        buf = bytearray(struct.calcsize('I'))
+        fcntl.ioctl(fd, FS_IOC_GETFLAGS, buf)
+    except OSError:
+        return ''
+    finally:
+        os.close(fd)
+
+    flags, = struct.unpack('I', buf)
+
+    return ''.join(y if flags & x else '-' for x, y in LSATTR_FLAGS)
+
+
+@tool_required('lsattr')
+def lsattr_command(path):
+    try:
+        output = check_output(
+            ['lsattr', '-d', path],
+            shell=False,
+            stderr=subprocess.STDOUT,
+        ).decode('utf-8')
+        return output.split()[0]
+    except subprocess.CalledProcessError:
+        # eg. the filesystem doesn't support these flags
+        return ''
+
+
+def compare_meta(path1, path2, stat1=None, stat2=None):
+    """
+    `stat1` and `stat2` may be passed in when the lstat() results of the
+    paths are already known, eg. from a DirectoryWalk.
+    """
+
     if Config().exclude_directory_metadata:
         logger.debug("Excluding directory metadata for paths (%s, %s)", path1, path2)
         return []
@@ -116,28 +448,52 @@ def compare_meta(path1, path2):
     logger.debug('compare_meta(%s, %s)', path1, path2)
     differences = []
 
-    try:
-        differences.append(Difference.from_command(Stat, path1, path2))
-    except RequiredToolNotFound:
-        logger.error("Unable to find 'stat'! Is PATH wrong?")
-    if os.path.islink(path1) or os.path.islink(path2):
+    if stat1 is None:
+        stat1 = os.lstat(path1)
+    if stat2 is None:
+        stat2 = os.lstat(path2)
+
+    # Rather than running stat, getfacl and lsattr for each file we read the
+    # same information ourselves where we can, producing the same output.
+    if os.uname()[0] == 'FreeBSD':
+        try:
+            differences.append(Difference.from_command(Stat, path1, path2))
+        except RequiredToolNotFound:
+            logger.error("Unable to find 'stat'! Is PATH wrong?")
+    else:
+        differences.append(Difference.from_text(
+            stat_text(path1, stat1),
+            stat_text(path2, stat2),
+            path1,
+            path2,
+            source='stat {}',
+        ))
+    if stat.S_ISLNK(stat1.st_mode) or stat.S_ISLNK(stat2.st_mode):
         return [d for d in differences if d is not None]
-    try:
-        differences.append(Difference.from_command(Getfacl, path1, path2))
-    except RequiredToolNotFound:
-        logger.warning("Unable to find 'getfacl', some directory metadata differences might not be noticed.")
-    try:
-        lsattr1 = lsattr(path1)
-        lsattr2 = lsattr(path2)
+    if hasattr(os, 'getxattr'):
         differences.append(Difference.from_text(
-            lsattr1,
-            lsattr2,
+            getfacl_text(path1, stat1),
+            getfacl_text(path2, stat2),
             path1,
             path2,
-            source='lsattr',
+            source='getfacl -p -c {}',
         ))
-    except RequiredToolNotFound:
-        logger.info("Unable to find 'lsattr', some directory metadata differences might not be noticed.")
+    else:
+        try:
+            differences.append(Difference.from_command(Getfacl, path1, path2))
+        except RequiredToolNotFound:
+            logger.warning("Unable to find 'getfacl', some directory metadata differences might not be noticed.")
+    if sys.platform.startswith('linux'):
+        try:
+            differences.append(Difference.from_text(
+                lsattr(path1, stat1),
+                lsattr(path2, stat2),
+                path1,
+                path2,
+                source='lsattr',
+            ))
+        except RequiredToolNotFound:
+            logger.info("Unable to find 'lsattr', some directory metadata differences might not be noticed.")
     return [d for d in differences if d is not None]
 
 
@@ -152,8 +508,10 @@ class Directory(object):
 
 
 class FilesystemDirectory(Directory):
-    def __init__(self, path):
+    def __init__(self, path, walk=None, relpath=''):
         self._path = path
+        self._walk = walk
+        self._relpath = relpath
 
     @property
     def path(self):
@@ -163,6 +521,17 @@ class FilesystemDirectory(Directory):
     def name(self):
         return self._path
 
+    @property
+    def walk(self):
+        """
+        The DirectoryWalk this directory is part of, and its path within it.
+        Subdirectories share the walk of the directory they were found in.
+        """
+
+        if self._walk is None:
+            self._walk = DirectoryWalk(self._path)
+        return self._walk, self._relpath
+
     @property
     def as_container(self):
         if not hasattr(self, '_as_container'):
@@ -177,11 +546,15 @@ class FilesystemDirectory(Directory):
         return False
 
     def compare(self, other, source=None):
+        lazily = claim_streaming()
         differences = []
 
+        my_walk, my_relpath = self.walk
+        other_walk, other_relpath = other.walk
+
         listing_diff = Difference.from_text(
-            '\n'.join(list_files(self.path)),
-            '\n'.join(list_files(other.path)),
+            '\n'.join(my_walk.list_files(my_relpath)),
+            '\n'.join(other_walk.list_files(other_relpath)),
             self.path,
             other.path,
             source='file list',
@@ -189,34 +562,71 @@ class FilesystemDirectory(Directory):
         if listing_diff:
             differences.append(listing_diff)
 
-        differences.extend(compare_meta(self.name, other.name))
+        differences.extend(compare_meta(
+            self.name,
+            other.name,
+            my_walk.stat(my_relpath),
+            other_walk.stat(other_relpath),
+        ))
 
         my_container = DirectoryContainer(self)
         other_container = DirectoryContainer(other)
-        differences.extend(my_container.compare(other_container))
-
-        if not differences:
-            return None
 
-        difference = Difference(None, self.path, other.path, source)
-        difference.add_details(differences)
-        return difference
+        return add_member_details(
+            Difference(None, self.path, other.path, source),
+            differences,
+            my_container.compare(other_container),
+            lazily,
+        )
 
 
 class DirectoryContainer(Container):
     def get_member_names(self):
-        return sorted(os.listdir(self.source.path or '.'))
+        walk, relpath = self.source.walk
+        return walk.members(relpath)
 
     def get_member(self, member_name):
+        walk, relpath = self.source.walk
         member_path = os.path.join(self.source.path, member_name)
 
-        if not os.path.islink(member_path) and os.path.isdir(member_path):
-            return FilesystemDirectory(member_path)
+        if walk.is_directory(join(relpath, member_name)):
+            return FilesystemDirectory(
+                member_path,
+                walk,
+                join(relpath, member_name),
+            )
+
+        try:
+            st = walk.stat(join(relpath, member_name))
+        except OSError:
+            st = None
+
+        return FilesystemFile(member_path, container=self, lstat=st)
+
+    def member_stat(self, member_name):
+        """
+        The lstat() result of the member, or None if it vanished or cannot
+        be read since the directory was listed.
+        """
+
+        walk, relpath = self.source.walk
+        try:
+            return walk.stat(join(relpath, member_name))
+        except OSError as e:
+            logger.debug("Unable to stat %s: %s", member_name, e)
+            return None
+
+    def member_size(self, member_name):
+        st = self.member_stat(member_name)
+        return 0 if st is None else st.st_size
 
-        return FilesystemFile(
-            os.path.join(self.source.path, member_name),
-            container=self,
-        )
+    def get_adjusted_members_sizes(self):
+        for name, member in self.get_adjusted_members():
+            if member.is_directory():
+                size = 4096 # default "size" of a directory
+            else:
+                size = self.member_size(name)
+            yield name, (member, size)
 
     def comparisons(self, other):
         my_members = collections.OrderedDict(self.get_adjusted_members_sizes())
@@ -224,7 +634,7 @@ class DirectoryContainer(Container):
         total_size = sum(x[1] for x in my_members.values()) + sum(x[1] for x in other_members.values())
 
         to_compare = set(my_members.keys()).intersection(other_members.keys())
-        with Progress(total_size) as p:
+        with ComparisonsProgress(total_size) as p:
             for name in sorted(to_compare):
                 my_file, my_size = my_members[name]
                 other_file, other_size = other_members[name]
@@ -236,14 +646,35 @@ class DirectoryContainer(Container):
 
         def compare_pair(file1, file2, source):
             inner_difference = compare_files(file1, file2, source=source)
-            meta_differences = compare_meta(file1.name, file2.name)
+            stat1 = self.member_stat(source)
+            stat2 = other.member_stat(source)
+            if stat1 is None or stat2 is None:
+                if not inner_difference:
+                    inner_difference = Difference(None, file1.path, file2.path)
+                inner_difference.add_comment(
+                    "Unable to read the metadata of {}".format(source),
+                )
+                return inner_difference
+            meta_differences = compare_meta(
+                file1.name,
+                file2.name,
+                stat1,
+                stat2,
+            )
             if meta_differences and not inner_difference:
                 inner_difference = Difference(None, file1.path, file2.path)
             if inner_difference:
                 inner_difference.add_details(meta_differences)
             return inner_difference
 
+        def cost(file1, file2, source):
+            return self.member_size(source) + other.member_size(source)
+
         return filter(
             None,
-            itertools.starmap(compare_pair, self.comparisons(other)),
+            map_comparisons(
+                journalled(compare_pair),
+                self.comparisons(other),
+                cost,
+            ),
         )
@@ -24,12 +24,15 @@ import subprocess
 import collections
 
 from diffoscope.exc import OutputParsingError
+from diffoscope.cache import command_output
 from diffoscope.tools import tool_required
+from diffoscope.config import Config
+from diffoscope.executor import degrade, check_call, check_output
 from diffoscope.tempfiles import get_named_temporary_file
 from diffoscope.difference import Difference
 
 from .deb import DebFile, get_build_id_map
-from .utils.file import File
+from .utils.file import File, timeout_comment
 from .utils.command import Command
 from .utils.container import Container
 from .utils.libarchive import list_libarchive
@@ -58,7 +61,10 @@ class Readelf(Command):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # we don't care about the name of the archive
-        self._archive_re = re.compile(r'^File: %s\(' % re.escape(self.path))
+        self._archive_re = re.compile(
+            r'^File: %s\(' % re.escape(self.path),
+            re.MULTILINE,
+        )
 
     @tool_required('readelf')
     def cmdline(self):
@@ -76,6 +82,16 @@ class Readelf(Command):
         except UnicodeDecodeError:
             return line
 
+    def filter_block(self, block):
+        if '\n' in self.path:
+            return super().filter_block(block)
+        try:
+            block = self._archive_re.sub('File: lib.a(', block.decode('utf-8'))
+            return block.replace(self.path, '<elf>').encode('utf-8')
+        except UnicodeDecodeError:
+            # Leave only the undecodable lines alone, as filter() does
+            return super().filter_block(block)
+
     @staticmethod
     def should_skip_section(section_name, section_type):
         return False
@@ -167,7 +183,7 @@ class ReadElfSection(Readelf):
     @staticmethod
     def base_options():
         if not hasattr(ReadElfSection, '_base_options'):
-            output = subprocess.check_output(
+            output = check_output(
                 ['readelf', '--help'],
                 shell=False,
                 stderr=subprocess.DEVNULL,
@@ -200,6 +216,10 @@ class ObjdumpSection(Command):
         self._path = path
         self._path_bin = path.encode('utf-8')
         self._section_name = section_name
+        self._header_re = re.compile(
+            rb'^(?:%s:|In archive).*\n?' % re.escape(self._path_bin),
+            re.MULTILINE,
+        )
         super().__init__(path, *args, **kwargs)
 
     def objdump_options(self):
@@ -223,8 +243,16 @@ class ObjdumpSection(Command):
 
         return line
 
+    def filter_block(self, block):
+        if b'\n' in self._path_bin:
+            return super().filter_block(block)
+        return self._header_re.sub(b'', block)
+
 class ObjdumpDisassembleSection(ObjdumpSection):
-    RE_SYMBOL_COMMENT = re.compile(rb'^( +[0-9a-f]+:[^#]+)# [0-9a-f]+ <[^>]+>$')
+    RE_SYMBOL_COMMENT = re.compile(
+        rb'^( +[0-9a-f]+:[^#\n]+)# [0-9a-f]+ <[^>\n]+>$',
+        re.MULTILINE,
+    )
 
     def objdump_options(self):
         # With '--line-numbers' we get the source filename and line within the
@@ -237,6 +265,10 @@ class ObjdumpDisassembleSection(ObjdumpSection):
         line = super().filter(line)
         return ObjdumpDisassembleSection.RE_SYMBOL_COMMENT.sub(r'\1', line)
 
+    def filter_block(self, block):
+        block = super().filter_block(block)
+        return ObjdumpDisassembleSection.RE_SYMBOL_COMMENT.sub(rb'\1', block)
+
 
 READELF_COMMANDS = (
     ReadelfFileHeader,
@@ -250,10 +282,11 @@ READELF_COMMANDS = (
 )
 
 def _compare_elf_data(path1, path2):
-    return [
-        Difference.from_command(x, path1, path2)
-        for x in list(READELF_COMMANDS) + READELF_DEBUG_DUMP_COMMANDS
-    ]
+    return Difference.from_commands(
+        list(READELF_COMMANDS) + READELF_DEBUG_DUMP_COMMANDS,
+        path1,
+        path2,
+    )
 
 
 def _should_skip_section(name, type):
@@ -314,44 +347,46 @@ class ElfSection(File):
         return False
 
     def compare(self, other, source=None):
-        return Difference.from_command(
-            ReadElfSection,
-            self.path,
-            other.path,
-            command_args=[self._name],
-        )
+        return self.compare_with(ReadElfSection, other)
+
+    def compare_with(self, klass, other):
+        try:
+            return Difference.from_command(
+                klass,
+                self.path,
+                other.path,
+                command_args=[self._name],
+            )
+        except subprocess.TimeoutExpired as e:
+            degrade()
+            # A binary comparison would be of the whole file, not the section
+            difference = Difference(None, self.name, other.name)
+            difference.add_comment(timeout_comment(e))
+            return difference
 
 class ElfCodeSection(ElfSection):
     def compare(self, other, source=None):
-        return Difference.from_command(
-            ObjdumpDisassembleSection,
-            self.path,
-            other.path,
-            command_args=[self._name],
-        )
+        return self.compare_with(ObjdumpDisassembleSection, other)
 
 class ElfStringSection(ElfSection):
     def compare(self, other, source=None):
-        return Difference.from_command(
-            ReadelfStringSection,
-            self.path,
-            other.path,
-            command_args=[self._name],
-        )
+        return self.compare_with(ReadelfStringSection, other)
 
 
 @tool_required('readelf')
 def get_build_id(path):
     try:
-        output = subprocess.check_output(
-            ['readelf', '--notes', path],
-            stderr=subprocess.DEVNULL,
-        )
-    except subprocess.CalledProcessError as e:
+        # Shares the output of ReadelfNotes when comparing the same file
+        output = command_output(ReadelfNotes(path))
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        if isinstance(e, subprocess.TimeoutExpired) or \
+                Config().max_command_memory:
+            degrade()
         logger.debug("Unable to get Build ID for %s: %s", path, e)
         return None
 
-    m = re.search(r'^\s+Build ID: ([0-9a-f]+)$', output.decode('utf-8'), flags=re.MULTILINE)
+    # With --wide, the Build ID follows the note type on the same line
+    m = re.search(r'\sBuild ID: ([0-9a-f]+)$', output.decode('utf-8'), flags=re.MULTILINE)
     if not m:
         return None
 
@@ -361,7 +396,7 @@ def get_build_id(path):
 @tool_required('readelf')
 def get_debug_link(path):
     try:
-        output = subprocess.check_output(
+        output = check_output(
             ['readelf', '--string-dump=.gnu_debuglink', path],
             stderr=subprocess.DEVNULL,
         )
@@ -389,7 +424,7 @@ class ElfContainer(Container):
         logger.debug("Creating ElfContainer for %s", self.source.path)
 
         cmd = ['readelf', '--wide', '--section-headers', self.source.path]
-        output = subprocess.check_output(cmd, shell=False, stderr=subprocess.DEVNULL)
+        output = check_output(cmd, shell=False, stderr=subprocess.DEVNULL)
         has_debug_symbols = False
 
         try:
@@ -488,7 +523,7 @@ class ElfContainer(Container):
         os.makedirs(os.path.dirname(dest_path), exist_ok=True)
 
         def objcopy(*args):
-            subprocess.check_call(
+            check_call(
                 ('objcopy',) + args,
                 shell=False,
                 stderr=subprocess.DEVNULL,
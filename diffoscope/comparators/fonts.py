@@ -34,6 +34,9 @@ class Showttf(Command):
     def filter(self, line):
         return line.decode('latin-1').encode('utf-8')
 
+    def filter_block(self, block):
+        return block.decode('latin-1').encode('utf-8')
+
 
 class TtfFile(File):
     FILE_TYPE_RE = re.compile(r'^(TrueType|OpenType) font data$')
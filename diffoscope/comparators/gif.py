@@ -24,6 +24,7 @@ import subprocess
 from diffoscope.tools import tool_required
 from diffoscope.config import Config
 from diffoscope.difference import Difference
+from diffoscope.executor import check_output
 
 from .image import pixel_difference, flicker_difference, same_size
 from .utils.file import File
@@ -51,7 +52,7 @@ class Gifbuild(Command):
 @tool_required('identify')
 def is_image_static(image):
     try:
-        return subprocess.check_output((
+        return check_output((
             'identify',
             '-format', '%n',
             image.path,
@@ -20,10 +20,10 @@
 import re
 import os.path
 import logging
-import subprocess
 
 from diffoscope.tools import tool_required
 from diffoscope.difference import Difference
+from diffoscope.executor import check_call
 
 
 from .utils.file import File
@@ -47,7 +47,7 @@ class GzipContainer(Archive):
         dest_path = os.path.join(dest_dir, member_name)
         logger.debug('gzip extracting to %s', dest_path)
         with open(dest_path, 'wb') as fp:
-            subprocess.check_call(
+            check_call(
                 ["gzip", "--decompress", "--stdout", self.source.path],
                 shell=False, stdout=fp, stderr=None)
         return dest_path
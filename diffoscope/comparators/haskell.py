@@ -26,6 +26,7 @@ import subprocess
 from diffoscope.tools import tool_required
 from diffoscope.profiling import profile
 from diffoscope.difference import Difference
+from diffoscope.executor import check_output
 
 from .utils.file import File
 from .utils.command import Command
@@ -78,7 +79,7 @@ class HiFile(File):
         if not hasattr(HiFile, 'hi_version'):
             try:
                 with profile('command', 'ghc'):
-                    output = subprocess.check_output(
+                    output = check_output(
                         ['ghc', '--numeric-version'],
                     )
             except (OSError, subprocess.CalledProcessError):
@@ -20,9 +20,11 @@
 import re
 import base64
 import logging
+import functools
 import subprocess
 
 from diffoscope.config import Config
+from diffoscope.executor import gather, check_call, check_output
 from diffoscope.tools import tool_required
 from diffoscope.tempfiles import get_named_temporary_file
 from diffoscope.difference import Difference, VisualDifference
@@ -89,7 +91,7 @@ def pixel_difference(image1_path, image2_path):
     compared_filename = get_named_temporary_file(suffix='.png').name
 
     try:
-        subprocess.check_call((
+        check_call((
             'compare',
             image1_path,
             image2_path,
@@ -111,7 +113,7 @@ def pixel_difference(image1_path, image2_path):
 def flicker_difference(image1_path, image2_path):
     compared_filename = get_named_temporary_file(suffix='.gif').name
 
-    subprocess.check_call((
+    check_call((
         'convert',
         '-delay', '50',
         image1_path,
@@ -129,7 +131,7 @@ def flicker_difference(image1_path, image2_path):
 
 @tool_required('identify')
 def get_image_size(image_path):
-    return subprocess.check_output((
+    return check_output((
         'identify',
         '-format', '%[h]x%[w]',
         image_path,
@@ -147,11 +149,21 @@ class JPEGImageFile(File):
     FILE_TYPE_RE = re.compile(r'\bJPEG image data\b')
 
     def compare_details(self, other, source=None):
-        content_diff = Difference.from_command(
-            Img2Txt,
-            self.path,
-            other.path,
-            source="Image content",
+        content_diff, metadata_diff = gather(
+            functools.partial(
+                Difference.from_command,
+                Img2Txt,
+                self.path,
+                other.path,
+                source="Image content",
+            ),
+            functools.partial(
+                Difference.from_command,
+                Identify,
+                self.path,
+                other.path,
+                source="Image metadata",
+            ),
         )
         if content_diff is not None and Config().compute_visual_diffs and \
                 same_size(self, other):
@@ -167,15 +179,7 @@ class JPEGImageFile(File):
                 ])
             except subprocess.CalledProcessError:  # noqa
                 pass
-        return [
-            content_diff,
-            Difference.from_command(
-                Identify,
-                self.path,
-                other.path,
-                source="Image metadata",
-            ),
-        ]
+        return [content_diff, metadata_diff]
 
 
 class ICOImageFile(File):
@@ -224,6 +228,6 @@ class ICOImageFile(File):
     def convert(file):
         result = get_named_temporary_file(suffix='.png').name
 
-        subprocess.check_call(('convert', file.path, result))
+        check_call(('convert', file.path, result))
 
         return result
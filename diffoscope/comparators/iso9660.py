@@ -22,6 +22,7 @@ import subprocess
 
 from diffoscope.tools import tool_required
 from diffoscope.difference import Difference
+from diffoscope.executor import check_output
 
 from .utils.file import File
 from .utils.command import Command
@@ -30,7 +31,7 @@ from .utils.libarchive import LibarchiveContainer
 
 @tool_required('isoinfo')
 def get_iso9660_names(path):
-    return subprocess.check_output((
+    return check_output((
         'isoinfo',
         '-R',  # Always use RockRidge for names
         '-f',
@@ -87,12 +88,11 @@ class Iso9660File(File):
         return False
 
     def compare_details(self, other, source=None):
-        differences = []
-
-        for klass in (ISO9660PVD, ISO9660Listing):
-            differences.append(Difference.from_command(
-                klass, self.path, other.path,
-            ))
+        differences = Difference.from_commands(
+            (ISO9660PVD, ISO9660Listing),
+            self.path,
+            other.path,
+        )
 
         for x in ('joliet', 'rockridge'):
             try:
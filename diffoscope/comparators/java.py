@@ -29,6 +29,9 @@ from .utils.command import Command
 
 
 class Javap(Command):
+    # Each starts a JVM, so only compare one pair of files at a time
+    MAX_PROCESSES = 2
+
     def __init__(self, path, *args, **kwargs):
         super().__init__(path, *args, **kwargs)
         self.real_path = os.path.realpath(path)
@@ -40,10 +40,16 @@ class Pdftk(Command):
     def filter(self, line):
         return line.decode('latin-1').encode('utf-8')
 
+    def filter_block(self, block):
+        return block.decode('latin-1').encode('utf-8')
+
 
 class PdfFile(File):
     FILE_TYPE_RE = re.compile(r'^PDF document\b')
 
     def compare_details(self, other, source=None):
-        return [Difference.from_command(Pdftotext, self.path, other.path),
-                Difference.from_command(Pdftk, self.path, other.path)]
+        return Difference.from_commands(
+            (Pdftotext, Pdftk),
+            self.path,
+            other.path,
+        )
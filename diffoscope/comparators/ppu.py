@@ -27,6 +27,7 @@ import subprocess
 from diffoscope.tools import tool_required
 from diffoscope.profiling import profile
 from diffoscope.difference import Difference
+from diffoscope.executor import check_output
 
 from .utils.file import File
 from .utils.command import Command
@@ -72,7 +73,7 @@ class PpuFile(File):
         if not hasattr(PpuFile, 'ppu_version'):
             try:
                 with profile('command', 'ppudump'):
-                    subprocess.check_output(['ppudump', '-vh', file.path], shell=False, stderr=subprocess.STDOUT)
+                    check_output(['ppudump', '-vh', file.path], shell=False, stderr=subprocess.STDOUT)
                 PpuFile.ppu_version = ppu_version
             except subprocess.CalledProcessError as e:
                 error = e.output.decode('utf-8', errors='ignore')
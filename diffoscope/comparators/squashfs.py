@@ -29,6 +29,7 @@ import collections
 from diffoscope.tools import tool_required
 from diffoscope.difference import Difference
 from diffoscope.tempfiles import get_temporary_directory
+from diffoscope.executor import check_output
 
 from .utils.file import File
 from .device import Device
@@ -254,7 +255,7 @@ class SquashfsContainer(Archive):
 
         logger.debug("Extracting %s to %s", self.source.path, self._temp_dir)
 
-        output = subprocess.check_output((
+        output = check_output((
             'unsquashfs',
             '-n',
             '-f',
@@ -301,7 +302,8 @@ class SquashfsFile(File):
     FILE_TYPE_RE = re.compile(r'^Squashfs filesystem\b')
 
     def compare_details(self, other, source=None):
-        return [
-            Difference.from_command(SquashfsSuperblock, self.path, other.path),
-            Difference.from_command(SquashfsListing, self.path, other.path),
-        ]
+        return Difference.from_commands(
+            (SquashfsSuperblock, SquashfsListing),
+            self.path,
+            other.path,
+        )
@@ -20,15 +20,22 @@
 import re
 import codecs
 
+from diffoscope.diff import DiffIndex
 from diffoscope.difference import Difference
 
 from .utils.file import File
 
 
-def order_only_difference(unified_diff):
-    diff_lines = unified_diff.splitlines()
-    added_lines = [line[1:] for line in diff_lines if line.startswith('+')]
-    removed_lines = [line[1:] for line in diff_lines if line.startswith('-')]
+def order_only_difference(unified_diff, index=None):
+    if index is None:
+        index = DiffIndex.from_text(unified_diff)
+
+    added_lines, removed_lines = [], []
+    for type_, line in index.lines(unified_diff):
+        if type_ == DiffIndex.ADDED:
+            added_lines.append(line[1:])
+        elif type_ == DiffIndex.REMOVED:
+            removed_lines.append(line[1:])
     # Faster check: does number of lines match?
     if len(added_lines) != len(removed_lines):
         return False
@@ -52,7 +59,10 @@ class TextFile(File):
                  codecs.open(other.path, 'r', encoding=other_encoding) as other_content:
                 difference = Difference.from_text_readers(my_content, other_content, self.name, other.name, source)
                 # Check if difference is only in line order.
-                if difference and order_only_difference(difference.unified_diff):
+                if difference and order_only_difference(
+                    difference.unified_diff,
+                    difference.diff_index,
+                ):
                     difference.add_comment("ordering differences only")
                 if my_encoding != other_encoding:
                     if difference is None:
@@ -19,26 +19,56 @@
 
 import io
 import abc
-import logging
+import time
 import shlex
+import logging
+import resource
+import functools
 import subprocess
 import threading
 
+from diffoscope.config import Config
+
 logger = logging.getLogger(__name__)
 
 
 class Command(object, metaclass=abc.ABCMeta):
+    # How many processes of this tool may run at once, if it needs a lower
+    # limit than --max-processes. See executor.limit_processes.
+    MAX_PROCESSES = None
+
     def __init__(self, path):
         self._path = path
 
     def start(self):
+        self._timeout = self.timeout()
+        self._timed_out = False
+        if self._timeout is not None and self._timeout <= 0:
+            # Past the --deadline; don't even start
+            raise subprocess.TimeoutExpired(self.cmdline(), 0)
+
+        preexec_fn = None
+        if Config().max_command_memory:
+            limit = Config().max_command_memory
+            preexec_fn = functools.partial(
+                resource.setrlimit,
+                resource.RLIMIT_AS,
+                (limit, limit),
+            )
+
         logger.debug("Executing %s", ' '.join([shlex.quote(x) for x in self.cmdline()]))
         self._process = subprocess.Popen(self.cmdline(),
                                          shell=False, close_fds=True,
                                          env=self.env(),
+                                         preexec_fn=preexec_fn,
                                          stdin=subprocess.PIPE,
                                          stdout=subprocess.PIPE,
                                          stderr=subprocess.PIPE)
+        self._timer = None
+        if self._timeout is not None:
+            self._timer = threading.Timer(self._timeout, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
         if hasattr(self, 'feed_stdin'):
             self._stdin_feeder = threading.Thread(target=self._feed_stdin, args=(self._process.stdin,))
             self._stdin_feeder.daemon = True
@@ -52,6 +82,35 @@ class Command(object, metaclass=abc.ABCMeta):
         self._stderr_reader.daemon = True
         self._stderr_reader.start()
 
+    def timeout(self):
+        """
+        The number of seconds the command may run for, given
+        --command-timeout and --deadline, or None if there is no limit.
+        """
+
+        timeouts = []
+        if Config().command_timeout:
+            timeouts.append(Config().command_timeout)
+        if Config().deadline is not None:
+            timeouts.append(Config().deadline - time.monotonic())
+        return min(timeouts, default=None)
+
+    def _expire(self):
+        logger.debug(
+            "Terminating %s after %d seconds",
+            ' '.join([shlex.quote(x) for x in self.cmdline()]),
+            self._timeout,
+        )
+        self._timed_out = True
+        self._process.terminate()
+
+    def replay(self, stderr):
+        """
+        Stand in for start() when the output of the command is already known,
+        eg. from the cache, so that its stderr can still be reported.
+        """
+        self._stderr = io.BytesIO(stderr)
+
     @property
     def path(self):
         return self._path
@@ -79,6 +138,14 @@ class Command(object, metaclass=abc.ABCMeta):
         # Assume command output is utf-8 by default
         return line
 
+    def filter_block(self, block):
+        """
+        Filter `block`, a run of whole lines of output. Subclasses can
+        override this when filter() can be applied to many lines at once;
+        by default filter() is called on each line.
+        """
+        return b''.join(map(self.filter, io.BytesIO(block)))
+
     def poll(self):
         return self._process.poll()
 
@@ -90,11 +157,19 @@ class Command(object, metaclass=abc.ABCMeta):
             self._stdin_feeder.join()
         self._stderr_reader.join()
         returncode = self._process.wait()
+        if self._timer is not None:
+            self._timer.cancel()
         logger.debug(
             "%s returned (exit code: %d)",
             ' '.join([shlex.quote(x) for x in self.cmdline()]),
             returncode,
         )
+        if self._timed_out:
+            raise subprocess.TimeoutExpired(
+                self.cmdline(),
+                self._timeout,
+                output=self.stderr.getvalue(),
+            )
         return returncode
 
     MAX_STDERR_LINES = 50
@@ -22,10 +22,13 @@ import os
 import sys
 import logging
 import binascii
+import subprocess
 
 from diffoscope.tools import tool_required
 from diffoscope.exc import RequiredToolNotFound
+from diffoscope.cache import cached_compare
 from diffoscope.config import Config
+from diffoscope.executor import degrade
 from diffoscope.excludes import any_excluded
 from diffoscope.profiling import profile
 from diffoscope.difference import Difference
@@ -92,7 +95,7 @@ def compare_files(file1, file2, source=None, diff_content_only=False):
     elif file1.__class__.__name__ != file2.__class__.__name__:
         return file1.compare_bytes(file2, source)
     with profile('compare_files (cumulative)', file1):
-        return file1.compare(file2, source)
+        return cached_compare(file1, file2, source)
 
 def bail_if_non_existing(*paths):
     if not all(map(os.path.lexists, paths)):
@@ -109,10 +112,20 @@ def compare_binary_files(file1, file2, source=None):
             Xxd, file1.path, file2.path,
             source=source, has_internal_linenos=True)
     except RequiredToolNotFound:
-        hexdump1 = hexdump_fallback(file1.path)
-        hexdump2 = hexdump_fallback(file2.path)
         comment = 'xxd not available in path. Falling back to Python hexlify.\n'
-        return Difference.from_text(hexdump1, hexdump2, file1.name, file2.name, source, comment)
+    except subprocess.TimeoutExpired:
+        degrade()
+        comment = 'xxd exceeded its time limit. Falling back to Python hexlify.\n'
+    except subprocess.CalledProcessError as e:
+        # eg. when it cannot start within --max-command-memory
+        if Config().max_command_memory:
+            degrade()
+        comment = 'xxd exited with {}. Falling back to Python hexlify.\n'.format(
+            e.returncode,
+        )
+    hexdump1 = hexdump_fallback(file1.path)
+    hexdump2 = hexdump_fallback(file2.path)
+    return Difference.from_text(hexdump1, hexdump2, file1.name, file2.name, source, comment)
 
 def hexdump_fallback(path):
     hexdump = io.StringIO()
@@ -18,11 +18,21 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import abc
+import heapq
+import weakref
 import logging
 import itertools
+import threading
+import contextlib
+import functools
+import collections
+import concurrent.futures
+
 from collections import OrderedDict
 
 from diffoscope.config import Config
+from diffoscope.executor import degrade, degradable
+from diffoscope.checkpoint import journalled
 from diffoscope.difference import Difference
 from diffoscope.excludes import filter_excludes
 from diffoscope.progress import Progress
@@ -34,8 +44,212 @@ from .fuzzy import perform_fuzzy_matching
 
 NO_COMMENT = None
 
+# How many comparisons per job map_comparisons may read ahead when choosing
+# the most expensive to start next. Their results are kept until they are
+# yielded.
+LOOKAHEAD_PER_JOB = 8
+
 logger = logging.getLogger(__name__)
 
+_local = threading.local()
+_streaming = False
+
+
+def map_comparisons(compare_pair, comparisons, cost=None):
+    """
+    Apply `compare_pair` to each (file1, file2, extra) tuple yielded by
+    `comparisons`, lazily and in order.
+
+    If Config().jobs is greater than 1, pairs are compared concurrently by a
+    pool of worker threads (the heavy lifting is done by external processes)
+    but results are still yielded in the same order as the serial version so
+    that the output is identical. Only the outermost container is
+    parallelised; nested containers compared from within a worker run
+    serially to avoid an explosion of threads.
+
+    If given, `cost` estimates how long comparing a tuple takes, taking the
+    same arguments as `compare_pair`. Comparisons are then read further
+    ahead and the most expensive ones started first, so that a huge member
+    is not left running on its own at the end.
+
+    Progress reported with ComparisonsProgress while reading a tuple is
+    deferred until its comparison is started.
+    """
+
+    jobs = Config().jobs
+    if jobs <= 1 or getattr(_local, 'in_worker', False):
+        yield from itertools.starmap(compare_pair, comparisons)
+        return
+
+    def worker(args):
+        _local.in_worker = True
+        with degradable() as degraded:
+            return compare_pair(*args), degraded()
+
+    # Only read a bounded number of comparisons ahead of the one to be
+    # yielded next so that progress reporting stays meaningful and memory
+    # usage stays bounded.
+    lookahead = 2 * jobs if cost is None else LOOKAHEAD_PER_JOB * jobs
+    comparisons = enumerate(comparisons)
+    exhausted = False
+    next_index = 0
+    read = 0
+
+    waiting = [] # heap of (-cost, index, args, steps) not yet started
+    futures = {} # index -> future
+    running = set()
+    trailing = [] # progress deferred after the last tuple was read
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            while True:
+                while not exhausted and read - next_index < lookahead:
+                    _local.deferred = steps = []
+                    try:
+                        index, args = next(comparisons)
+                    except StopIteration:
+                        exhausted = True
+                        trailing.extend(steps)
+                        break
+                    finally:
+                        _local.deferred = None
+                    read += 1
+                    priority = 0 if cost is None else -cost(*args)
+                    heapq.heappush(waiting, (priority, index, args, steps))
+
+                while waiting and len(running) < jobs:
+                    _, index, args, steps = heapq.heappop(waiting)
+                    for x in steps:
+                        x()
+                    futures[index] = executor.submit(worker, args)
+                    running.add(futures[index])
+
+                if next_index not in futures and not waiting:
+                    break
+
+                future = futures.get(next_index)
+                if future is not None and future.done():
+                    del futures[next_index]
+                    next_index += 1
+                    result, degraded = future.result()
+                    if degraded:
+                        degrade()
+                    yield result
+                    continue
+
+                done, _ = concurrent.futures.wait(
+                    running,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                running -= done
+        finally:
+            for x in futures.values():
+                x.cancel()
+            for x in trailing:
+                x()
+
+
+def defer(fn, *args, **kwargs):
+    """
+    Call `fn`, or if map_comparisons is reading a tuple ahead of starting
+    its comparison, do so when it is started.
+    """
+
+    deferred = getattr(_local, 'deferred', None)
+    if deferred is None:
+        fn(*args, **kwargs)
+    else:
+        deferred.append(functools.partial(fn, *args, **kwargs))
+
+
+class ComparisonsProgress(object):
+    """
+    A Progress for Container.comparisons generators whose steps begin when
+    the comparison of the tuple yielded next is started rather than when it
+    is read by map_comparisons.
+    """
+
+    def __init__(self, total):
+        self.progress = Progress(total)
+
+    def __enter__(self):
+        self.progress.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        defer(self.progress.__exit__, *exc_info)
+
+    def begin_step(self, step, msg=''):
+        defer(self.progress.begin_step, step, msg=msg)
+
+
+def member_size(member):
+    if member.is_directory():
+        return 4096 # default "size" of a directory
+    return path_apparent_size(member.path)
+
+
+@contextlib.contextmanager
+def streaming(enabled=True):
+    """
+    Within this context, the outermost comparison adds the differences
+    between container members to its Difference lazily, so that they are
+    computed as they are presented. See Difference.iter_details.
+    """
+
+    global _streaming
+
+    _streaming = enabled
+    try:
+        yield
+    finally:
+        _streaming = False
+
+
+def claim_streaming():
+    """
+    Returns whether the caller should add its member differences lazily.
+    Only true for the first caller, ie. the outermost comparison, within
+    streaming().
+    """
+
+    global _streaming
+
+    result, _streaming = _streaming, False
+    return result
+
+
+def add_member_details(difference, details, members, lazily=False):
+    """
+    Add the non-empty `details`, followed by the differences between
+    container members yielded by `members`, to `difference`. Returns
+    `difference`, or None if there were none at all.
+
+    If `lazily`, only as many members are compared as needed to tell
+    whether there are any differences and the rest are added lazily.
+    """
+
+    details = [x for x in details if x]
+
+    if not lazily:
+        details.extend(members)
+        if not details:
+            return None
+        difference.add_details(details)
+        return difference
+
+    members = iter(members)
+    if not details:
+        first = next(members, None)
+        if first is None:
+            return None
+        details.append(first)
+
+    difference.add_details(details)
+    difference.add_lazy_details(members)
+
+    return difference
+
 
 class Container(object, metaclass=abc.ABCMeta):
     def __new__(cls, source):
@@ -48,6 +262,7 @@ class Container(object, metaclass=abc.ABCMeta):
 
     def __init__(self, source):
         self._source = source
+        self._sizes = weakref.WeakKeyDictionary()
 
         # Keep a count of how "nested" we are
         self.depth = 0
@@ -111,11 +326,19 @@ class Container(object, metaclass=abc.ABCMeta):
 
     def get_adjusted_members_sizes(self):
         for name, member in self.get_adjusted_members():
-            if member.is_directory():
-                size = 4096 # default "size" of a directory
-            else:
-                size = path_apparent_size(member.path)
-            yield name, (member, size)
+            self._sizes[member] = member_size(member)
+            yield name, (member, self._sizes[member])
+
+    def known_size(self, member):
+        """
+        The size of `member` as found by get_adjusted_members_sizes, so
+        that it is not looked up again.
+        """
+
+        try:
+            return self._sizes[member]
+        except KeyError:
+            return member_size(member)
 
     def comparisons(self, other):
         my_members = OrderedDict(self.get_adjusted_members_sizes())
@@ -124,7 +347,7 @@ class Container(object, metaclass=abc.ABCMeta):
         # TODO: progress could be a bit more accurate here, give more weight to fuzzy-hashed files
         # TODO: merge DirectoryContainer.comparisons() into this
 
-        with Progress(total_size) as p:
+        with ComparisonsProgress(total_size) as p:
             def prep_yield(my_name, other_name, comment=NO_COMMENT):
                 my_member, my_size = my_members.pop(my_name)
                 other_member, other_size = other_members.pop(other_name)
@@ -168,7 +391,14 @@ class Container(object, metaclass=abc.ABCMeta):
                 difference.add_comment(comment)
             return difference
 
-        return filter(None, itertools.starmap(compare_pair, self.comparisons(other)))
+        def cost(file1, file2, comment):
+            return self.known_size(file1) + other.known_size(file2)
+
+        return filter(None, map_comparisons(
+            journalled(compare_pair),
+            self.comparisons(other),
+            cost,
+        ))
 
 
 class MissingContainer(Container):
@@ -20,14 +20,19 @@
 import os
 import re
 import abc
+import mmap
+import stat
 import magic
+import hashlib
 import logging
+import threading
 import subprocess
+import collections
 
 from diffoscope.exc import RequiredToolNotFound, OutputParsingError, \
     ContainerExtractionError
-from diffoscope.tools import tool_required
 from diffoscope.config import Config
+from diffoscope.executor import degrade
 from diffoscope.profiling import profile
 from diffoscope.difference import Difference
 
@@ -36,11 +41,77 @@ try:
 except ImportError:  # noqa
     tlsh = None
 
-SMALL_FILE_THRESHOLD = 65536 # 64 kiB
+# Contents are compared (and hashed) in chunks of this size
+COMPARE_CHUNK_SIZE = 2 ** 20 # 1 MiB
+
+# Digests of file contents that have been calculated recently, so they can
+# be reused by any File object referring to the same, unmodified file. The
+# least recently used are forgotten beyond MAX_DIGESTS.
+MAX_DIGESTS = 2 ** 16
+
+_digests_lock = threading.Lock()
+_digests = collections.OrderedDict()
 
 logger = logging.getLogger(__name__)
 
 
+def digest_key(path, st):
+    return (
+        path,
+        st.st_dev,
+        st.st_ino,
+        st.st_size,
+        st.st_mtime_ns,
+        st.st_ctime_ns,
+    )
+
+
+def has_real_size(st):
+    """
+    Whether `st` is for a regular file whose size reflects its content.
+    Files in /proc and sysfs are regular files too, but report a size of 0 or
+    4096 regardless; they occupy no blocks on disk, though.
+    """
+    return stat.S_ISREG(st.st_mode) and st.st_blocks > 0
+
+
+def lookup_digest(key):
+    with _digests_lock:
+        digest = _digests.get(key)
+        if digest is not None:
+            _digests.move_to_end(key)
+        return digest
+
+
+def remember_digest(key, digest):
+    with _digests_lock:
+        _digests[key] = digest
+        _digests.move_to_end(key)
+        while len(_digests) > MAX_DIGESTS:
+            _digests.popitem(last=False)
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for buf in iter(lambda: f.read(COMPARE_CHUNK_SIZE), b''):
+            h.update(buf)
+    return h.hexdigest()
+
+
+def path_digest(path):
+    """
+    Returns the digest of the contents of `path`, reusing one calculated
+    earlier for any File referring to it.
+    """
+    key = digest_key(path, os.stat(path))
+    digest = lookup_digest(key)
+    if digest is None:
+        digest = file_digest(path)
+        remember_digest(key, digest)
+    return digest
+
+
 def path_apparent_size(path=".", visited=None):
     # should output the same as `du --apparent-size -bs "$path"`
     if not visited:
@@ -58,32 +129,39 @@ def path_apparent_size(path=".", visited=None):
 
 
 class File(object, metaclass=abc.ABCMeta):
+    # libmagic is not thread-safe
+    _magic_lock = threading.Lock()
+
     if hasattr(magic, 'open'): # use Magic-file-extensions from file
         @classmethod
         def guess_file_type(self, path):
-            if not hasattr(self, '_mimedb'):
-                self._mimedb = magic.open(magic.NONE)
-                self._mimedb.load()
-            return self._mimedb.file(path)
+            with self._magic_lock:
+                if not hasattr(self, '_mimedb'):
+                    self._mimedb = magic.open(magic.NONE)
+                    self._mimedb.load()
+                return self._mimedb.file(path)
 
         @classmethod
         def guess_encoding(self, path):
-            if not hasattr(self, '_mimedb_encoding'):
-                self._mimedb_encoding = magic.open(magic.MAGIC_MIME_ENCODING)
-                self._mimedb_encoding.load()
-            return self._mimedb_encoding.file(path)
+            with self._magic_lock:
+                if not hasattr(self, '_mimedb_encoding'):
+                    self._mimedb_encoding = magic.open(magic.MAGIC_MIME_ENCODING)
+                    self._mimedb_encoding.load()
+                return self._mimedb_encoding.file(path)
     else: # use python-magic
         @classmethod
         def guess_file_type(self, path):
-            if not hasattr(self, '_mimedb'):
-                self._mimedb = magic.Magic()
-            return maybe_decode(self._mimedb.from_file(path))
+            with self._magic_lock:
+                if not hasattr(self, '_mimedb'):
+                    self._mimedb = magic.Magic()
+                return maybe_decode(self._mimedb.from_file(path))
 
         @classmethod
         def guess_encoding(self, path):
-            if not hasattr(self, '_mimedb_encoding'):
-                self._mimedb_encoding = magic.Magic(mime_encoding=True)
-            return maybe_decode(self._mimedb_encoding.from_file(path))
+            with self._magic_lock:
+                if not hasattr(self, '_mimedb_encoding'):
+                    self._mimedb_encoding = magic.Magic(mime_encoding=True)
+                return maybe_decode(self._mimedb_encoding.from_file(path))
 
     def __init__(self, container=None):
         self._container = container
@@ -195,6 +273,28 @@ class File(object, metaclass=abc.ABCMeta):
 
         return "file"
 
+    @property
+    def digest(self):
+        if not hasattr(self, '_digest'):
+            st = os.stat(self.path)
+            digest = self.known_digest(st)
+            if digest is None:
+                digest = file_digest(self.path)
+            self.remember_digest(st, digest)
+        return self._digest
+
+    def digest_key(self, st):
+        return digest_key(self.path, st)
+
+    def known_digest(self, st):
+        if hasattr(self, '_digest'):
+            return self._digest
+        return lookup_digest(self.digest_key(st))
+
+    def remember_digest(self, st, digest):
+        self._digest = digest
+        remember_digest(self.digest_key(st), digest)
+
     if tlsh:
         @property
         def fuzzy_hash(self):
@@ -239,7 +339,11 @@ class File(object, metaclass=abc.ABCMeta):
         return compare_binary_files(self, other, source)
 
     def _compare_using_details(self, other, source):
+        from .container import claim_streaming, add_member_details
+
+        lazily = claim_streaming()
         details = []
+        members = ()
         difference = Difference(None, self.name, other.name, source=source)
 
         if hasattr(self, 'compare_details'):
@@ -252,46 +356,83 @@ class File(object, metaclass=abc.ABCMeta):
                 msg = "Reached max container depth ({})".format(depth)
                 logger.debug(msg)
                 difference.add_comment(msg)
-            details.extend(self.as_container.compare(other.as_container, no_recurse=no_recurse))
+            members = self.as_container.compare(other.as_container, no_recurse=no_recurse)
 
-        details = [x for x in details if x]
-        if not details:
-            return None
-        difference.add_details(details)
-
-        return difference
+        return add_member_details(difference, details, members, lazily)
 
     def has_same_content_as(self, other):
         logger.debug('Binary.has_same_content: %s %s', self, other)
         if os.path.isdir(self.path) or os.path.isdir(other.path):
             return False
-        # try comparing small files directly first
         try:
-            my_size = os.path.getsize(self.path)
-            other_size = os.path.getsize(other.path)
+            my_stat = os.stat(self.path)
+            other_stat = os.stat(other.path)
         except OSError:
             # files not readable (e.g. broken symlinks) or something else,
             # just assume they are different
             return False
-        if my_size == other_size and my_size <= SMALL_FILE_THRESHOLD:
-            try:
-                with profile('command', 'cmp (internal)'):
-                    with open(self.path, 'rb') as file1, open(other.path, 'rb') as file2:
-                        return file1.read() == file2.read()
-            except OSError:
-                # one or both files could not be opened for some reason,
-                # assume they are different
-                return False
 
-        return self.cmp_external(other)
+        # The same file, or hardlinks to it
+        if (my_stat.st_dev, my_stat.st_ino) == \
+                (other_stat.st_dev, other_stat.st_ino):
+            return True
+
+        regular = has_real_size(my_stat) and has_real_size(other_stat)
+        if regular and my_stat.st_size != other_stat.st_size:
+            return False
+
+        try:
+            with profile('command', 'cmp (internal)'):
+                if not regular:
+                    return self.cmp_read(other)
+                return self.cmp_internal(other, my_stat, other_stat)
+        except (OSError, ValueError):
+            # one or both files could not be opened or mapped for some
+            # reason, assume they are different
+            return False
+
+    def cmp_internal(self, other, my_stat, other_stat):
+        if my_stat.st_size == 0:
+            return True
+
+        my_digest = self.known_digest(my_stat)
+        other_digest = other.known_digest(other_stat)
 
-    @tool_required('cmp')
-    def cmp_external(self, other):
-        return subprocess.call(
-            ('cmp', '-s', self.path, other.path),
-            shell=False,
-            close_fds=True,
-        ) == 0
+        # If we already know both digests, we need not read either file.
+        # Knowing just one does not help, as hashing the other in full is
+        # worse than stopping at the first chunk that differs below.
+        if my_digest is not None and other_digest is not None:
+            return my_digest == other_digest
+
+        h = hashlib.sha256()
+        with open(self.path, 'rb') as file1, open(other.path, 'rb') as file2, \
+                mmap.mmap(file1.fileno(), 0, access=mmap.ACCESS_READ) as m1, \
+                mmap.mmap(file2.fileno(), 0, access=mmap.ACCESS_READ) as m2:
+            if len(m1) != len(m2):
+                return False
+            for offset in range(0, len(m1), COMPARE_CHUNK_SIZE):
+                buf = m1[offset:offset + COMPARE_CHUNK_SIZE]
+                if buf != m2[offset:offset + COMPARE_CHUNK_SIZE]:
+                    return False
+                h.update(buf)
+
+        # The files are identical, so remember the digest for both.
+        digest = h.hexdigest()
+        self.remember_digest(my_stat, digest)
+        other.remember_digest(other_stat, digest)
+
+        return True
+
+    def cmp_read(self, other):
+        # Neither the size nor the times of these files can be trusted, so
+        # don't remember any digests either.
+        with open(self.path, 'rb') as file1, open(other.path, 'rb') as file2:
+            while True:
+                buf = file1.read(COMPARE_CHUNK_SIZE)
+                if buf != file2.read(COMPARE_CHUNK_SIZE):
+                    return False
+                if not buf:
+                    return True
 
     # To be specialized directly, or by implementing compare_details
     def compare(self, other, source=None):
@@ -308,6 +449,9 @@ class File(object, metaclass=abc.ABCMeta):
                         "yet data differs ({})".format(self.magic_file_type),
                     )
             except subprocess.CalledProcessError as e:
+                if Config().max_command_memory:
+                    # It may have run out of memory rather than failed
+                    degrade()
                 difference = self.compare_bytes(other, source=source)
                 if e.output:
                     output = re.sub(r'^', '    ', e.output.decode('utf-8', errors='replace'), flags=re.MULTILINE)
@@ -318,6 +462,13 @@ class File(object, metaclass=abc.ABCMeta):
                     return None
                 difference.add_comment("Command `%s` exited with %d. Output:\n%s"
                                        % (cmd, e.returncode, output))
+            except subprocess.TimeoutExpired as e:
+                degrade()
+                difference = self.compare_bytes(other, source=source)
+                if difference is None:
+                    return None
+                difference.add_comment(
+                    "%s Falling back to binary comparison." % timeout_comment(e))
             except RequiredToolNotFound as e:
                 difference = self.compare_bytes(other, source=source)
                 if difference is None:
@@ -342,6 +493,10 @@ class File(object, metaclass=abc.ABCMeta):
             return difference
         return self.compare_bytes(other, source)
 
+def timeout_comment(e):
+    return "Command `%s` exceeded its time limit of %d seconds (see " \
+        "--command-timeout and --deadline)." % (' '.join(e.cmd), e.timeout)
+
 # helper function to convert to bytes if necessary
 def maybe_decode(s):
     if type(s) is bytes:
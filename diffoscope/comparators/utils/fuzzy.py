@@ -18,7 +18,8 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
-import operator
+import itertools
+import collections
 
 from diffoscope.config import Config
 
@@ -33,22 +34,135 @@ logger = logging.getLogger(__name__)
 def perform_fuzzy_matching(members1, members2):
     if tlsh == None or Config().fuzzy_threshold == 0:
         return
-    already_compared = set()
     # Perform local copies because they will be modified by consumer
     members1 = dict(members1)
     members2 = dict(members2)
+    index = None
     for name1, (file1, _) in members1.items():
         if file1.is_directory() or not file1.fuzzy_hash:
             continue
-        comparisons = []
-        for name2, (file2, _) in members2.items():
-            if name2 in already_compared or file2.is_directory() or not file2.fuzzy_hash:
-                continue
-            comparisons.append((tlsh.diff(file1.fuzzy_hash, file2.fuzzy_hash), name2))
-        if comparisons:
-            comparisons.sort(key=operator.itemgetter(0))
-            score, name2 = comparisons[0]
+        if index is None:
+            index = FuzzyIndex(Config().fuzzy_threshold)
+            for name2, (file2, _) in members2.items():
+                if not file2.is_directory() and file2.fuzzy_hash:
+                    index.add(name2, file2.fuzzy_hash)
+        found = index.best_match(file1.fuzzy_hash)
+        if found is not None:
+            score, name2 = found
             logger.debug('fuzzy top match %s %s: %d difference score', name1, name2, score)
-            if score < Config().fuzzy_threshold:
-                yield name1, name2, score
-                already_compared.add(name2)
+            yield name1, name2, score
+            index.remove(name2)
+
+
+def length_score(d):
+    # How a difference in the length component contributes to tlsh.diff
+    return d if d <= 1 else d * 12
+
+
+def ratio_score(d):
+    # ... and a difference in either of the quartile ratios
+    return d if d <= 1 else (d - 1) * 12
+
+
+def mod_diff(x, y, r):
+    d = abs(x - y)
+    return min(d, r - d)
+
+
+def parse_header(digest):
+    """
+    Return the checksum, length and quartile ratio components of a TLSH hex
+    digest, or None if it is not in a format we know.
+    """
+
+    if digest.startswith('T1'):
+        digest = digest[2:]
+    if len(digest) != 70:
+        return None
+    try:
+        checksum, lvalue, qratios = bytes.fromhex(digest[:6])
+    except ValueError:
+        return None
+    # The nibbles of the length and quartile bytes are swapped in hex form
+    return checksum, ((lvalue & 0xf) << 4) | (lvalue >> 4), qratios >> 4, \
+        qratios & 0xf
+
+
+def header_distance(a, b):
+    """
+    The part of tlsh.diff(a, b) that is due to the digest headers; the rest
+    is due to the body, so this is a lower bound of the total.
+    """
+
+    return length_score(mod_diff(a[1], b[1], 256)) + \
+        ratio_score(mod_diff(a[2], b[2], 16)) + \
+        ratio_score(mod_diff(a[3], b[3], 16)) + \
+        (a[0] != b[0])
+
+
+class FuzzyIndex(object):
+    """
+    Candidate TLSH digests, bucketed by their length component so that
+    candidates whose headers alone score at least `threshold` are never
+    compared.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.buckets = collections.defaultdict(dict)
+        self.lvalues = {}
+        self.order = itertools.count()
+
+        # Only lengths up to this distance away can score below threshold
+        self.max_ldiff = 0
+        while self.max_ldiff < 128 and \
+                length_score(self.max_ldiff + 1) < threshold:
+            self.max_ldiff += 1
+
+    def add(self, name, digest):
+        header = parse_header(digest)
+        # Digests we cannot parse are always compared
+        lvalue = None if header is None else header[1]
+        self.lvalues[name] = lvalue
+        self.buckets[lvalue][name] = (next(self.order), header, digest)
+
+    def remove(self, name):
+        del self.buckets[self.lvalues.pop(name)][name]
+
+    def candidates(self, header):
+        if header is None:
+            for bucket in list(self.buckets.values()):
+                yield from bucket.items()
+            return
+
+        lvalue = header[1]
+        lvalues = set()
+        for d in range(self.max_ldiff + 1):
+            lvalues.add((lvalue + d) % 256)
+            lvalues.add((lvalue - d) % 256)
+        lvalues.add(None)
+
+        for x in lvalues:
+            for name, (order, other, digest) in self.buckets.get(x, {}).items():
+                if other is not None and \
+                        header_distance(header, other) >= self.threshold:
+                    continue
+                yield name, (order, other, digest)
+
+    def best_match(self, digest):
+        """
+        Return the (score, name) of the candidate closest to `digest` if it
+        is under the threshold; the earliest added wins ties.
+        """
+
+        best = None
+        for name, (order, _, other) in self.candidates(parse_header(digest)):
+            score = tlsh.diff(digest, other)
+            if score < self.threshold and \
+                    (best is None or (score, order) < best[:2]):
+                best = score, order, name
+
+        if best is None:
+            return None
+
+        return best[0], best[2]
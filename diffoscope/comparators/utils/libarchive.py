@@ -93,6 +93,22 @@ def list_libarchive(path):
             yield '{strmode} {entry.nlink:>3} {user:>8} {group:>8} {size_or_dev:>8} {mtime:>8} {name_and_link}\n'.format(strmode=entry.strmode.decode('us-ascii'), entry=entry, user=user, group=group, size_or_dev=size_or_dev, mtime=mtime, name_and_link=name_and_link)
 
 
+class LibarchiveEntry(object):
+    """
+    The metadata we need from a libarchive entry, which is only valid while
+    the archive is being read.
+    """
+
+    __slots__ = (
+        'pathname', 'isdir', 'issym', 'isblk', 'ischr', 'linkpath', 'mode',
+        'rdevmajor', 'rdevminor',
+    )
+
+    def __init__(self, entry):
+        for x in self.__slots__:
+            setattr(self, x, getattr(entry, x))
+
+
 class LibarchiveMember(ArchiveMember):
     def __init__(self, archive, entry):
         super().__init__(archive, entry.pathname)
@@ -174,18 +190,44 @@ class LibarchiveContainer(Archive):
         return self._members.keys()
 
     def get_member(self, member_name):
-        with libarchive.file_reader(self.source.path) as archive:
-            for entry in archive:
-                if entry.pathname == member_name:
-                    return self.get_subclass(entry)
-        raise KeyError('%s not found in archive', member_name)
+        try:
+            entry = self.get_entries()[member_name]
+        except KeyError:
+            raise KeyError('%s not found in archive', member_name)
+        return self.get_subclass(entry)
 
     def get_filtered_members(self):
-        with libarchive.file_reader(self.source.path) as archive:
-            for entry in archive:
-                if any_excluded(entry.pathname):
-                    continue
-                yield entry.pathname, self.get_subclass(entry)
+        self.get_entries()
+        for entry in self._entry_list:
+            if any_excluded(entry.pathname):
+                continue
+            yield entry.pathname, self.get_subclass(entry)
+
+    def get_entries(self):
+        """
+        Returns a mapping of archive path to a LibarchiveEntry describing it.
+        The archive is only read the first time.
+        """
+        if not hasattr(self, '_entries'):
+            with libarchive.file_reader(self.source.path) as archive:
+                for _ in self.index_entries(archive):
+                    pass
+        return self._entries
+
+    def index_entries(self, entries):
+        """
+        Builds the entry index from a pass over the archive, passing each
+        live entry on to the caller.
+        """
+        self._entry_list = []
+        entries_by_name = {}
+        for entry in entries:
+            x = LibarchiveEntry(entry)
+            self._entry_list.append(x)
+            # As with a linear scan, the first entry wins for duplicate names
+            entries_by_name.setdefault(x.pathname, x)
+            yield entry
+        self._entries = entries_by_name
 
     def extract(self, member_name, dest_dir):
         self.ensure_unpacked()
@@ -211,6 +253,9 @@ class LibarchiveContainer(Archive):
         logger.debug("Extracting %s to %s", self.source.path, tmpdir)
 
         with libarchive.file_reader(self.source.path) as archive:
+            # Index the entries on the way if we have not done so already
+            if not hasattr(self, '_entries'):
+                archive = self.index_entries(archive)
             for idx, entry in enumerate(archive):
                 # Always skip directories
                 if entry.isdir:
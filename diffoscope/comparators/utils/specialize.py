@@ -18,6 +18,7 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import logging
+import collections
 
 from diffoscope.profiling import profile
 
@@ -27,13 +28,31 @@ logger = logging.getLogger(__name__)
 
 
 def specialize(file):
-    for cls in ComparatorManager().classes:
-        if isinstance(file, cls):
+    index = SpecializeIndex.get(ComparatorManager().comparators)
+    candidates = None
+
+    for idx, comparator in enumerate(index.comparators):
+        # Only an imported class can have instances
+        cls = comparator.imported()
+        if cls is not None and isinstance(file, cls):
             return file
 
         # Does this file class match?
         with profile('recognizes', file):
-            if not cls.recognizes(file):
+            if comparator.if_imported and cls is None:
+                continue
+
+            if idx in index.indexed:
+                if candidates is None:
+                    candidates = index.candidates(file)
+                if idx not in candidates:
+                    continue
+
+            cls = comparator.load()
+
+            # We may have already run exactly the tests of File.recognizes
+            if not (idx in index.indexed and comparator.exact) and \
+                    not cls.recognizes(file):
                 continue
 
         # Found a match; perform type magic
@@ -46,3 +65,76 @@ def specialize(file):
     logger.debug("Unidentified file. Magic says: %s", file.magic_file_type)
 
     return file
+
+
+class SpecializeIndex(object):
+    """
+    Precomputed dispatch over the suffix, header prefix and file type regex
+    that ComparatorManager.RECOGNIZES declares for each comparator, so that
+    each of these tests is run once per file rather than once per class and
+    without importing the comparators.
+    """
+
+    _cache = None
+
+    @classmethod
+    def get(cls, comparators):
+        # Rebuild whenever ComparatorManager reloads its comparators
+        if cls._cache is None or cls._cache.comparators is not comparators:
+            cls._cache = cls(comparators)
+        return cls._cache
+
+    def __init__(self, comparators):
+        self.comparators = comparators
+        self.indexed = set()
+
+        self.suffixes = collections.defaultdict(set)
+        self.prefixes = collections.defaultdict(set)
+        self.regexes = collections.OrderedDict()
+        self.no_suffix = set()
+        self.no_file_type = set()
+
+        for idx, x in enumerate(comparators):
+            if not x.indexed:
+                continue
+            self.indexed.add(idx)
+
+            if x.suffix:
+                self.suffixes[x.suffix].add(idx)
+            else:
+                self.no_suffix.add(idx)
+
+            if x.header_prefix:
+                self.prefixes[x.header_prefix].add(idx)
+            if x.file_type_re:
+                self.regexes.setdefault(x.file_type_re, set()).add(idx)
+            if not x.header_prefix and not x.file_type_re:
+                self.no_file_type.add(idx)
+
+        self.suffix_lengths = sorted({len(x) for x in self.suffixes})
+        self.prefix_lengths = sorted({len(x) for x in self.prefixes})
+
+    def candidates(self, file):
+        """
+        Returns the indexes of the indexed comparators whose tests pass, in
+        the manner of File.recognizes.
+        """
+
+        name = file.name
+        result = set(self.no_suffix)
+        for x in self.suffix_lengths:
+            result.update(self.suffixes.get(name[-x:], ()))
+        if not result:
+            return result
+
+        matched = set(self.no_file_type)
+        if self.prefixes:
+            header = file.file_header
+            for x in self.prefix_lengths:
+                matched.update(self.prefixes.get(header[:x], ()))
+        for regex, idxs in self.regexes.items():
+            if (idxs & result) - matched and \
+                    regex.search(file.magic_file_type):
+                matched.update(idxs)
+
+        return result & matched
@@ -20,9 +20,9 @@
 import re
 import os.path
 import logging
-import subprocess
 
 from diffoscope.tools import tool_required
+from diffoscope.executor import check_call
 
 from .utils.file import File
 from .utils.archive import Archive
@@ -45,7 +45,7 @@ class XzContainer(Archive):
         dest_path = os.path.join(dest_dir, member_name)
         logger.debug('xz extracting to %s', dest_path)
         with open(dest_path, 'wb') as fp:
-            subprocess.check_call(
+            check_call(
                 ["xz", "--decompress", "--stdout", self.source.path],
                 shell=False, stdout=fp, stderr=None)
         return dest_path
@@ -23,6 +23,10 @@ class Config(object):
     # GNU diff cannot process arbitrary large files :(
     max_diff_input_lines = 2 ** 22
     max_diff_block_lines_saved = float("inf")
+    # ... but smaller inputs can be compared without forking it
+    max_diff_in_process_lines = 2 ** 9 # 512 lines
+    # larger diffs are kept on disk rather than in memory
+    max_diff_in_memory_size = 2 ** 24 # 16M characters
 
     # hard limits, restricts single-file and multi-file formats
     max_report_size = 40 * 2 ** 20 # 40 MB
@@ -43,6 +47,15 @@ class Config(object):
     exclude_directory_metadata = False
     compute_visual_diffs = False
     max_container_depth = 50
+    jobs = 1
+    max_processes = 0
+    command_timeout = 0
+    # time.monotonic() after which no more external commands are run
+    deadline = None
+    max_command_memory = 0
+    cache_dir = None
+    max_cache_size = 2 ** 30 # 1 GiB
+    checkpoint = None
 
     _singleton = {}
 
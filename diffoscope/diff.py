@@ -20,6 +20,7 @@
 import re
 import io
 import os
+import array
 import errno
 import fcntl
 import hashlib
@@ -29,10 +30,13 @@ import subprocess
 
 from multiprocessing.dummy import Queue
 
-from diffoscope.tempfiles import get_temporary_directory
+from diffoscope.tempfiles import get_temporary_directory, \
+    get_named_temporary_file
 
 from .tools import tool_required
+from .myers import unified_diff, diff_sequences
 from .config import Config
+from .executor import limit_processes
 
 DIFF_CHUNK = 4096
 
@@ -40,17 +44,236 @@ logger = logging.getLogger(__name__)
 re_diff_change = re.compile(r'^([+-@]).*', re.MULTILINE)
 
 
+class SpilledDiff(object):
+    """
+    A unified diff that was too large to be kept in memory. It is stored as
+    UTF-8 in a temporary file, possibly shared with other diffs, and read
+    back lazily; it otherwise behaves like the str it replaces as far as
+    Difference and the presenters need.
+    """
+
+    def __init__(self, f, length, offset=0, size=None):
+        self._file = f
+        self._length = length
+        self._offset = offset
+        self._size = os.fstat(f.fileno()).st_size - offset \
+            if size is None else size
+
+    def __repr__(self):
+        return "<SpilledDiff %s at %d (%d characters)>" % (
+            self._file.name,
+            self._offset,
+            len(self),
+        )
+
+    def __reduce__(self):
+        # Reopened by name, eg. by the processes rendering --html-dir pages
+        return open_spilled_diff, \
+            (self._file.name, self._length, self._offset, self._size)
+
+    def __len__(self):
+        return self._length
+
+    def __str__(self):
+        return self.data().decode('utf-8')
+
+    def __eq__(self, other):
+        if isinstance(other, SpilledDiff):
+            return len(self) == len(other) and self.data() == other.data()
+        if isinstance(other, str):
+            return len(self) == len(other) and str(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def data(self, start=0, size=None):
+        """
+        Returns `size` bytes of the diff from `start`, or the rest of it.
+        """
+
+        end = self._size if size is None else min(start + size, self._size)
+        return os.pread(
+            self._file.fileno(),
+            max(end - start, 0),
+            self._offset + start,
+        )
+
+    def chunks(self, size=2 ** 16):
+        """
+        Yield the diff as strings of about `size` bytes of complete lines.
+        """
+
+        start = 0
+        while start < self._size:
+            data = self.data(start, size)
+            while start + len(data) < self._size:
+                stop = data.rfind(b'\n') + 1
+                if stop:
+                    data = data[:stop]
+                    break
+                data += self.data(start + len(data), size)
+            yield data.decode('utf-8')
+            start += len(data)
+
+    def splitlines(self, keepends=False):
+        for chunk in self.chunks():
+            yield from chunk.splitlines(keepends)
+
+
+def open_spilled_diff(path, length, offset=0, size=None):
+    return SpilledDiff(open(path, 'rb'), length, offset, size)
+
+
+class DiffBuffer(object):
+    """
+    Accumulates a unified diff in memory, spilling it to a temporary file once
+    it exceeds `max_size` characters. If `spool` is given, diffs are spilled
+    by appending them to that file instead.
+    """
+
+    def __init__(self, max_size=None, spool=None):
+        self._max_size = Config().max_diff_in_memory_size \
+            if max_size is None else max_size
+        self._spool = spool
+        self._buf = []
+        self._length = 0
+        self._file = None
+        self._offset = 0
+
+    def write(self, s):
+        self._length += len(s)
+
+        if self._file is not None:
+            self._file.write(s.encode('utf-8'))
+            return
+
+        self._buf.append(s)
+
+        if self._length > self._max_size:
+            if self._spool is None:
+                self._file = get_named_temporary_file(mode='w+b')
+            else:
+                self._file = self._spool
+                self._offset = self._file.seek(0, io.SEEK_END)
+            for x in self._buf:
+                self._file.write(x.encode('utf-8'))
+            self._buf = None
+
+    def getvalue(self):
+        if self._file is None:
+            return ''.join(self._buf)
+
+        self._file.flush()
+
+        return SpilledDiff(
+            self._file,
+            self._length,
+            self._offset,
+            self._file.tell() - self._offset,
+        )
+
+
+def iter_lines(diff):
+    """
+    Yield the lines of a unified diff (a str or a SpilledDiff), including
+    their trailing newline. Unlike str.splitlines, only split on newlines.
+    """
+
+    for chunk in ([diff] if isinstance(diff, str) else diff.chunks()):
+        start = 0
+        while True:
+            end = chunk.find('\n', start) + 1
+            if not end:
+                if start < len(chunk):
+                    yield chunk[start:]
+                break
+            yield chunk[start:end]
+            start = end
+
+
+class DiffIndex(object):
+    """
+    A compact, parsed representation of a unified diff: the type of each line
+    (its first character, or FILE_HEADER for `---`/`+++` lines) as a byte and
+    the offset at which each line starts.
+    """
+
+    FILE_HEADER = ord('F')
+    HUNK_HEADER = ord('@')
+    CONTEXT = ord(' ')
+    REMOVED = ord('-')
+    ADDED = ord('+')
+    NO_NEWLINE = ord('\\')
+
+    def __init__(self, types=None, offsets=None):
+        self.types = bytearray() if types is None else types
+        self.offsets = array.array('q', [0]) if offsets is None else offsets
+
+    def __len__(self):
+        return len(self.types)
+
+    def append(self, line, type_=None):
+        self.types.append(ord(line[:1] or '\n') if type_ is None else type_)
+        self.offsets.append(self.offsets[-1] + len(line))
+
+    @classmethod
+    def from_text(cls, diff):
+        index = cls()
+        remaining = 0
+
+        for line in iter_lines(diff):
+            if remaining <= 0:
+                if line.startswith(('---', '+++')):
+                    index.append(line, cls.FILE_HEADER)
+                    continue
+
+                found = DiffParser.RANGE_RE.match(line.rstrip('\n'))
+                if found:
+                    remaining = int(found.group('len1') or 1) + \
+                        int(found.group('len2') or 1)
+            elif line[0] == ' ':
+                remaining -= 2
+            elif line[0] in '+-':
+                found = DiffParser.REMOVED_RE.match(line, 1)
+                remaining -= int(found.group(1)) if found else 1
+
+            index.append(line)
+
+        return index
+
+    def lines(self, diff, keepends=False):
+        """
+        Yield a (type, line) tuple for each line of the unified diff `diff`
+        that this index describes.
+        """
+
+        if isinstance(diff, str):
+            offsets = self.offsets
+            lines = (
+                diff[offsets[i]:offsets[i + 1]] for i in range(len(self))
+            )
+        else:
+            lines = iter_lines(diff)
+
+        for type_, line in zip(self.types, lines):
+            if not keepends and line.endswith('\n'):
+                line = line[:-1]
+            yield type_, line
+
+
 class DiffParser(object):
     RANGE_RE = re.compile(
         r'^@@\s+-(?P<start1>\d+)(,(?P<len1>\d+))?\s+\+(?P<start2>\d+)(,(?P<len2>\d+))?\s+@@$',
     )
+    REMOVED_RE = re.compile(r'\[ (\d+) lines removed \]$')
 
     def __init__(self, output, end_nl_q1, end_nl_q2):
         self._output = output
         self._end_nl_q1 = end_nl_q1
         self._end_nl_q2 = end_nl_q2
         self._action = self.read_headers
-        self._diff = io.StringIO()
+        self._diff = DiffBuffer()
+        self._index = DiffIndex()
         self._success = False
         self._remaining_hunk_lines = None
         self._block_len = None
@@ -62,6 +285,14 @@ class DiffParser(object):
     def diff(self):
         return self._diff.getvalue()
 
+    @property
+    def index(self):
+        return self._index
+
+    def write(self, line):
+        self._diff.write(line)
+        self._index.append(line)
+
     @property
     def success(self):
         return self._success
@@ -89,7 +320,7 @@ class DiffParser(object):
         if not found:
             raise ValueError('Unable to parse diff headers: %r' % line)
 
-        self._diff.write(line)
+        self.write(line)
         if found.group('len1'):
             self._remaining_hunk_lines = int(found.group('len1'))
         else:
@@ -126,7 +357,7 @@ class DiffParser(object):
         else:
             raise ValueError('Unable to parse diff hunk: %r' % line)
 
-        self._diff.write(line)
+        self.write(line)
 
         if line[0] in ('-', '+'):
             if line[0] == self._direction:
@@ -147,7 +378,7 @@ class DiffParser(object):
         if self._remaining_hunk_lines == 0 or line[0] != self._direction:
             removed = self._block_len - Config().max_diff_block_lines_saved
             if removed:
-                self._diff.write('%s[ %d lines removed ]\n' % (
+                self.write('%s[ %d lines removed ]\n' % (
                     self._direction,
                     removed,
                 ))
@@ -165,15 +396,17 @@ def run_diff(fifo1, fifo2, end_nl_q1, end_nl_q2):
 
     logger.debug("Running %s", ' '.join(cmd))
 
-    p = subprocess.Popen(
-        cmd,
-        bufsize=1,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-    )
-    parser = DiffParser(p.stdout, end_nl_q1, end_nl_q2)
-    parser.parse()
-    p.wait()
+    # Already counted if comparing the output of commands
+    with limit_processes(1, 'diff'):
+        p = subprocess.Popen(
+            cmd,
+            bufsize=1,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        parser = DiffParser(p.stdout, end_nl_q1, end_nl_q2)
+        parser.parse()
+        p.wait()
 
     logger.debug(
         "%s: returncode %d, parsed %s",
@@ -188,16 +421,94 @@ def run_diff(fifo1, fifo2, end_nl_q1, end_nl_q2):
     if p.returncode == 0:
         return None
 
-    return parser.diff
+    return parser.diff, parser.index
+
+
+def run_unidiff(content1, content2, end_nl_q1, end_nl_q2):
+    if content1 == content2:
+        return None
+
+    parser = DiffParser(
+        unified_diff(content1, content2, context=7),
+        end_nl_q1,
+        end_nl_q2,
+    )
+    parser.parse()
+
+    return parser.diff, parser.index
+
+
+class FeederSwitch(object):
+    """
+    Decides whether the output of two feeders is compared in-process or by
+    diff(1). Feeders buffer their output in memory until either side exceeds
+    `max_lines` lines, in which case both are streamed through FIFOs instead.
+    """
+
+    def __init__(self, max_lines):
+        self.max_lines = max_lines
+        self.fifo_paths = None
+        self._cond = threading.Condition()
+        self._decided = False
+        self._finished = 0
+
+        if not max_lines:
+            self.use_fifos()
+
+    def use_fifos(self):
+        with self._cond:
+            if self.fifo_paths is None:
+                tmpdir = get_temporary_directory().name
+                fifo_paths = [
+                    os.path.join(tmpdir, 'fifo1'),
+                    os.path.join(tmpdir, 'fifo2'),
+                ]
+                for x in fifo_paths:
+                    os.mkfifo(x)
+                self.fifo_paths = fifo_paths
+                self._cond.notify_all()
+
+            return self.fifo_paths
+
+    def finished(self):
+        """
+        Called by each feeder once it has finished; returns whether it
+        should write its buffered output to its FIFO.
+        """
+
+        with self._cond:
+            self._finished += 1
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: self._decided)
+
+            return self.fifo_paths is not None
+
+    def decide(self):
+        """
+        Wait until either both feeders have finished within the limit or one
+        has exceeded it. Returns the FIFO paths in the latter case.
+        """
+
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.fifo_paths is not None or self._finished == 2
+            )
+            self._decided = True
+            self._cond.notify_all()
+
+            return self.fifo_paths
 
 
 class FIFOFeeder(threading.Thread):
-    def __init__(self, feeder, fifo_path, end_nl_q=None, daemon=True, *args):
-        os.mkfifo(fifo_path)
+    def __init__(self, feeder, switch, index, end_nl_q=None, daemon=True, *args):
         super().__init__(daemon=daemon)
         self.feeder = feeder
-        self.fifo_path = fifo_path
+        self.switch = switch
+        self.index = index
         self.end_nl_q = Queue() if end_nl_q is None else end_nl_q
+        self._buf = io.BytesIO()
+        self._line_count = 0
+        self._fifo = None
         self._exception = None
         self._want_join = threading.Event()
 
@@ -208,32 +519,68 @@ class FIFOFeeder(threading.Thread):
     def __exit__(self, exc_type, exc_value, exc_tb):
         self.join()
 
+    @property
+    def content(self):
+        return self._buf.getvalue()
+
+    def write(self, data):
+        if self._fifo is not None:
+            self._fifo.write(data)
+            return
+
+        self._buf.write(data)
+        self._line_count += data.count(b'\n')
+
+        if self._line_count > self.switch.max_lines or \
+                self.switch.fifo_paths is not None:
+            self.open_fifo()
+
+    def open_fifo(self):
+        fifo_path = self.switch.use_fifos()[self.index]
+
+        # Try to open the FIFO nonblocking, so we can periodically check if
+        # the main thread wants us to wind down.  If it does, there's no more
+        # need for the FIFO, so discard the rest of the output.
+        while True:
+            try:
+                fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as error:
+                if error.errno != errno.ENXIO:
+                    raise
+                elif self._want_join.is_set():
+                    self._fifo = open(os.devnull, 'wb')
+                    return
+            else:
+                break
+
+        # Now clear the fd's nonblocking flag to let writes block normally.
+        fcntl.fcntl(fd, fcntl.F_SETFL, 0)
+
+        self._fifo = open(fd, 'wb')
+        self._fifo.write(self._buf.getvalue())
+        self._buf = None
+
     def run(self):
         try:
-            # Try to open the FIFO nonblocking, so we can periodically check
-            # if the main thread wants us to wind down.  If it does, there's no
-            # more need for the FIFO, so stop the thread.
-            while True:
-                try:
-                    fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
-                except OSError as error:
-                    if error.errno != errno.ENXIO:
-                        raise
-                    elif self._want_join.is_set():
-                        return
-                else:
-                    break
-
-            # Now clear the fd's nonblocking flag to let writes block normally.
-            fcntl.fcntl(fd, fcntl.F_SETFL, 0)
+            try:
+                if self.switch.fifo_paths is not None:
+                    self.open_fifo()
 
-            with open(fd, 'wb') as fifo:
                 # The queue works around a unified diff limitation: if there's
                 # no newlines in both don't make it a difference
-                end_nl = self.feeder(fifo)
-                self.end_nl_q.put(end_nl)
+                end_nl = self.feeder(self)
+            finally:
+                # Even on error, diff(1) must be able to open our FIFO
+                if self.switch.finished() and self._fifo is None:
+                    self.open_fifo()
+            self.end_nl_q.put(end_nl)
         except Exception as error:
             self._exception = error
+            # Don't leave the diff parser waiting; the error is raised on join()
+            self.end_nl_q.put(False)
+        finally:
+            if self._fifo is not None:
+                self._fifo.close()
 
     def join(self):
         self._want_join.set()
@@ -243,45 +590,93 @@ class FIFOFeeder(threading.Thread):
 
 
 def diff(feeder1, feeder2):
-    tmpdir = get_temporary_directory().name
+    switch = FeederSwitch(Config().max_diff_in_process_lines)
+
+    with FIFOFeeder(feeder1, switch, 0) as fifo1, \
+            FIFOFeeder(feeder2, switch, 1) as fifo2:
+        fifo_paths = switch.decide()
+        if fifo_paths is not None:
+            return run_diff(
+                fifo_paths[0],
+                fifo_paths[1],
+                fifo1.end_nl_q,
+                fifo2.end_nl_q,
+            )
+
+    # Both inputs are small enough to be compared without forking diff(1)
+    return run_unidiff(
+        fifo1.content,
+        fifo2.content,
+        fifo1.end_nl_q,
+        fifo2.end_nl_q,
+    )
 
-    fifo1_path = os.path.join(tmpdir, 'fifo1')
-    fifo2_path = os.path.join(tmpdir, 'fifo2')
-    with FIFOFeeder(feeder1, fifo1_path) as fifo1, \
-            FIFOFeeder(feeder2, fifo2_path) as fifo2:
-        return run_diff(fifo1_path, fifo2_path, fifo1.end_nl_q, fifo2.end_nl_q)
 
+def reverse_unified_diff(diff, index=None, reversed_index=None):
+    """
+    Swap the sides of the unified diff `diff`. If given, `reversed_index` is
+    filled in to describe the result; hunk headers are rewritten in canonical
+    form so may not keep their length.
+    """
 
-def reverse_unified_diff(diff):
-    res = []
-    for line in diff.splitlines(keepends=True):
-        found = DiffParser.RANGE_RE.match(line)
+    if index is None:
+        index = DiffIndex.from_text(diff)
+
+    res = DiffBuffer()
+
+    def write(line, type_):
+        res.write(line)
+        if reversed_index is not None:
+            reversed_index.append(line, type_)
+
+    for type_, line in index.lines(diff, keepends=True):
+        if type_ == DiffIndex.HUNK_HEADER:
+            found = DiffParser.RANGE_RE.match(line)
+
+            if found:
+                before = found.group('start2')
+                if found.group('len2') is not None:
+                    before += ',' + found.group('len2')
 
-        if found:
-            before = found.group('start2')
-            if found.group('len2') is not None:
-                before += ',' + found.group('len2')
-
-            after = found.group('start1')
-            if found.group('len1') is not None:
-                after += ',' + found.group('len1')
-
-            res.append('@@ -%s +%s @@\n' % (before, after))
-        elif line.startswith('-'):
-            res.append('+')
-            res.append(line[1:])
-        elif line.startswith('+'):
-            res.append('-')
-            res.append(line[1:])
+                after = found.group('start1')
+                if found.group('len1') is not None:
+                    after += ',' + found.group('len1')
+
+                write('@@ -%s +%s @@\n' % (before, after), type_)
+                continue
+
+        if type_ == DiffIndex.REMOVED:
+            write('+' + line[1:], DiffIndex.ADDED)
+        elif type_ == DiffIndex.ADDED:
+            write('-' + line[1:], DiffIndex.REMOVED)
         else:
-            res.append(line)
-    return ''.join(res)
+            write(line, type_)
+    return res.getvalue()
 
 
-def color_unified_diff(diff):
+def color_unified_diff(diff, index=None):
     RESET = '\033[0m'
     RED, GREEN, CYAN = '\033[31m', '\033[32m', '\033[0;36m'
 
+    if index is not None:
+        colors = {
+            DiffIndex.REMOVED: RED,
+            DiffIndex.HUNK_HEADER: CYAN,
+            DiffIndex.ADDED: GREEN,
+        }
+        res = []
+        for type_, line in index.lines(diff, keepends=True):
+            if type_ == DiffIndex.FILE_HEADER:
+                type_ = ord(line[0])
+            color = colors.get(type_)
+            if color is None:
+                res.append(line)
+            elif line.endswith('\n'):
+                res.append('{}{}{}\n'.format(color, line[:-1], RESET))
+            else:
+                res.append('{}{}{}'.format(color, line, RESET))
+        return ''.join(res)
+
     def repl(m):
         return '{}{}{}'.format({
             '-': RED,
@@ -293,11 +688,14 @@ def color_unified_diff(diff):
 
 DIFFON = "\x01"
 DIFFOFF = "\x02"
-MAX_WF_SIZE = 1024 # any higher, and linediff takes >1 second and >200MB RAM
+# Inputs are compared with a linear-space O(ND) algorithm whose effort is
+# bounded, so this can be fairly large.
+MAX_LINEDIFF_SIZE = 2 ** 16
+LINEDIFF_TOO_EXPENSIVE = 256
+LINEDIFF_MAX_COST = 2 ** 18
 
-def _linediff_sane(x):
-    # turn non-printable chars into "."
-    return "." if ord(x) < 32 and x not in '\t\n' else x
+# turn non-printable chars into "."
+_LINEDIFF_SANE = {x: '.' for x in range(32) if chr(x) not in '\t\n'}
 
 def diffinput_truncate(s, sz):
     # Truncate, preserving uniqueness
@@ -307,7 +705,7 @@ def diffinput_truncate(s, sz):
     return s
 
 def linediff(s, t, diffon, diffoff):
-    # calculate common prefix/suffix, easy optimisation to WF
+    # calculate common prefix/suffix, easy optimisation
     prefix = os.path.commonprefix((s, t))
     if prefix:
         s = s[len(prefix):]
@@ -317,92 +715,49 @@ def linediff(s, t, diffon, diffoff):
         s = s[:-len(suffix)]
         t = t[:-len(suffix)]
 
-    # truncate so WF doesn't blow up RAM
-    s = diffinput_truncate(s, MAX_WF_SIZE)
-    t = diffinput_truncate(t, MAX_WF_SIZE)
-    l1, l2 = zip(*linediff_simplify(linediff_wagnerfischer(s, t)))
+    # truncate so very long lines don't take too long
+    s = diffinput_truncate(s, MAX_LINEDIFF_SIZE)
+    t = diffinput_truncate(t, MAX_LINEDIFF_SIZE)
+    changed1, changed2 = diff_sequences(
+        s,
+        t,
+        LINEDIFF_TOO_EXPENSIVE,
+        LINEDIFF_MAX_COST,
+    )
 
-    def to_string(k, v):
-        sanev = "".join(_linediff_sane(c) for c in v)
-        return (diffon + sanev + diffoff) if k else sanev
-    s1 = ''.join(to_string(*p) for p in l1)
-    t1 = ''.join(to_string(*p) for p in l2)
+    s1 = linediff_markup(s, changed1, diffon, diffoff)
+    t1 = linediff_markup(t, changed2, diffon, diffoff)
     return prefix + s1 + suffix, prefix + t1 + suffix
 
-def linediff_wagnerfischer(s, t):
-    '''
-    Line diff algorithm, originally from diff2html.
-
-    https://en.wikipedia.org/wiki/Wagner%E2%80%93Fischer_algorithm
-
-    Finds the minimum (levenshtein) edit distance between two strings, but has
-    quadratic performance O(m*n).
-    '''
-    m, n = len(s), len(t)
-    d = [[(0, 0) for i in range(n+1)] for i in range(m+1)]
+def linediff_markup(s, changed, diffon, diffoff):
+    """
+    Wrap each run of characters of `s` flagged in `changed` with `diffon`
+    and `diffoff`.
+    """
+    result = []
+    start = 0
+    while start < len(s):
+        on = changed.find(1, start)
+        if on < 0:
+            on = len(s)
+        result.append(s[start:on].translate(_LINEDIFF_SANE))
+        if on == len(s):
+            break
+        off = changed.find(0, on)
+        if off < 0:
+            off = len(s)
+        result.append(diffon + s[on:off].translate(_LINEDIFF_SANE) + diffoff)
+        start = off
+    return ''.join(result)
 
-    d[0][0] = (0, (0, 0))
-    for i in range(1, m+1):
-        d[i][0] = (i, (i-1, 0))
-    for j in range(1, n+1):
-        d[0][j] = (j, (0, j-1))
-
-    for i in range(1, m+1):
-        for j in range(1, n+1):
-            if s[i-1] == t[j-1]:
-                cost = 0
-            else:
-                cost = 1
-            d[i][j] = min((d[i-1][j][0] + 1, (i-1, j)),
-                          (d[i][j-1][0] + 1, (i, j-1)),
-                          (d[i-1][j-1][0] + cost, (i-1, j-1)))
-
-    l = []
-    coord = (m, n)
-    while coord != (0, 0):
-        l.insert(0, coord)
-        x, y = coord
-        coord = d[x][y][1]
-
-    for coord in l:
-        cx, cy = coord
-        child_val = d[cx][cy][0]
-
-        father_coord = d[cx][cy][1]
-        fx, fy = father_coord
-        father_val = d[fx][fy][0]
-
-        diff = (cx-fx, cy-fy)
-
-        if diff == (0, 1):
-            yield (False, ""), (True, t[fy])
-        elif diff == (1, 0):
-            yield (True, s[fx]), (False, "")
-        elif child_val-father_val == 1:
-            yield (True, s[fx]), (True, t[fy])
-        else:
-            assert s[fx] == t[fy]
-            yield (False, s[fx]), (False, t[fy])
-
-def linediff_simplify(g):
-    """Simplify the output of WF."""
-    current = None
-    for l, r in g:
-        if not current:
-            current = l, r
-        elif current[0][0] == l[0] and current[1][0] == r[0]:
-            current = (l[0], current[0][1] + l[1]), (r[0], current[1][1] + r[1])
-        else:
-            yield current
-            current = l, r
-    if current:
-        yield current
 
 class SideBySideDiff(object):
     """Calculates a side-by-side diff from a unified diff."""
 
-    def __init__(self, unified_diff, diffon=DIFFON, diffoff=DIFFOFF):
+    def __init__(self, unified_diff, diffon=DIFFON, diffoff=DIFFOFF, index=None):
         self.unified_diff = unified_diff
+        self.index = DiffIndex.from_text(unified_diff) \
+            if index is None else index
         self.diffon = diffon
         self.diffoff = diffoff
         self.reset()
@@ -464,12 +819,14 @@ class SideBySideDiff(object):
 
         yield "L", (type_name, s1, self.line1, s2, self.line2)
 
-        m = orig1 and re.match(r"^\[ (\d+) lines removed \]$", orig1)
+        m = orig1 and orig1.startswith('[') and \
+            re.match(r"^\[ (\d+) lines removed \]$", orig1)
         if m:
             self.line1 += int(m.group(1))
         elif orig1:
             self.line1 += 1
-        m = orig2 and re.match(r"^\[ (\d+) lines removed \]$", orig2)
+        m = orig2 and orig2.startswith('[') and \
+            re.match(r"^\[ (\d+) lines removed \]$", orig2)
         if m:
             self.line2 += int(m.group(1))
         elif orig2:
@@ -500,18 +857,14 @@ class SideBySideDiff(object):
         """
         self.reset()
 
-        for l in self.unified_diff.splitlines():
+        for t, l in self.index.lines(self.unified_diff):
             self._bytes_processed += len(l) + 1
-            m = re.match(r'^--- ([^\s]*)', l)
-            if m:
-                yield from self.empty_buffer()
-                continue
-            m = re.match(r'^\+\+\+ ([^\s]*)', l)
-            if m:
+            if t == DiffIndex.FILE_HEADER:
                 yield from self.empty_buffer()
                 continue
 
-            m = re.match(r"@@ -(\d+),?(\d*) \+(\d+),?(\d*)", l)
+            m = t == DiffIndex.HUNK_HEADER and \
+                re.match(r"@@ -(\d+),?(\d*) \+(\d+),?(\d*)", l)
             if m:
                 yield from self.empty_buffer()
                 hunk_data = map(lambda x:x=="" and 1 or int(x), m.groups())
@@ -520,11 +873,11 @@ class SideBySideDiff(object):
                 yield "H", (self.hunk_off1, self.hunk_size1, self.hunk_off2, self.hunk_size2)
                 continue
 
-            if re.match(r'^\[', l):
+            if l.startswith('['):
                 yield from self.empty_buffer()
                 yield "C", l
 
-            if re.match(r"^\\ No newline", l):
+            if t == DiffIndex.NO_NEWLINE and l.startswith("\\ No newline"):
                 if self.hunk_size2 == 0:
                     self.buf[-1] = (self.buf[-1][0], self.buf[-1][1] + '\n' + l[2:])
                 else:
@@ -535,33 +888,29 @@ class SideBySideDiff(object):
                 yield from self.empty_buffer()
                 continue
 
-            m = re.match(r"^\+\[ (\d+) lines removed \]$", l)
-            if m:
-                self.add_cpt += int(m.group(1))
-                self.hunk_size2 -= int(m.group(1))
-                self.buf.append((None, l[1:]))
-                continue
-
-            if re.match(r"^\+", l):
-                self.add_cpt += 1
-                self.hunk_size2 -= 1
+            if t == DiffIndex.ADDED:
+                m = l.startswith('+[') and DiffParser.REMOVED_RE.match(l, 1)
+                if m:
+                    self.add_cpt += int(m.group(1))
+                    self.hunk_size2 -= int(m.group(1))
+                else:
+                    self.add_cpt += 1
+                    self.hunk_size2 -= 1
                 self.buf.append((None, l[1:]))
                 continue
 
-            m = re.match(r"^-\[ (\d+) lines removed \]$", l)
-            if m:
-                self.del_cpt += int(m.group(1))
-                self.hunk_size1 -= int(m.group(1))
-                self.buf.append((l[1:], None))
-                continue
-
-            if re.match(r"^-", l):
-                self.del_cpt += 1
-                self.hunk_size1 -= 1
+            if t == DiffIndex.REMOVED:
+                m = l.startswith('-[') and DiffParser.REMOVED_RE.match(l, 1)
+                if m:
+                    self.del_cpt += int(m.group(1))
+                    self.hunk_size1 -= int(m.group(1))
+                else:
+                    self.del_cpt += 1
+                    self.hunk_size1 -= 1
                 self.buf.append((l[1:], None))
                 continue
 
-            if re.match(r"^ ", l) and self.hunk_size1 and self.hunk_size2:
+            if t == DiffIndex.CONTEXT and self.hunk_size1 and self.hunk_size2:
                 yield from self.empty_buffer()
                 self.hunk_size1 -= 1
                 self.hunk_size2 -= 1
@@ -17,20 +17,25 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import heapq
 import logging
+import functools
+import itertools
 
 from . import feeders
 from .exc import RequiredToolNotFound
-from .diff import diff, reverse_unified_diff
+from .diff import diff, reverse_unified_diff, DiffIndex
+from .executor import gather, limit_processes
 from .excludes import command_excluded
 
 logger = logging.getLogger(__name__)
 
 
 class Difference(object):
-    def __init__(self, unified_diff, path1, path2, source=None, comment=None, has_internal_linenos=False, details=None):
+    def __init__(self, unified_diff, path1, path2, source=None, comment=None, has_internal_linenos=False, details=None, diff_index=None):
         self._unified_diff = unified_diff
+        self._diff_index = diff_index
 
         self._comments = []
         if comment:
@@ -60,6 +65,7 @@ class Difference(object):
         # Whether the unified_diff already contains line numbers inside itself
         self._has_internal_linenos = has_internal_linenos
         self._details = details or []
+        self._lazy_details = None
         self._visuals = []
         self._size_cache = None
 
@@ -79,8 +85,14 @@ class Difference(object):
             )
 
         diff = self.unified_diff
+        diff_index = None
         if diff is not None:
-            diff = reverse_unified_diff(self.unified_diff)
+            diff_index = DiffIndex()
+            diff = reverse_unified_diff(
+                self.unified_diff,
+                self.diff_index,
+                diff_index,
+            )
 
         return Difference(
             diff,
@@ -88,7 +100,8 @@ class Difference(object):
             self.source1,
             comment=self.comments,
             has_internal_linenos=self.has_internal_linenos,
-            details=[d.get_reverse() for d in self._details],
+            details=[d.get_reverse() for d in self.details],
+            diff_index=diff_index,
         )
 
     def equals(self, other):
@@ -120,12 +133,12 @@ class Difference(object):
         Useful for e.g. choosing whether to display [+]/[-] controls.
         """
         return (self._unified_diff is not None or
-                self._comments or self._details or self._visuals)
+                self._comments or self.has_details() or self._visuals)
 
     def traverse_depth(self, depth=-1):
         yield self
         if depth != 0:
-            for d in self._details:
+            for d in self.details:
                 yield from d.traverse_depth(depth-1)
 
     def traverse_breadth(self, queue=None):
@@ -133,7 +146,7 @@ class Difference(object):
         if queue:
             top = queue.pop(0)
             yield top
-            queue.extend(top._details)
+            queue.extend(top.details)
             yield from self.traverse_breadth(queue)
 
     def traverse_heapq(self, scorer, yield_score=False, queue=None):
@@ -149,21 +162,23 @@ class Difference(object):
         while queue:
             val, top = heapq.heappop(queue)
             yield ((top, val) if yield_score else top)
-            for d in top._details:
+            for d in top.details:
                 heapq.heappush(queue, (scorer(d, val), d))
 
     @staticmethod
     def from_feeder(feeder1, feeder2, path1, path2, source=None, comment=None, **kwargs):
         try:
-            unified_diff = diff(feeder1, feeder2)
-            if not unified_diff:
+            result = diff(feeder1, feeder2)
+            if not result or not result[0]:
                 return None
+            unified_diff, diff_index = result
             return Difference(
                 unified_diff,
                 path1,
                 path2,
                 source,
                 comment,
+                diff_index=diff_index,
                 **kwargs
             )
         except RequiredToolNotFound:
@@ -207,35 +222,41 @@ class Difference(object):
             command_args = kwargs['command_args']
             del kwargs['command_args']
 
-        def command_and_feeder(path):
-            command = None
-            if path == '/dev/null':
-                feeder = feeders.empty()
-            else:
-                command = klass(path, *command_args)
-                feeder = feeders.from_command(command)
-                if command_excluded(command.shell_cmdline()):
-                    return None, None
-                command.start()
-            return feeder, command
-
-        feeder1, command1 = command_and_feeder(path1)
-        feeder2, command2 = command_and_feeder(path2)
-        if not feeder1 or not feeder2:
+        # Deferred as the cache depends on this module
+        from .cache import command_feeder
+
+        commands = [
+            None if x == '/dev/null' else klass(x, *command_args)
+            for x in (path1, path2)
+        ]
+        if any(command_excluded(x.shell_cmdline()) for x in commands if x):
             return None
 
+        command1, command2 = commands
+        source_cmd = command1 or command2
         if 'source' not in kwargs:
-            source_cmd = command1 or command2
             kwargs['source'] = source_cmd.shell_cmdline()
 
-        difference = Difference.from_feeder(
-            feeder1,
-            feeder2,
-            path1,
-            path2,
-            *args,
-            **kwargs
-        )
+        # Both commands must run at the same time to be diffed, so wait until
+        # they can both be started, along with diff(1) itself.
+        with limit_processes(
+            len([x for x in commands if x]) + 1,
+            os.path.basename(source_cmd.cmdline()[0]),
+            klass.MAX_PROCESSES,
+        ):
+            # Either output may be replayed from the cache rather than run
+            feeder1, feeder2 = [
+                command_feeder(x) if x else feeders.empty() for x in commands
+            ]
+
+            difference = Difference.from_feeder(
+                feeder1,
+                feeder2,
+                path1,
+                path2,
+                *args,
+                **kwargs
+            )
         if not difference:
             return None
 
@@ -252,6 +273,19 @@ class Difference(object):
 
         return difference
 
+    @staticmethod
+    def from_commands(klasses, path1, path2, *args, **kwargs):
+        """
+        Like from_command, but for several independent commands which are run
+        concurrently. Returns a list of differences in the order of `klasses`.
+        """
+
+        return gather(*[
+            functools.partial(
+                Difference.from_command, x, path1, path2, *args, **kwargs
+            ) for x in klasses
+        ])
+
     @property
     def comment(self):
         return '\n'.join(self._comments)
@@ -277,14 +311,63 @@ class Difference(object):
     def unified_diff(self):
         return self._unified_diff
 
+    @property
+    def diff_index(self):
+        """
+        The parsed structure of unified_diff, as a DiffIndex. Built on demand
+        if the Difference was not created from the output of diff(1).
+        """
+        if self._diff_index is None and self._unified_diff is not None:
+            self._diff_index = DiffIndex.from_text(self._unified_diff)
+        return self._diff_index
+
     @property
     def has_internal_linenos(self):
         return self._has_internal_linenos
 
     @property
     def details(self):
+        if self._lazy_details is not None:
+            lazy, self._lazy_details = self._lazy_details, None
+            self.add_details(list(lazy))
         return self._details
 
+    def has_details(self):
+        """
+        Whether there are any details, computing at most one of any lazy
+        details to find out.
+        """
+
+        if not self._details and self._lazy_details is not None:
+            for x in self._lazy_details:
+                self._details.append(x)
+                break
+            else:
+                self._lazy_details = None
+        return bool(self._details)
+
+    def has_lazy_details(self):
+        """
+        Whether any details added by add_lazy_details are yet to be
+        computed.
+        """
+
+        return self._lazy_details is not None
+
+    def iter_details(self):
+        """
+        Iterate over the details. Lazy details are computed as they are
+        reached and are not kept afterwards, so that each can be freed once
+        the caller has finished with it. They are then gone for good, so this
+        is only suitable for the last thing to look at the Difference.
+        """
+
+        yield from self._details
+
+        lazy, self._lazy_details = self._lazy_details, None
+        if lazy is not None:
+            yield from lazy
+
     @property
     def visuals(self):
         return self._visuals
@@ -292,7 +375,19 @@ class Difference(object):
     def add_details(self, differences):
         if len([d for d in differences if type(d) is not Difference]) > 0:
             raise TypeError("'differences' must contains Difference objects'")
-        self._details.extend(differences)
+        # Keep the details in order
+        self.details.extend(differences)
+        self._size_cache = None
+
+    def add_lazy_details(self, differences):
+        """
+        Like add_details, but `differences` is an iterator that is not
+        consumed until the details are needed.
+        """
+
+        if self._lazy_details is not None:
+            differences = itertools.chain(self._lazy_details, differences)
+        self._lazy_details = differences
         self._size_cache = None
 
     def add_visuals(self, visuals):
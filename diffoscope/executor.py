@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import logging
+import threading
+import subprocess
+import contextlib
+import concurrent.futures
+
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_local = threading.local()
+_executor = None
+_executor_jobs = None
+_limiters = {}
+
+
+def get_executor():
+    global _executor, _executor_jobs
+
+    jobs = Config().jobs
+
+    with _lock:
+        if _executor_jobs != jobs:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            logger.debug("Starting executor with %d workers", jobs)
+            _executor = concurrent.futures.ThreadPoolExecutor(jobs)
+            _executor_jobs = jobs
+
+    return _executor
+
+
+def gather(*fns):
+    """
+    Call each of the callables in `fns`, possibly concurrently, and return
+    a list of their results in the same order. At most Config().jobs of
+    them run at once; with the default of 1 they are simply called in turn.
+
+    If any of the calls raise an exception, the first one (in the order of
+    `fns`) is re-raised, as if the calls had been performed serially.
+    """
+
+    # Avoid deadlocking by waiting on the executor from one of its own
+    # threads.
+    if len(fns) <= 1 or Config().jobs <= 1 or \
+            getattr(_local, 'in_worker', False):
+        return [x() for x in fns]
+
+    degraded = []
+
+    def worker(fn):
+        _local.in_worker = True
+        with degradable() as is_degraded:
+            try:
+                return fn()
+            finally:
+                if is_degraded():
+                    degraded.append(fn)
+
+    executor = get_executor()
+    futures = [executor.submit(worker, x) for x in fns]
+
+    # Don't leave anything running in the background if one of the calls
+    # fails; the caller may well go on to fall back to another method.
+    concurrent.futures.wait(futures)
+
+    if degraded:
+        degrade()
+
+    return [x.result() for x in futures]
+
+
+def degrade():
+    """
+    Record that the comparison being performed by this thread fell back to
+    a lesser method because a command was cut short by --command-timeout,
+    --deadline or --max-command-memory. Its result depends on more than the
+    inputs and the configuration, so it must not be cached or journalled.
+    """
+
+    _local.degraded = True
+
+
+@contextlib.contextmanager
+def degradable():
+    """
+    Yields a callable telling whether degrade() was called within this
+    context, by this thread or on its behalf by the workers of gather() or
+    map_comparisons(). Such calls also count for any enclosing context.
+    """
+
+    outer = getattr(_local, 'degraded', False)
+    _local.degraded = False
+    inner = []
+    try:
+        # Still answers for this context once it has been left
+        yield lambda: inner[0] if inner else _local.degraded
+    finally:
+        inner.append(_local.degraded)
+        _local.degraded = outer or _local.degraded
+
+
+class Limiter(object):
+    """
+    A semaphore from which several units can be acquired at once, so that
+    callers needing more than one at the same time (such as the pair of
+    processes behind a diff) cannot deadlock by each holding some of them.
+
+    For the same reason, a thread that already holds units is assumed to
+    have acquired all it needs up front and does not wait for more.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def hold(self, n):
+        if getattr(self._local, 'held', False):
+            yield
+            return
+
+        # Never wait for more than could ever be available
+        n = min(n, self.limit)
+
+        with self._cond:
+            self._cond.wait_for(lambda: self.used + n <= self.limit)
+            self.used += n
+        self._local.held = True
+        try:
+            yield
+        finally:
+            self._local.held = False
+            with self._cond:
+                self.used -= n
+                self._cond.notify_all()
+
+
+def get_limiter(name, limit):
+    with _lock:
+        key = (name, limit)
+        if key not in _limiters:
+            _limiters[key] = Limiter(limit)
+        return _limiters[key]
+
+
+@contextlib.contextmanager
+def limit_processes(n, tool=None, max_tool_processes=None):
+    """
+    Wait until `n` more external processes may run, both overall (see
+    Config().max_processes) and of `tool` if it has a limit of its own, and
+    hold them for the duration of the context.
+    """
+
+    with contextlib.ExitStack() as stack:
+        # Wait for the tool first so as not to hold up other tools meanwhile
+        if max_tool_processes:
+            stack.enter_context(
+                get_limiter(tool, max_tool_processes).hold(n),
+            )
+        if Config().max_processes:
+            stack.enter_context(
+                get_limiter(None, Config().max_processes).hold(n),
+            )
+        yield
+
+
+def check_call(cmd, *args, **kwargs):
+    """
+    subprocess.check_call(), counting towards Config().max_processes.
+    """
+
+    with limit_processes(1, os.path.basename(cmd[0])):
+        return subprocess.check_call(cmd, *args, **kwargs)
+
+
+def check_output(cmd, *args, **kwargs):
+    """
+    subprocess.check_output(), counting towards Config().max_processes.
+    """
+
+    with limit_processes(1, os.path.basename(cmd[0])):
+        return subprocess.check_output(cmd, *args, **kwargs)
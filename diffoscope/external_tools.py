@@ -38,10 +38,6 @@ EXTERNAL_TOOLS = {
         'arch': 'colord',
         'FreeBSD': 'colord',
     },
-    'cmp': {
-        'debian': 'diffutils',
-        'arch': 'diffutils',
-    },
     'compare': {
         'debian': 'imagemagick',
         'arch': 'imagemagick',
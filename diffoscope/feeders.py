@@ -28,9 +28,15 @@ from .profiling import profile
 logger = logging.getLogger(__name__)
 
 DIFF_CHUNK = 4096
+READ_BLOCK = 1 << 16
 
 
-def from_raw_reader(in_file, filter=lambda buf: buf):
+def _from_blocks(blocks, filter):
+    """
+    Feed `blocks`, pairs of a buffer and the number of lines it holds, through
+    `filter`. A buffer straddling the line limit is split at the last line
+    that is written out, so the filter only ever sees whole lines.
+    """
     def feeder(out_file):
         max_lines = Config().max_diff_input_lines
         end_nl = False
@@ -42,15 +48,27 @@ def from_raw_reader(in_file, filter=lambda buf: buf):
         if max_lines < float('inf'):
             h = hashlib.sha1()
 
-        for buf in in_file:
-            line_count += 1
-            out = filter(buf)
+        for buf, n in blocks:
+            keep = min(n, max_lines - 1 - line_count)
+            line_count += n
+
+            if keep >= n:
+                out = filter(buf)
+                out_file.write(out)
+            elif keep <= 0:
+                out = filter(buf)
+            else:
+                cut = 0
+                for _ in range(keep):
+                    cut = buf.index(b'\n', cut) + 1
+                out = filter(buf[:cut])
+                out_file.write(out)
+                if h is not None:
+                    h.update(out)
+                out = filter(buf[cut:])
 
             if h is not None:
                 h.update(out)
-
-            if line_count < max_lines:
-                out_file.write(out)
             end_nl = buf[-1] == '\n'
 
         if h is not None and line_count >= max_lines:
@@ -63,6 +81,37 @@ def from_raw_reader(in_file, filter=lambda buf: buf):
     return feeder
 
 
+def read_blocks(in_file, size=READ_BLOCK):
+    """
+    Yield the content of `in_file` in blocks of whole lines, along with the
+    number of lines in each. Only the last block may lack a final newline.
+    """
+    pending = []
+    while True:
+        buf = in_file.read(size)
+        if not buf:
+            break
+        end = buf.rfind(b'\n') + 1
+        if not end:
+            pending.append(buf)
+            continue
+        pending.append(buf[:end])
+        block = b''.join(pending)
+        yield block, block.count(b'\n')
+        pending = [buf[end:]]
+    rest = b''.join(pending)
+    if rest:
+        yield rest, 1
+
+
+def from_raw_reader(in_file, filter=lambda buf: buf):
+    return _from_blocks(((buf, 1) for buf in in_file), filter)
+
+
+def from_raw_blocks(in_file, filter_block=lambda buf: buf):
+    return _from_blocks(read_blocks(in_file), filter_block)
+
+
 def from_text_reader(in_file, filter=lambda text_buf: text_buf):
     def encoding_filter(text_buf):
         return filter(text_buf).encode('utf-8')
@@ -72,9 +121,9 @@ def from_text_reader(in_file, filter=lambda text_buf: text_buf):
 def from_command(command):
     def feeder(out_file):
         with profile('command', command.cmdline()[0]):
-            feeder = from_raw_reader(
+            feeder = from_raw_blocks(
                 command.stdout,
-                command.filter,
+                command.filter_block,
             )
             end_nl = feeder(out_file)
             if command.poll() is None:
@@ -22,6 +22,7 @@
 
 import os
 import sys
+import time
 import signal
 import logging
 import argparse
@@ -36,13 +37,12 @@ from .logging import setup_logging
 from .progress import ProgressManager, Progress
 from .profiling import ProfileManager, profile
 from .tempfiles import clean_all_temp_files
-from .difference import Difference
-from .comparators import ComparatorManager
 from .external_tools import EXTERNAL_TOOLS
-from .presenters.html import JQUERY_SYSTEM_LOCATIONS
+from .presenters.utils import JQUERY_SYSTEM_LOCATIONS
 from .presenters.formats import PresenterManager
-from .comparators.utils.compare import compare_root_paths
-from .readers import load_diff, load_diff_from_path
+
+# The comparators, readers and most presenters are only imported once we know
+# we need them; see test_import_time in tests/test_main.py.
 
 logger = logging.getLogger(__name__)
 
@@ -52,11 +52,6 @@ try:
 except ImportError:
     tlsh = None
 
-try:
-    import argcomplete
-except ImportError:
-    argcomplete = None
-
 
 class BooleanAction(argparse.Action):
 
@@ -117,6 +112,9 @@ def create_parser():
                         ', '.join(JQUERY_SYSTEM_LOCATIONS))
     group1.add_argument('--json', metavar='OUTPUT_FILE', dest='json_output',
                         help='Write JSON text output to given file (use - for stdout)')
+    group1.add_argument('--json-compact', action='store_true',
+                        help='Write --json output without any indentation '
+                        'or whitespace')
     group1.add_argument('--markdown', metavar='OUTPUT_FILE', dest='markdown_output',
                         help='Write Markdown text output to given file (use - for stdout)')
     group1.add_argument('--restructured-text', metavar='OUTPUT_FILE',
@@ -203,11 +201,65 @@ def create_parser():
                         Config().max_diff_input_lines,
                         default=None).completer=RangeCompleter(
                         Config().max_diff_input_lines)
+    group3.add_argument('--max-diff-in-process-lines', metavar='LINES',
+                        type=int, help='Inputs of up to this many lines are '
+                        'compared in-process instead of with diff(1); the '
+                        'output is the same. (0 to always use diff(1), '
+                        'default: %(default)s)',
+                        default=Config().max_diff_in_process_lines)
     group3.add_argument('--max-container-depth', metavar='DEPTH', type=int,
                         help='Maximum depth to recurse into containers. '
                         '(Cannot be disabled for security reasons, default: '
                         '%(default)s)',
                         default=Config().max_container_depth)
+    group3.add_argument('--jobs', '-j', metavar='N', type=int,
+                        help='Number of container members to compare in '
+                        'parallel, of independent tools to run at once on '
+                        'the same file, and of processes rendering '
+                        '--html-dir pages. Output is identical regardless of this '
+                        'setting. (default: %(default)s)',
+                        default=Config().jobs)
+    group3.add_argument('--max-processes', metavar='N', type=int,
+                        help='Maximum number of external tools, including '
+                        'diff(1), to run at once. Tools that use a lot of '
+                        'memory, such as javap, have a lower limit of their '
+                        'own. (0 to disable, default: %(default)s)',
+                        default=Config().max_processes)
+    group3.add_argument('--command-timeout', metavar='SECONDS', type=int,
+                        help='Terminate external tools that run for longer '
+                        'than SECONDS, falling back to a binary comparison. '
+                        '(0 to disable, default: %(default)s)',
+                        default=Config().command_timeout)
+    group3.add_argument('--deadline', metavar='SECONDS', type=int,
+                        help='Stop running external tools SECONDS after '
+                        'starting, falling back to binary comparisons for '
+                        'the rest of the files. (default: disabled)')
+    group3.add_argument('--max-command-memory', metavar='BYTES', type=int,
+                        help='Maximum address space of each external tool; '
+                        'a tool exceeding it will usually fail and fall back '
+                        'to a binary comparison. (0 to disable, default: '
+                        '%(default)s)',
+                        default=Config().max_command_memory)
+    group3.add_argument('--cache-dir', metavar='DIR',
+                        help='Cache comparison results and the output of '
+                        'external tools in DIR, keyed by the contents of the '
+                        'files being compared. The cache may be shared '
+                        'between runs. When the output is streamed, only '
+                        'the results for the members of the outermost '
+                        'container are cached, not the container itself, '
+                        'so as not to hold them all in memory. (default: '
+                        'disabled)')
+    group3.add_argument('--max-cache-size', metavar='BYTES', type=int,
+                        help='Maximum size of the --cache-dir cache; least '
+                        'recently used results are evicted first. (0 to '
+                        'disable, default: %(default)s)',
+                        default=Config().max_cache_size).completer=RangeCompleter(
+                        Config().max_cache_size)
+    group3.add_argument('--checkpoint', metavar='FILE',
+                        help='Record the progress of the comparison in FILE. '
+                        'If interrupted, running again with the same inputs '
+                        'and FILE carries on from where it left off. '
+                        '(default: disabled)')
     group3.add_argument('--max-diff-block-lines-saved', metavar='LINES', type=int,
                         help='Maximum number of lines saved per diff block. '
                         'Most users should not need this, unless you run out '
@@ -215,6 +267,14 @@ def create_parser():
                         'it in a report, and affects all types of output, '
                         'including --text and --json. (0 to disable, default: '
                         '%(default)s)', default=0)
+    group3.add_argument('--max-diff-in-memory-size', metavar='CHARS', type=int,
+                        help='Diffs larger than this are stored in temporary '
+                        'files instead of memory and read back lazily when '
+                        'emitting the report. When reading a JSON report for '
+                        'a format that cannot be emitted as it is read, such '
+                        'as --html, all diffs are stored this way. (0 to '
+                        'disable, default: '
+                        '%(default)s)', default=Config().max_diff_in_memory_size)
 
     group4 = parser.add_argument_group('information commands')
     group4.add_argument('--help', '-h', action='help',
@@ -233,18 +293,22 @@ def create_parser():
 
     if not tlsh:
         parser.epilog = 'File renaming detection based on fuzzy-matching is currently disabled. It can be enabled by installing the "tlsh" module available at https://github.com/trendmicro/tlsh'
-    if argcomplete:
+    if '_ARGCOMPLETE' in os.environ:
+        try:
+            import argcomplete
+        except ImportError:
+            logger.error('Argument completion requested but the "argcomplete" module is not installed. It can be obtained at https://pypi.python.org/pypi/argcomplete')
+            sys.exit(1)
         argcomplete.autocomplete(parser)
-    elif '_ARGCOMPLETE' in os.environ:
-        logger.error('Argument completion requested but the "argcomplete" module is not installed. It can be obtained at https://pypi.python.org/pypi/argcomplete')
-        sys.exit(1)
 
     def post_parse(parsed_args):
         if parsed_args.path2 is None:
             # warn about unusual flags in this mode
             ineffective_flags = [f
                 for x in group3._group_actions
-                    if getattr(parsed_args, x.dest) != x.default
+                    # --jobs also applies to rendering --html-dir pages
+                    if getattr(parsed_args, x.dest) != x.default and
+                        x.dest != 'jobs'
                 for f in x.option_strings]
             if ineffective_flags:
                 logger.warning("Loading diff instead of calculating it, but diff-calculation flags were given; they will be ignored:")
@@ -267,7 +331,8 @@ class ListToolsAction(argparse.Action):
     def __call__(self, parser, namespace, os_override, option_string=None):
         # Ensure all comparators are imported so tool_required.all is
         # populated.
-        ComparatorManager().reload()
+        from .comparators import ComparatorManager
+        ComparatorManager().load_all()
 
         print("External-Tools-Required: ", end='')
         print(', '.join(sorted(tool_required.all)))
@@ -291,7 +356,8 @@ class ListDebianSubstvarsAction(argparse._StoreTrueAction):
     def __call__(self, *args, **kwargs):
         # Ensure all comparators are imported so tool_required.all is
         # populated.
-        ComparatorManager().reload()
+        from .comparators import ComparatorManager
+        ComparatorManager().load_all()
 
         tools = set()
         for x in tool_required.all:
@@ -346,7 +412,19 @@ def run_diffoscope(parsed_args):
 
     maybe_set_limit(Config(), parsed_args, "max_diff_block_lines_saved")
     maybe_set_limit(Config(), parsed_args, "max_diff_input_lines")
+    Config().max_diff_in_process_lines = parsed_args.max_diff_in_process_lines
+    Config().max_diff_in_memory_size = \
+        parsed_args.max_diff_in_memory_size or float("inf")
     Config().max_container_depth = parsed_args.max_container_depth
+    Config().jobs = max(1, parsed_args.jobs)
+    Config().max_processes = max(0, parsed_args.max_processes)
+    Config().command_timeout = max(0, parsed_args.command_timeout)
+    if parsed_args.deadline is not None:
+        Config().deadline = time.monotonic() + parsed_args.deadline
+    Config().max_command_memory = max(0, parsed_args.max_command_memory)
+    Config().cache_dir = parsed_args.cache_dir
+    Config().max_cache_size = parsed_args.max_cache_size or float("inf")
+    Config().checkpoint = parsed_args.checkpoint
     Config().fuzzy_threshold = parsed_args.fuzzy_threshold
     Config().new_file = parsed_args.new_file
     Config().excludes = parsed_args.excludes
@@ -358,20 +436,41 @@ def run_diffoscope(parsed_args):
     set_locale()
     path1, path2 = parsed_args.path1, parsed_args.path2
     if path2 is None:
+        from .readers import load_diff
+        # If possible, read the details of the report as they are output
+        lazily = PresenterManager().supports_streaming()
         if path1 is None or path1 == '-':
-            difference = load_diff(sys.stdin, "stdin")
-        else:
-            difference = load_diff_from_path(path1)
-    else:
-        logger.debug('Starting comparison')
-        with Progress():
+            difference = load_diff(sys.stdin.buffer, "stdin", lazily)
+            return output_difference(difference, parsed_args)
+        with open(path1, 'rb') as fp:
+            difference = load_diff(fp, path1, lazily)
+            return output_difference(difference, parsed_args)
+
+    from .checkpoint import journal
+    from .comparators.utils.compare import compare_root_paths
+    from .comparators.utils.container import streaming
+    # If possible, output the differences between the members of the
+    # outermost container as they are found rather than all at the end.
+    stream = PresenterManager().supports_streaming()
+    logger.debug('Starting comparison')
+    with Progress():
+        with journal(path1, path2), streaming(stream):
             with profile('main', 'outputs'):
                 difference = compare_root_paths(path1, path2)
-        ProgressManager().finish()
+            if stream:
+                exit_code = output_difference(difference, parsed_args)
+    ProgressManager().finish()
+    if not stream:
+        exit_code = output_difference(difference, parsed_args)
+    return exit_code
+
+
+def output_difference(difference, parsed_args):
     # Generate an empty, dummy diff to write, saving the exit code first.
     has_differences = bool(difference is not None)
     if difference is None and parsed_args.output_empty:
-        difference = Difference(None, path1, path2)
+        from .difference import Difference
+        difference = Difference(None, parsed_args.path1, parsed_args.path2)
     with profile('main', 'outputs'):
         PresenterManager().output(difference, parsed_args, has_differences)
     return 1 if has_differences else 0
@@ -0,0 +1,716 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 1988-1989, 1992-1995, 1998, 2001-2002, 2004, 2006-2007,
+#   2009-2013, 2015-2017 Free Software Foundation, Inc.
+# Copyright © 2026 agent <agent@local>
+#
+# Derived from src/analyze.c of GNU diffutils, which is distributed under
+# the same license.
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+In-process unified diff engine.
+
+This is a port of the algorithm used by GNU diff (Myers' O(ND) algorithm
+with the "confusing lines" and boundary-shifting heuristics from diffutils'
+analyze.c) so that for the same input it produces the same hunks as
+`diff -aU7`, without having to fork a process.
+"""
+
+import sys
+import array
+
+NL = ord('\n')
+
+# GNU diff's --horizon-lines defaults to the amount of context
+CONTEXT = 7
+
+_OFFSET_MAX = sys.maxsize
+
+
+def _common_prefix_length(b0, b1):
+    n = min(len(b0), len(b1))
+    lo, hi = 0, n
+    # Binary search using slice comparisons, which are done at C speed
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if b0[lo:mid] == b1[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix_length(b0, b1, limit):
+    lo, hi = 0, limit
+    n0, n1 = len(b0), len(b1)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if b0[n0 - mid:n0 - lo] == b1[n1 - mid:n1 - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _split_lines(data):
+    lines = data.split(b'\n')
+    lines.pop()  # the buffer always ends with a newline
+    return [x + b'\n' for x in lines]
+
+
+def find_identical_ends(b0, b1, m0, m1, horizon):
+    """
+    Find the identical prefix and suffix of the two buffers, keeping
+    `horizon` lines of each so that the analysis produces the same results as
+    GNU diff. Returns the offsets of the end of the prefix and of the start of
+    each suffix.
+    """
+
+    n0, n1 = len(b0), len(b1)
+
+    p = _common_prefix_length(b0, b1)
+
+    # Don't mistakenly count missing newline as part of prefix
+    if (n0 - m0 < p) != (n1 - m1 < p):
+        p -= 1
+
+    # Skip back to last line-beginning in the prefix, and then discard up
+    # to `horizon` lines from the prefix.
+    i = horizon
+    while p:
+        if b0[p - 1] != NL:
+            p -= 1
+            continue
+        if not i:
+            break
+        i -= 1
+        p -= 1
+    prefix_end = p
+
+    p0, p1 = n0, n1
+    if m0 == m1:
+        # Don't scan back into the identical prefix of either buffer
+        limit = min(n0, n1) - prefix_end
+        length = _common_suffix_length(b0, b1, limit)
+        p0, p1 = n0 - length, n1 - length
+        beg0 = p0
+
+        # Are we at a line-beginning in both files? If not, add the rest of
+        # this line to the main body. Discard up to `horizon` lines from the
+        # identical suffix.
+        at_bol = (p0 == 0 or b0[p0 - 1] == NL) and \
+            (p1 == 0 or b1[p1 - 1] == NL)
+        i = horizon + (not at_bol)
+        while i and p0 != n0:
+            i -= 1
+            p0 = b0.index(b'\n', p0) + 1
+        p1 += p0 - beg0
+
+    return prefix_end, p0, p1
+
+
+def discard_confusing_lines(equivs, counts, minimal=False):
+    """
+    Discard lines from one file that have no matches in the other file, and
+    provisionally discard lines which have lots of matches.
+
+    Returns a list of the indices of the lines which were not discarded and
+    a list of flags for those which were.
+    """
+
+    discarded = []
+
+    for f in (0, 1):
+        xs = equivs[f]
+        other_counts = counts[1 - f]
+        end = len(xs)
+
+        # Multiply `many` by the approximate square root of number of lines
+        many = 5
+        tem = end // 64
+        while True:
+            tem >>= 2
+            if tem <= 0:
+                break
+            many *= 2
+
+        discards = [0] * end
+        for i, x in enumerate(xs):
+            nmatch = other_counts.get(x, 0)
+            if nmatch == 0:
+                discards[i] = 1
+            elif nmatch > many:
+                discards[i] = 2
+        discarded.append(discards)
+
+    # Don't really discard the provisional lines except when they occur in a
+    # run of discardables, with nonprovisionals at the beginning and end.
+    for discards in discarded:
+        end = len(discards)
+        i = 0
+        while i < end:
+            if discards[i] == 2:
+                discards[i] = 0
+            elif discards[i]:
+                # Find end of this run of discardable lines and count how
+                # many are provisionally discardable.
+                provisional = 0
+                j = i
+                while j < end:
+                    if discards[j] == 0:
+                        break
+                    if discards[j] == 2:
+                        provisional += 1
+                    j += 1
+
+                # Cancel provisional discards at end, and shrink the run
+                while j > i and discards[j - 1] == 2:
+                    j -= 1
+                    discards[j] = 0
+                    provisional -= 1
+
+                length = j - i
+
+                if provisional * 4 > length:
+                    # If 1/4 of the lines in the run are provisional, cancel
+                    # discarding of all provisional lines in the run.
+                    while j > i:
+                        j -= 1
+                        if discards[j] == 2:
+                            discards[j] = 0
+                else:
+                    # `minimum` is the approximate square root of length/4
+                    minimum = 1
+                    tem = length >> 2
+                    while True:
+                        tem >>= 2
+                        if tem <= 0:
+                            break
+                        minimum <<= 1
+                    minimum += 1
+
+                    # Cancel any subrun of `minimum` or more provisionals
+                    # within the larger run.
+                    j = consec = 0
+                    while j < length:
+                        if discards[i + j] != 2:
+                            consec = 0
+                        else:
+                            consec += 1
+                            if minimum == consec:
+                                # Back up to start of subrun to cancel it all
+                                j -= consec
+                            elif minimum < consec:
+                                discards[i + j] = 0
+                        j += 1
+
+                    # Scan from beginning of run until we find 3 or more
+                    # nonprovisionals in a row or until the first
+                    # nonprovisional at least 8 lines in. Until that point,
+                    # cancel any provisionals.
+                    consec = 0
+                    for j in range(length):
+                        if j >= 8 and discards[i + j] == 1:
+                            break
+                        if discards[i + j] == 2:
+                            consec = 0
+                            discards[i + j] = 0
+                        elif discards[i + j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+
+                    # Advance to the last line of the run
+                    i += length - 1
+
+                    # Same thing, from end
+                    consec = 0
+                    for j in range(length):
+                        if j >= 8 and discards[i - j] == 1:
+                            break
+                        if discards[i - j] == 2:
+                            consec = 0
+                            discards[i - j] = 0
+                        elif discards[i - j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+            i += 1
+
+    if minimal:
+        return [list(range(len(x))) for x in equivs], \
+            [[0] * len(x) for x in equivs]
+
+    return [
+        [i for i, x in enumerate(discards) if not x] for discards in discarded
+    ], discarded
+
+
+def diag(xv, yv, xoff, xlim, yoff, ylim, find_minimal, fd, bd, too_expensive):
+    """
+    Find the midpoint of the shortest edit script for a specified portion of
+    the two vectors.
+
+    Returns (xmid, ymid, lo_minimal, hi_minimal, cost), where `cost` is the
+    number of edit steps that were taken. `fd` and `bd` are the
+    forward and backward vectors of furthest reaching paths, indexed by
+    diagonal plus `len(yv) + 1`.
+    """
+
+    k = len(yv) + 1
+    dmin = xoff - ylim
+    dmax = xlim - yoff
+    fmid = xoff - yoff
+    bmid = xlim - ylim
+    fmin = fmax = fmid
+    bmin = bmax = bmid
+    odd = (fmid - bmid) & 1
+
+    fd[fmid + k] = xoff
+    bd[bmid + k] = xlim
+
+    c = 0
+    while True:
+        c += 1
+
+        # Extend the top-down search by an edit step in each diagonal
+        if fmin > dmin:
+            fmin -= 1
+            fd[fmin - 1 + k] = -1
+        else:
+            fmin += 1
+        if fmax < dmax:
+            fmax += 1
+            fd[fmax + 1 + k] = -1
+        else:
+            fmax -= 1
+        for d in range(fmax + k, fmin + k - 1, -2):
+            tlo = fd[d - 1]
+            thi = fd[d + 1]
+            x = thi if tlo < thi else tlo + 1
+            y = x - d + k
+            while x < xlim and y < ylim and xv[x] == yv[y]:
+                x += 1
+                y += 1
+            fd[d] = x
+            if odd and bmin + k <= d <= bmax + k and bd[d] <= x:
+                return x, y, True, True, c
+
+        # Similarly extend the bottom-up search
+        if bmin > dmin:
+            bmin -= 1
+            bd[bmin - 1 + k] = _OFFSET_MAX
+        else:
+            bmin += 1
+        if bmax < dmax:
+            bmax += 1
+            bd[bmax + 1 + k] = _OFFSET_MAX
+        else:
+            bmax -= 1
+        for d in range(bmax + k, bmin + k - 1, -2):
+            tlo = bd[d - 1]
+            thi = bd[d + 1]
+            x = tlo if tlo < thi else thi - 1
+            y = x - d + k
+            while xoff < x and yoff < y and xv[x - 1] == yv[y - 1]:
+                x -= 1
+                y -= 1
+            bd[d] = x
+            if not odd and fmin + k <= d <= fmax + k and x <= fd[d]:
+                return x, y, True, True, c
+
+        if find_minimal or c < too_expensive:
+            continue
+
+        # We've gone well beyond the call of duty; give up and report
+        # halfway between our best results so far.
+        fxybest = -1
+        fxbest = 0
+        for d in range(fmax, fmin - 1, -2):
+            x = min(fd[d + k], xlim)
+            y = x - d
+            if ylim < y:
+                x = ylim + d
+                y = ylim
+            if fxybest < x + y:
+                fxybest = x + y
+                fxbest = x
+
+        bxybest = _OFFSET_MAX
+        bxbest = 0
+        for d in range(bmax, bmin - 1, -2):
+            x = max(xoff, bd[d + k])
+            y = x - d
+            if y < yoff:
+                x = yoff + d
+                y = yoff
+            if x + y < bxybest:
+                bxybest = x + y
+                bxbest = x
+
+        if (xlim + ylim) - bxybest < fxybest - (xoff + yoff):
+            return fxbest, fxybest - fxbest, True, False, c
+        return bxbest, bxybest - bxbest, False, True, c
+
+
+def compareseq(xv, yv, changed0, changed1, xindex, yindex, minimal,
+               too_expensive=None, max_cost=None):
+    """
+    Compare the undiscarded lines `xv` and `yv`, marking the lines which are
+    not part of the longest common subsequence as changed.
+
+    Once the search for a midpoint has taken `too_expensive` edit steps, a
+    good but not necessarily optimal one is used instead. If the total work
+    (roughly the sum of the squares of the edit steps) exceeds `max_cost`,
+    all remaining lines are simply marked as changed.
+    """
+
+    n, m = len(xv), len(yv)
+
+    if too_expensive is None:
+        # Set `too_expensive` to be the approximate square root of the input
+        # size, bounded below by 4096.
+        diags = n + m + 3
+        too_expensive = 1
+        while diags:
+            diags >>= 2
+            too_expensive <<= 1
+        too_expensive = max(4096, too_expensive)
+
+    fd = array.array('q', bytes(8 * (n + m + 3)))
+    bd = array.array('q', bytes(8 * (n + m + 3)))
+
+    cost = 0
+    stack = [(0, n, 0, m, minimal)]
+    while stack:
+        xoff, xlim, yoff, ylim, find_minimal = stack.pop()
+
+        if max_cost is not None and cost > max_cost:
+            for x in range(xoff, xlim):
+                changed0[xindex[x]] = 1
+            for y in range(yoff, ylim):
+                changed1[yindex[y]] = 1
+            continue
+
+        # Slide down the bottom initial diagonal
+        while xoff < xlim and yoff < ylim and xv[xoff] == yv[yoff]:
+            xoff += 1
+            yoff += 1
+
+        # Slide up the top initial diagonal
+        while xoff < xlim and yoff < ylim and xv[xlim - 1] == yv[ylim - 1]:
+            xlim -= 1
+            ylim -= 1
+
+        if xoff == xlim:
+            for y in range(yoff, ylim):
+                changed1[yindex[y]] = 1
+        elif yoff == ylim:
+            for x in range(xoff, xlim):
+                changed0[xindex[x]] = 1
+        else:
+            xmid, ymid, lo_minimal, hi_minimal, c = diag(
+                xv, yv, xoff, xlim, yoff, ylim, find_minimal, fd, bd,
+                too_expensive,
+            )
+            cost += c * c
+            stack.append((xmid, xlim, ymid, ylim, hi_minimal))
+            stack.append((xoff, xmid, yoff, ymid, lo_minimal))
+
+
+def diff_sequences(xv, yv, too_expensive=None, max_cost=None):
+    """
+    Compare the sequences `xv` and `yv` (eg. two strings). Returns a pair of
+    bytearrays flagging the items of each which are not part of the common
+    subsequence that was found.
+    """
+
+    changed0 = bytearray(len(xv))
+    changed1 = bytearray(len(yv))
+
+    compareseq(
+        xv,
+        yv,
+        changed0,
+        changed1,
+        range(len(xv)),
+        range(len(yv)),
+        False,
+        too_expensive,
+        max_cost,
+    )
+
+    return changed0, changed1
+
+
+def shift_boundaries(equivs, changed):
+    """
+    Adjust inserts/deletes of identical lines to join changes as much as
+    possible, and move them forward as far as possible otherwise.
+
+    `changed` are lists of flags with a sentinel 0 at each end; index k of a
+    file's lines is thus at index k + 1.
+    """
+
+    for f in (0, 1):
+        ch = changed[f]
+        other = changed[1 - f]
+        eq = equivs[f]
+        i_end = len(eq)
+        i = j = 0
+
+        while True:
+            # Scan forwards to find beginning of another run of changes.
+            # Also keep track of the corresponding point in the other file.
+            while i < i_end and not ch[i + 1]:
+                while other[j + 1]:
+                    j += 1
+                j += 1
+                i += 1
+
+            if i == i_end:
+                break
+
+            start = i
+
+            # Find the end of this run of changes
+            i += 1
+            while ch[i + 1]:
+                i += 1
+            while other[j + 1]:
+                j += 1
+
+            while True:
+                # Record the length of this run of changes, so that we can
+                # later determine whether the run has grown.
+                runlength = i - start
+
+                # Move the changed region back, so long as the previous
+                # unchanged line matches the last changed one. This merges
+                # with previous changed regions.
+                while start and eq[start - 1] == eq[i - 1]:
+                    start -= 1
+                    ch[start + 1] = 1
+                    i -= 1
+                    ch[i + 1] = 0
+                    while ch[start]:
+                        start -= 1
+                    j -= 1
+                    while other[j + 1]:
+                        j -= 1
+
+                # Set `corresponding` to the end of the changed run, at the
+                # last point where it corresponds to a changed run in the
+                # other file. i_end means no such point has been found.
+                corresponding = i if other[j] else i_end
+
+                # Move the changed region forward, so long as the first
+                # changed line matches the following unchanged one. This
+                # merges with following changed regions.
+                while i != i_end and eq[start] == eq[i]:
+                    ch[start + 1] = 0
+                    start += 1
+                    ch[i + 1] = 1
+                    i += 1
+                    while ch[i + 1]:
+                        i += 1
+                    j += 1
+                    while other[j + 1]:
+                        j += 1
+                        corresponding = i
+
+                if runlength == i - start:
+                    break
+
+            # If possible, move the fully-merged run of changes back to a
+            # corresponding run in the other file.
+            while corresponding < i:
+                start -= 1
+                ch[start + 1] = 1
+                i -= 1
+                ch[i + 1] = 0
+                j -= 1
+                while other[j + 1]:
+                    j -= 1
+
+
+def build_script(changed0, changed1, len0, len1):
+    """
+    Yield (line0, line1, deleted, inserted) tuples for each change.
+    """
+
+    i0 = i1 = 0
+    while i0 < len0 or i1 < len1:
+        if changed0[i0 + 1] or changed1[i1 + 1]:
+            line0, line1 = i0, i1
+            while changed0[i0 + 1]:
+                i0 += 1
+            while changed1[i1 + 1]:
+                i1 += 1
+            yield line0, line1, i0 - line0, i1 - line1
+        i0 += 1
+        i1 += 1
+
+
+def format_range(first, last):
+    # Convert to 1-based line numbers
+    a, b = first + 1, last + 1
+    if b < a:
+        return '{},0'.format(b)
+    if b == a:
+        return '{}'.format(b)
+    return '{},{}'.format(a, b - a + 1)
+
+
+def unified_diff(data1, data2, context=CONTEXT):
+    """
+    Yield the lines of a unified diff of the bytes `data1` and `data2`, as
+    `diff -aU<context>` would output them, without the file headers.
+    """
+
+    if data1 == data2:
+        return
+
+    # Like GNU diff, append a newline to incomplete last lines
+    buffers, missing = [], []
+    for x in (data1, data2):
+        m = bool(x) and not x.endswith(b'\n')
+        buffers.append(x + b'\n' if m else x)
+        missing.append(m)
+    b0, b1 = buffers
+
+    prefix_end, suffix0, suffix1 = find_identical_ends(
+        b0, b1, missing[0], missing[1], context,
+    )
+    prefix_lines = b0.count(b'\n', 0, prefix_end)
+
+    lines = []
+    buffered = []
+    for b, m, suffix in zip(buffers, missing, (suffix0, suffix1)):
+        xs = _split_lines(b)
+        if m:
+            # An incomplete line only compares equal to another one
+            xs[-1] = xs[-1][:-1]
+        lines.append(xs)
+        buffered.append(xs[prefix_lines:b.count(b'\n', 0, suffix)])
+
+    # Assign equivalence classes to the lines being analysed
+    classes = {}
+    equivs = [[classes.setdefault(x, len(classes) + 1) for x in xs] for xs in buffered]
+    counts = []
+    for xs in equivs:
+        count = {}
+        for x in xs:
+            count[x] = count.get(x, 0) + 1
+        counts.append(count)
+
+    undiscarded, discarded = discard_confusing_lines(equivs, counts)
+
+    # Flags with a sentinel at each end
+    changed = [[0] + list(x) + [0] for x in discarded]
+    for x in changed:
+        for i in range(1, len(x) - 1):
+            x[i] = 1 if x[i] else 0
+
+    compareseq(
+        [equivs[0][i] for i in undiscarded[0]],
+        [equivs[1][i] for i in undiscarded[1]],
+        _Offset(changed[0]),
+        _Offset(changed[1]),
+        undiscarded[0],
+        undiscarded[1],
+        False,
+    )
+
+    shift_boundaries(equivs, changed)
+
+    script = [
+        (line0 + prefix_lines, line1 + prefix_lines, deleted, inserted)
+        for line0, line1, deleted, inserted in build_script(
+            changed[0], changed[1], len(equivs[0]), len(equivs[1]),
+        )
+    ]
+
+    yield from print_unified(script, lines, missing, context)
+
+
+class _Offset(object):
+    """
+    Write-only view of a flag list that skips the leading sentinel.
+    """
+
+    def __init__(self, xs):
+        self.xs = xs
+
+    def __setitem__(self, k, v):
+        self.xs[k + 1] = v
+
+
+def print_unified(script, lines, missing, context):
+    lines0, lines1 = lines
+    total0, total1 = len(lines0), len(lines1)
+    no_newline = b'\\ No newline at end of file\n'
+
+    def line(prefix, xs, i, m):
+        if m and i == len(xs) - 1:
+            return [prefix + xs[i] + b'\n', no_newline]
+        return [prefix + xs[i]]
+
+    i = 0
+    while i < len(script):
+        # Find the last change in this hunk; changes separated by no more
+        # than twice the context are shown together.
+        j = i
+        while j + 1 < len(script):
+            top0 = script[j][0] + script[j][2]
+            if script[j + 1][0] - top0 >= 2 * context + 1:
+                break
+            j += 1
+        hunk = script[i:j + 1]
+        i = j + 1
+
+        first0 = max(hunk[0][0] - context, 0)
+        first1 = max(hunk[0][1] - context, 0)
+        last0 = min(hunk[-1][0] + hunk[-1][2] - 1 + context, total0 - 1)
+        last1 = min(hunk[-1][1] + hunk[-1][3] - 1 + context, total1 - 1)
+
+        yield '@@ -{} +{} @@\n'.format(
+            format_range(first0, last0),
+            format_range(first1, last1),
+        ).encode('ascii')
+
+        x, y = first0, first1
+        changes = iter(hunk)
+        change = next(changes, None)
+        while x <= last0 or y <= last1:
+            if change is None or x < change[0]:
+                yield from line(b' ', lines0, x, missing[0])
+                x += 1
+                y += 1
+            else:
+                for _ in range(change[2]):
+                    yield from line(b'-', lines0, x, missing[0])
+                    x += 1
+                for _ in range(change[3]):
+                    yield from line(b'+', lines1, y, missing[1])
+                    y += 1
+                change = next(changes, None)
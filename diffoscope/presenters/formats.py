@@ -17,16 +17,12 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import sys
 import logging
+import importlib
 
 from ..profiling import profile
 
-from .text import TextPresenter
-from .json import JSONPresenter
-from .html import HTMLPresenter, HTMLDirectoryPresenter
-from .markdown import MarkdownTextPresenter
-from .restructuredtext import RestructuredTextPresenter
-
 logger = logging.getLogger(__name__)
 
 
@@ -45,27 +41,27 @@ class PresenterManager(object):
     def configure(self, parsed_args):
         FORMATS = {
             'text': {
-                'klass': TextPresenter,
+                'klass': 'text.TextPresenter',
                 'target': parsed_args.text_output,
             },
             'html': {
-                'klass': HTMLPresenter,
+                'klass': 'html.HTMLPresenter',
                 'target': parsed_args.html_output,
             },
             'json': {
-                'klass': JSONPresenter,
+                'klass': 'json.JSONPresenter',
                 'target': parsed_args.json_output,
             },
             'markdown': {
-                'klass': MarkdownTextPresenter,
+                'klass': 'markdown.MarkdownTextPresenter',
                 'target': parsed_args.markdown_output,
             },
             'restructuredtext': {
-                'klass': RestructuredTextPresenter,
+                'klass': 'restructuredtext.RestructuredTextPresenter',
                 'target': parsed_args.restructuredtext_output,
             },
             'html_directory': {
-                'klass': HTMLDirectoryPresenter,
+                'klass': 'html.HTMLDirectoryPresenter',
                 'target': parsed_args.html_output_directory,
             },
         }
@@ -79,6 +75,10 @@ class PresenterManager(object):
             FORMATS['text']['target'] = '-'
             self.config['text'] = FORMATS['text']
 
+        # Only import the presenters we will use
+        for v in self.config.values():
+            v['klass'] = load_presenter(v['klass'])
+
         logger.debug(
             "Will generate the following formats: %s",
             ", ".join(self.config.keys()),
@@ -111,5 +111,29 @@ class PresenterManager(object):
         """
 
         return any(
-            x['klass'].supports_visual_diffs for x in self.config.values(),
+            x['klass'].supports_visual_diffs for x in self.config.values()
         )
+
+    def supports_streaming(self):
+        """
+        Whether we can start output while the comparison is still running.
+        Only possible with a single presenter that visits the tree in order,
+        and not when writing to a terminal that may have a progress bar.
+        """
+
+        if len(self.config) != 1:
+            return False
+
+        data, = self.config.values()
+        if data['target'] == '-' and sys.stdout.isatty():
+            return False
+
+        return data['klass'].supports_streaming
+
+
+def load_presenter(name):
+    module, klass = name.rsplit('.', 1)
+
+    return getattr(importlib.import_module(
+        'diffoscope.presenters.{}'.format(module),
+    ), klass)
@@ -35,10 +35,13 @@ import base64
 import codecs
 import collections
 import contextlib
+import functools
 import hashlib
+import heapq
 import html
 import io
 import logging
+import multiprocessing
 import os
 import re
 import sys
@@ -50,7 +53,8 @@ from diffoscope.diff import SideBySideDiff, DIFFON, DIFFOFF
 
 from ..icon import FAVICON_BASE64
 from ..utils import sizeof_fmt, PrintLimitReached, DiffBlockLimitReached, \
-    create_limited_print_func, Presenter, make_printer, PartialString
+    create_limited_print_func, Presenter, make_printer, PartialString, \
+    JQUERY_SYSTEM_LOCATIONS
 
 from . import templates
 
@@ -62,9 +66,39 @@ TABSIZE = 8
 # Characters we're willing to word wrap on
 WORDBREAK = " \t;.,/):-"
 
-JQUERY_SYSTEM_LOCATIONS = (
-    '/usr/share/javascript/jquery/jquery.js',
-)
+# Characters in a line that are not counted towards LINESIZE
+ZERO_WIDTH = {
+    0: DIFFON + DIFFOFF,
+    1: DIFFON + DIFFOFF + "\n",
+}
+
+# Control characters within words that are shown escaped, and count as such
+ESCAPED = {
+    x: ''.join(
+        chr(y) for y in range(32)
+        if chr(y) not in ZERO_WIDTH[x] + WORDBREAK
+    )
+    for x in (0, 1)
+}
+
+# Characters that do not have a width of one
+re_not_one = {
+    x: re.compile('[%s]' % re.escape(ESCAPED[x] + ZERO_WIDTH[x]))
+    for x in (0, 1)
+}
+
+# Runs of characters between word breaks which need a zero-sized breakable
+# space inserted or are followed by a tab, whose width depends on the run.
+# Output for the text in between them does not depend on its position.
+WORD_CHAR = '[^%s]' % re.escape(WORDBREAK)
+re_segment = {
+    0: re.compile(r'((?<!{0})(?:{0}{{{1},}}|{0}*[{2}]{0}*))'.format(
+        WORD_CHAR, LINESIZE + 1, re.escape(ESCAPED[0]),
+    )),
+    1: re.compile(r'((?<!{0})(?:{0}{{{1},}}\t?|{0}*[{2}]{0}*\t?|{0}{{0,{3}}}\t))'.format(
+        WORD_CHAR, LINESIZE + 1, re.escape(ESCAPED[1]), LINESIZE,
+    )),
+}
 
 logger = logging.getLogger(__name__)
 re_anchor_prefix = re.compile(r'^[^A-Za-z]')
@@ -86,7 +120,11 @@ def send_and_exhaust(iterator, arg, default):
     return output
 
 def md5(s):
-    return hashlib.md5(s.encode('utf-8')).hexdigest()
+    h = hashlib.md5()
+    # Unified diffs may have been spilled to disk
+    for x in ([s] if isinstance(s, str) else s.chunks()):
+        h.update(x.encode('utf-8'))
+    return h.hexdigest()
 
 def escape_anchor(val):
     """
@@ -103,48 +141,78 @@ def escape_anchor(val):
 
     return val
 
+def smallest_first(node, parscore):
+    depth = parscore[0] + 1 if parscore else 0
+    parents = parscore[3] if parscore else []
+    # Difference is not comparable so use memory address in event of a tie
+    return depth, node.size_self(), id(node), parents + [node]
+
 def output_diff_path(path):
     return '/'.join(n.source1 for n in path[1:])
 
 def output_anchor(path):
     return escape_anchor(output_diff_path(path))
 
-def convert(s, ponct=0, tag=''):
-    i = 0
-    t = io.StringIO()
-    for c in s:
-        # used by diffs
-        if c == DIFFON:
-            t.write('<%s>' % tag)
-        elif c == DIFFOFF:
-            t.write('</%s>' % tag)
-
-        # special highlighted chars
-        elif c == "\t" and ponct == 1:
-            n = TABSIZE-(i%TABSIZE)
-            if n == 0:
-                n = TABSIZE
-            t.write('<span class="diffponct">\xbb</span>'+'\xa0'*(n-1))
-        elif c == " " and ponct == 1:
-            t.write('<span class="diffponct">\xb7</span>')
-        elif c == "\n" and ponct == 1:
-            t.write('<br/><span class="diffponct">\</span>')
-        elif ord(c) < 32:
-            conv = u"\\x%x" % ord(c)
-            t.write('<em>%s</em>' % conv)
-            i += len(conv)
-        else:
-            t.write(html.escape(c))
-            i += 1
+@functools.lru_cache()
+def convert_table(ponct, tag):
+    """
+    Returns a str.translate() table converting each character, as long as it
+    is not affected by the ones before it.
+    """
 
-        if WORDBREAK.count(c) == 1:
-            t.write('\u200b')
-            i = 0
-        if i > LINESIZE:
-            i = 0
-            t.write('\u200b')
+    table = {ord(x): html.escape(x) for x in '&<>"\''}
+    table.update((x, u"<em>\\x%x</em>" % x) for x in range(32))
+    table.update((ord(x), table.get(ord(x), x) + '\u200b') for x in WORDBREAK)
+    table[ord(DIFFON)] = '<%s>' % tag
+    table[ord(DIFFOFF)] = '</%s>' % tag
+
+    if ponct == 1:
+        table[ord(" ")] = '<span class="diffponct">\xb7</span>\u200b'
+        table[ord("\n")] = '<br/><span class="diffponct">\\</span>'
+    return table
+
+def convert_segment(s, ponct, table):
+    i = 0 # width since the last word break
+    t = []
+
+    tab = s.endswith("\t")
+    if tab:
+        s = s[:-1]
+
+    if re_not_one[ponct].search(s) is None:
+        # Every character has a width of one
+        end = len(s) - len(s) % (LINESIZE + 1)
+        for x in range(0, end, LINESIZE + 1):
+            t.append(s[x:x + LINESIZE + 1].translate(table))
+            t.append('\u200b')
+        t.append(s[end:].translate(table))
+        i = len(s) - end
+    else:
+        start = 0
+        for x, c in enumerate(s):
+            if c in ESCAPED[ponct]:
+                i += len(u"\\x%x" % ord(c))
+            elif c not in ZERO_WIDTH[ponct]:
+                i += 1
+            if i > LINESIZE:
+                t.append(s[start:x + 1].translate(table))
+                t.append('\u200b')
+                start = x + 1
+                i = 0
+        t.append(s[start:].translate(table))
+
+    if tab:
+        n = TABSIZE-(i%TABSIZE)
+        t.append('<span class="diffponct">\xbb</span>'+'\xa0'*(n-1)+'\u200b')
+
+    return ''.join(t)
 
-    return t.getvalue()
+def convert(s, ponct=0, tag=''):
+    table = convert_table(ponct, tag)
+    parts = re_segment[ponct].split(s)
+    parts[::2] = [x.translate(table) for x in parts[::2]]
+    parts[1::2] = [convert_segment(x, ponct, table) for x in parts[1::2]]
+    return ''.join(parts)
 
 def output_visual(visual, path, indentstr, indentnum):
     logger.debug('including image for %s', visual.source)
@@ -212,8 +280,10 @@ def output_node(ctx, difference, path, indentstr, indentnum):
     udiff = u""
     ud_cont = None
     if difference.unified_diff:
-        ud_cont = HTMLSideBySidePresenter().output_unified_diff(
-            ctx, difference.unified_diff, difference.has_internal_linenos)
+        if ctx.pool is not None:
+            ud_cont = ctx.pool.output_unified_diff(difference)
+        else:
+            ud_cont = output_unified_diff(ctx, difference)
         udiff = next(ud_cont)
         if isinstance(udiff, PartialString):
             ud_cont = ud_cont.send
@@ -283,8 +353,14 @@ def spl_file_printer(directory, filename, accum):
         yield recording_print_func
 
 
+def output_unified_diff(ctx, difference):
+    return HTMLSideBySidePresenter().output_unified_diff(
+        ctx, difference.unified_diff, difference.has_internal_linenos,
+        difference.diff_index)
+
+
 class HTMLPrintContext(collections.namedtuple("HTMLPrintContext",
-    "target single_page jquery_url css_url our_css_url icon_url")):
+    "target single_page jquery_url css_url our_css_url icon_url pool")):
     @property
     def directory(self):
         return None if self.single_page else self.target
@@ -410,7 +486,7 @@ class HTMLSideBySidePresenter(object):
         }
         self.spl_print_func(self.error_row)
 
-    def output_unified_diff_table(self, unified_diff, has_internal_linenos):
+    def output_unified_diff_table(self, unified_diff, has_internal_linenos, diff_index=None):
         """Output a unified diff <table> possibly over multiple pages.
 
         It is the caller's responsibility to set up self.spl_* correctly.
@@ -419,7 +495,7 @@ class HTMLSideBySidePresenter(object):
         on whether the whole output was truncated.
         """
         try:
-            ydiff = SideBySideDiff(unified_diff)
+            ydiff = SideBySideDiff(unified_diff, index=diff_index)
             for t, args in ydiff.items():
                 if t == "L":
                     self.output_line(has_internal_linenos, *args)
@@ -452,7 +528,7 @@ class HTMLSideBySidePresenter(object):
             self.spl_print_func(u"</table>")
         yield wrote_all
 
-    def output_unified_diff(self, ctx, unified_diff, has_internal_linenos):
+    def output_unified_diff(self, ctx, unified_diff, has_internal_linenos, diff_index=None):
         self.new_unified_diff()
         rotation_params = None
         if ctx.directory:
@@ -465,7 +541,7 @@ class HTMLSideBySidePresenter(object):
             self.spl_print_func = udiff.write
             self.spl_print_ctrl = None, rotation_params
 
-            it = self.output_unified_diff_table(unified_diff, has_internal_linenos)
+            it = self.output_unified_diff_table(unified_diff, has_internal_linenos, diff_index)
             wrote_all = next(it)
             if wrote_all is None:
                 assert self.spl_current_page == 1
@@ -505,6 +581,166 @@ class HTMLSideBySidePresenter(object):
         yield self.bytes_written, parent_last_row
 
 
+def worker_init(config):
+    # Workers do not inherit our state, as they are not forked from us
+    Config().__dict__.update(config)
+
+
+def worker_render(ctx, unified_diff, has_internal_linenos, diff_index):
+    """
+    Render a unified diff in full, including any child pages, as if the
+    report had no overall size limit.
+    """
+
+    presenter = HTMLSideBySidePresenter()
+    it = presenter.output_unified_diff(
+        ctx, unified_diff, has_internal_linenos, diff_index)
+    udiff = next(it)
+    if not isinstance(udiff, PartialString):
+        return udiff, 0, None
+    rest = it.send(sys.maxsize)
+    return udiff, presenter.spl_current_page, rest
+
+
+class HTMLPagePool(object):
+    """
+    Renders the unified diffs of a report, and their child pages, ahead of
+    time in a pool of worker processes for html-dir output.
+
+    Diffs are rendered as output_difference discovers them, most of those it
+    will reach next first, and without the overall report size limit. As
+    each is reached, the pages are kept if the limit would not have been hit
+    and are otherwise re-rendered serially, so that the output is identical
+    to the serial version.
+
+    The workers are started by a fork server rather than forked from us, as
+    a copy of a process with other threads may inherit locks that they hold.
+    """
+
+    def __init__(self, ctx, jobs):
+        self.ctx = ctx
+        self.jobs = jobs
+        self.upcoming = [] # heap of (score, node) discovered but not submitted
+        self.queued = set() # nodes in upcoming that were not reached yet
+        self.futures = {} # nodes to (mainname, result)
+        self.duplicates = {} # nodes to the result writing the same pages
+        self.mainnames = {} # unified diff hashes to the result writing their pages
+        self.written = set() # unified diff hashes whose pages were kept
+        self.executor = multiprocessing.get_context('forkserver').Pool(
+            jobs,
+            worker_init,
+            (dict(Config().__dict__),),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.close()
+        for mainname, result in self.futures.values():
+            try:
+                _, pages, _ = result.get()
+            except Exception:
+                continue
+            # Never reached, so the serial version would not have written it
+            self.remove_pages(mainname, pages)
+        self.executor.join()
+
+    def discover(self, nodes, parscore):
+        """
+        Note that output_difference will reach `nodes`, the details of the
+        node it reached with the score `parscore`.
+        """
+
+        for x in nodes:
+            if x.unified_diff:
+                heapq.heappush(self.upcoming, (smallest_first(x, parscore)[:3], x))
+                self.queued.add(x)
+        self.submit()
+
+    def submit(self):
+        # Bound the number of rendered diffs waiting to be output
+        while self.upcoming and \
+                len(self.futures) + len(self.duplicates) < 4 * self.jobs:
+            _, node = heapq.heappop(self.upcoming)
+            if node not in self.queued:
+                continue
+            self.queued.remove(node)
+            mainname = md5(node.unified_diff)
+            if mainname in self.written:
+                # Rewriting them when reached is harmless; removing them
+                # if not reached would not be.
+                continue
+            if mainname in self.mainnames:
+                # Same pages; let the first one finish writing them
+                self.duplicates[node] = self.mainnames[mainname]
+                continue
+            result = self.executor.apply_async(worker_render, (
+                self.ctx._replace(pool=None),
+                node.unified_diff,
+                node.has_internal_linenos,
+                node.diff_index,
+            ))
+            self.futures[node] = mainname, result
+            self.mainnames[mainname] = result
+
+    def remove_pages(self, mainname, pages):
+        for x in range(1, pages + 1):
+            try:
+                os.remove(os.path.join(
+                    self.ctx.directory,
+                    "%s-%s.html" % (mainname, x),
+                ))
+            except FileNotFoundError:
+                pass
+
+    def output_unified_diff(self, difference):
+        self.queued.discard(difference)
+        if difference in self.duplicates:
+            self.duplicates.pop(difference).wait()
+
+        if difference not in self.futures:
+            self.submit()
+            return output_unified_diff(self.ctx, difference)
+
+        mainname, result = self.futures.pop(difference)
+        del self.mainnames[mainname]
+        self.written.add(mainname)
+        self.submit()
+        return self.output_rendered(difference, mainname, *result.get())
+
+    def output_rendered(self, difference, mainname, udiff, pages, rest):
+        """
+        Behaves as HTMLSideBySidePresenter.output_unified_diff, using the
+        output of worker_render where possible.
+        """
+
+        if rest is None:
+            yield udiff
+            return
+
+        try:
+            new_limit = yield udiff
+        except GeneratorExit:
+            # Leave the first child page as the serial version would have
+            self.remove_pages(mainname, pages)
+            it = output_unified_diff(self.ctx, difference)
+            next(it)
+            it.close()
+            return
+
+        bytes_written, _ = rest
+        if new_limit and bytes_written <= new_limit:
+            yield rest
+            return
+
+        logger.debug("re-rendering unified diff %s within report limit", mainname)
+        self.remove_pages(mainname, pages)
+        it = output_unified_diff(self.ctx, difference)
+        next(it)
+        yield it.send(new_limit)
+
+
 class HTMLPresenter(Presenter):
     supports_visual_diffs = True
 
@@ -563,12 +799,6 @@ class HTMLPresenter(Presenter):
         continuations = {} # functions to print unified diff continuations (html-dir only)
         printers = {} # nodes to their printers
 
-        def smallest_first(node, parscore):
-            depth = parscore[0] + 1 if parscore else 0
-            parents = parscore[3] if parscore else []
-            # Difference is not comparable so use memory address in event of a tie
-            return depth, node.size_self(), id(node), parents + [node]
-
         for node, score in difference.traverse_heapq(smallest_first, yield_score=True):
             ancestor = ancestors.pop(node, None)
             path = score[3]
@@ -625,6 +855,8 @@ class HTMLPresenter(Presenter):
 
             for child in node.details:
                 ancestors[child] = stored
+            if ctx.pool is not None:
+                ctx.pool.discover(node.details, score)
 
             conts = continuations.setdefault(stored, [])
             if node_continuation:
@@ -692,8 +924,13 @@ class HTMLPresenter(Presenter):
             fp.write(templates.STYLES)
         with open(os.path.join(directory, "icon.png"), "wb") as fp:
             fp.write(base64.b64decode(FAVICON_BASE64))
-        ctx = HTMLPrintContext(directory, False, jquery_url, css_url, "common.css", "icon.png")
-        self.output_difference(ctx, difference)
+        ctx = HTMLPrintContext(directory, False, jquery_url, css_url, "common.css", "icon.png", None)
+        if Config().jobs <= 1:
+            self.output_difference(ctx, difference)
+            return
+
+        with HTMLPagePool(ctx, Config().jobs) as pool:
+            self.output_difference(ctx._replace(pool=pool), difference)
 
 
     def output_html(self, target, difference, css_url=None, jquery_url=None):
@@ -701,7 +938,7 @@ class HTMLPresenter(Presenter):
         Default presenter, all in one HTML file
         """
         jquery_url = self.ensure_jquery(jquery_url, os.getcwd(), None)
-        ctx = HTMLPrintContext(target, True, jquery_url, css_url, None, None)
+        ctx = HTMLPrintContext(target, True, jquery_url, css_url, None, None, None)
         self.output_difference(ctx, difference)
 
     @classmethod
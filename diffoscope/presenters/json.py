@@ -18,48 +18,121 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import json
-from collections import OrderedDict
 
-from .utils import Presenter
+from .utils import Presenter, make_printer
 
 JSON_FORMAT_VERSION = 1
 JSON_FORMAT_MAGIC = "diffoscope-json-version"
 
 
 class JSONPresenter(Presenter):
-    def __init__(self, print_func):
-        self.stack = []
+    """
+    Writes each node as it is visited, rather than building a copy of the
+    tree to serialise all at once. The output is the same as that of
+    json.dumps(..., indent=2) or, if `compact`, with no whitespace at all.
+    """
+
+    supports_streaming = True
+
+    def __init__(self, print_func, compact=False):
         self.print_func = print_func
+        self.compact = compact
+        self.key_separator = ':' if compact else ': '
 
         super().__init__()
 
+    @classmethod
+    def run(cls, data, difference, parsed_args):
+        with make_printer(data['target']) as fn:
+            cls(fn, parsed_args.json_compact).start(difference)
+
     def start(self, difference):
-        root = []
-        self.stack = [root]
         super().start(difference)
+        self.print_func()
+
+    def visit(self, difference, first=True):
+        level = 2 * self.depth
+
+        if self.depth > 0:
+            self.write('' if first else ',')
+            self.newline(level)
 
-        root[0][JSON_FORMAT_MAGIC] = JSON_FORMAT_VERSION
-        root[0].move_to_end(JSON_FORMAT_MAGIC, last=False)
-        self.print_func(json.dumps(root[0], indent=2))
+        self.visit_difference(difference)
+
+        if difference.has_details():
+            self.depth += 1
+            for idx, x in enumerate(difference.iter_details()):
+                self.visit(x, idx == 0)
+            self.depth -= 1
+
+            self.newline(level + 1)
+            self.write(']')
+
+        self.newline(level)
+        self.write('}')
 
     def visit_difference(self, difference):
-        while self.depth + 1 < len(self.stack):
-            self.stack.pop()
+        level = 2 * self.depth + 1
 
         elements = [
-            ('source1', difference.source1),
-            ('source2', difference.source2)
+            ('source1', json.dumps(difference.source1)),
+            ('source2', json.dumps(difference.source2)),
         ]
+        if self.depth == 0:
+            elements.insert(0, (JSON_FORMAT_MAGIC, str(JSON_FORMAT_VERSION)))
         if difference.comments:
-            elements += [('comments', [x for x in difference.comments])]
+            elements.append(('comments', self.list_(
+                [json.dumps(x) for x in difference.comments],
+                level,
+            )))
         if difference.has_internal_linenos:
-            elements += [('has_internal_linenos', True)]
-        elements += [('unified_diff', difference.unified_diff)]
+            elements.append(('has_internal_linenos', 'true'))
+
+        self.write('{')
+        for key, val in elements:
+            self.key(key, level)
+            self.write(val)
+            self.write(',')
+
+        self.key('unified_diff', level)
+        self.string(difference.unified_diff)
+
+        if difference.has_details():
+            self.write(',')
+            self.key('details', level)
+            self.write('[')
+
+    def key(self, key, level):
+        self.newline(level)
+        self.write(json.dumps(key) + self.key_separator)
+
+    def string(self, val):
+        if val is None:
+            self.write('null')
+            return
+
+        if isinstance(val, str):
+            self.write(json.dumps(val))
+            return
+
+        # The diff was spilled to disk; output it piecemeal. Escaping is per
+        # character so we can escape each chunk separately.
+        self.write('"')
+        for x in val.chunks():
+            self.write(json.dumps(x)[1:-1])
+        self.write('"')
+
+    def list_(self, vals, level):
+        if self.compact:
+            return '[' + ','.join(vals) + ']'
+
+        indent = '\n' + '  ' * (level + 1)
+        return '[' + ','.join(indent + x for x in vals) + \
+            '\n' + '  ' * level + ']'
 
-        child_differences = []
-        if difference.details:
-            elements += [('details', child_differences)]
+    def newline(self, level):
+        if not self.compact:
+            self.write('\n' + '  ' * level)
 
-        self.stack[-1].append(OrderedDict(elements))
-        if difference.details:
-            self.stack.append(child_differences)
+    def write(self, val):
+        self.print_func(val, end='')
@@ -21,6 +21,8 @@ from .utils import Presenter
 
 
 class MarkdownTextPresenter(Presenter):
+    supports_streaming = True
+
     def __init__(self, print_func):
         self.print_func = print_func
         super().__init__()
@@ -39,7 +41,7 @@ class MarkdownTextPresenter(Presenter):
             self.print_func()
 
         if difference.unified_diff:
-            self.print_func(self.indent(difference.unified_diff, '    '))
+            self.print_func(self.indent(str(difference.unified_diff), '    '))
             self.print_func()
 
     def title(self, val):
@@ -22,6 +22,7 @@ from .utils import Presenter
 
 class RestructuredTextPresenter(Presenter):
     TITLE_CHARS = '=-`:.\'"~^_*+#'
+    supports_streaming = True
 
     def __init__(self, print_func):
         self.print_func = print_func
@@ -43,7 +44,7 @@ class RestructuredTextPresenter(Presenter):
         if difference.unified_diff:
             self.print_func('::')
             self.print_func()
-            self.print_func(self.indent(difference.unified_diff, '    '))
+            self.print_func(self.indent(str(difference.unified_diff), '    '))
             self.print_func()
 
     def title(self, val):
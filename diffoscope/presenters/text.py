@@ -33,6 +33,7 @@ logger = logging.getLogger(__name__)
 class TextPresenter(Presenter):
     PREFIX = u'│ '
     RE_PREFIX = re.compile(r'(^|\n)')
+    supports_streaming = True
 
     def __init__(self, print_func, color):
         self.print_func = create_limited_print_func(
@@ -84,8 +85,36 @@ class TextPresenter(Presenter):
 
         diff = difference.unified_diff
 
-        if diff:
-            self.output(color_unified_diff(diff) if self.color else diff, True)
+        if not diff:
+            return
+
+        if isinstance(diff, str):
+            if self.color:
+                diff = color_unified_diff(diff, difference.diff_index)
+            self.output(diff, True)
+            return
+
+        # The diff was spilled to disk; output it piecemeal.
+        self.output_chunks(
+            (color_unified_diff(x) if self.color else x for x in diff.chunks()),
+            self.PREFIX * self.depth,
+        )
+
+    def output_chunks(self, chunks, prefix):
+        # Like output(), but for a string split into chunks of complete lines.
+        # As indent() strips trailing whitespace, the last line with any
+        # content and everything after it is always held back.
+        pending = ''
+        for chunk in chunks:
+            val = pending + chunk
+            cut = val.rstrip().rfind('\n')
+            if cut < 0:
+                pending = val
+                continue
+            self.print_func(prefix + val[:cut].replace('\n', '\n' + prefix))
+            pending = val[cut + 1:]
+
+        self.print_func(self.indent(pending, prefix))
 
     def output(self, val, raw=False):
         self.print_func(
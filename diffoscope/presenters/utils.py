@@ -24,6 +24,12 @@ import contextlib
 import string
 import _string
 
+# Where the HTML presenters look for jQuery. Defined here so that --help can
+# mention them without importing those presenters.
+JQUERY_SYSTEM_LOCATIONS = (
+    '/usr/share/javascript/jquery/jquery.js',
+)
+
 
 def round_sigfig(num, s):
     # https://stackoverflow.com/questions/3410976/how-to-round-a-number-to-significant-figures-in-python
@@ -46,6 +52,9 @@ def sizeof_fmt(num, suffix='B', sigfig=3):
 
 class Presenter(object):
     supports_visual_diffs = False
+    # Whether the Difference may still be being computed while we visit it,
+    # ie. we visit each node once, in order.
+    supports_streaming = False
 
     def __init__(self):
         self.depth = 0
@@ -63,7 +72,7 @@ class Presenter(object):
 
         self.depth += 1
 
-        for x in difference.details:
+        for x in difference.iter_details():
             self.visit(x)
 
         self.depth -= 1
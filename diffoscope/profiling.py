@@ -19,6 +19,7 @@
 
 import sys
 import time
+import threading
 import contextlib
 import collections
 
@@ -40,6 +41,7 @@ class ProfileManager(object):
         self.__dict__ = self._singleton
 
         if not self._singleton:
+            self.lock = threading.Lock()
             self.data = collections.defaultdict(
                 lambda: collections.defaultdict(lambda: {
                     'time': 0.0,
@@ -58,8 +60,9 @@ class ProfileManager(object):
                 key.__class__.__name__,
             )
 
-        self.data[namespace][key]['time'] += time.time() - start
-        self.data[namespace][key]['count'] += 1
+        with self.lock:
+            self.data[namespace][key]['time'] += time.time() - start
+            self.data[namespace][key]['count'] += 1
 
     def finish(self, parsed_args):
         from .presenters.utils import make_printer
@@ -21,6 +21,7 @@ import os
 import sys
 import json
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
@@ -85,11 +86,22 @@ class ProgressManager(object):
 
         return log_handler
 
+    def is_tracking(self):
+        # Only the main thread reports progress; comparisons running in
+        # worker threads (see --jobs) are accounted for by their parent step.
+        return threading.current_thread() is threading.main_thread()
+
     def push(self, progress):
+        if not self.is_tracking():
+            return
         assert not self.stack or self.stack[-1].is_active()
         self.stack.append(progress)
 
     def pop(self, progress):
+        if not self.is_tracking() or progress not in self.stack:
+            # Either a worker thread or a stale Progress that outlived a
+            # reset(), eg. a generator that was abandoned and later closed.
+            return
         x = self.stack.pop()
         assert x is progress
         if self.stack:
@@ -100,6 +112,8 @@ class ProgressManager(object):
         self.observers.append(observer)
 
     def update(self, msg):
+        if not self.is_tracking():
+            return
         if self.stack:
             cur_estimates = None
             for progress in reversed(self.stack):
@@ -25,5 +25,5 @@ def load_diff_from_path(path):
         return load_diff(fp, path)
 
 
-def load_diff(fp, path):
-    return JSONReaderV1().load(fp, 'stdin')
+def load_diff(fp, path, lazily=False):
+    return JSONReaderV1().load(fp, path, lazily)
@@ -17,35 +17,300 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import re
 import json
 import codecs
+import collections
 
+from json.decoder import scanstring
+
+from ..diff import DiffBuffer
+from ..config import Config
+from ..tempfiles import get_named_temporary_file
 from ..difference import Difference
 from ..presenters.json import JSON_FORMAT_MAGIC
 
 from .utils import UnrecognizedFormatError
 
+# Runs of characters and complete escapes, keeping surrogate pairs together
+re_string_chunk = re.compile(
+    r'(?:[^"\\\x00-\x1f]+|\\["\\/bfnrt]'
+    r'|\\u(?![dD][89abAB])[0-9a-fA-F]{4}'
+    r'|\\u[dD][89abAB][0-9a-fA-F]{2}(?:\\u[dD][c-fC-F][0-9a-fA-F]{2}'
+    r'|(?=[^\\]|\\[^u]|\\u(?![dD][c-fC-F])[0-9a-fA-F]{2})))*'
+)
+re_literal = re.compile(r'-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?|true|false|null')
+re_literal_end = re.compile(r'[\s,:\]}]')
+
+
+class JSONParser(object):
+    """
+    A minimal pull parser for JSON, reading `fp` a chunk at a time so that
+    neither the document nor any of its strings need be held in memory.
+    """
+
+    CHUNK_SIZE = 2 ** 20
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, n=1):
+        """
+        Ensure there are at least `n` characters past the current position,
+        if possible. Returns whether there are.
+        """
+
+        while len(self.buf) - self.pos < n and not self.eof:
+            data = self.fp.read(self.CHUNK_SIZE)
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            self.eof = not data
+            self.buf = self.buf[self.pos:] + \
+                self.decoder.decode(data, final=self.eof)
+            self.pos = 0
+
+        return len(self.buf) - self.pos >= n
+
+    def error(self, expected):
+        raise UnrecognizedFormatError("Expected {} in JSON, found {!r}".format(
+            expected,
+            self.buf[self.pos:self.pos + 10] if self.fill() else 'end of file',
+        ))
+
+    def peek(self):
+        """
+        Returns the next non-whitespace character, without consuming it.
+        """
+
+        while True:
+            if not self.fill():
+                return None
+            c = self.buf[self.pos]
+            if not c.isspace():
+                return c
+            self.pos += 1
+
+    def expect(self, c):
+        if self.peek() != c:
+            self.error(repr(c))
+        self.pos += 1
+
+    def items(self, start, end):
+        """
+        Consume the opening `start`, then return a generator that consumes
+        any separators and yields before each item until the closing `end`.
+        """
+
+        self.expect(start)
+
+        def fn():
+            if self.peek() == end:
+                self.pos += 1
+                return
+            while True:
+                yield
+                c = self.peek()
+                self.pos += 1
+                if c == end:
+                    return
+                if c != ',':
+                    self.pos -= 1
+                    self.error("',' or {!r}".format(end))
+
+        return fn()
+
+    def keys(self):
+        """
+        Yield each key of an object. The caller must consume its value.
+        """
+
+        for _ in self.items('{', '}'):
+            key = self.string()
+            self.expect(':')
+            yield key
+
+    def string(self, write=None):
+        """
+        Consume a string, passing it piecemeal to `write` if given, otherwise
+        returning it.
+        """
+
+        if write is None:
+            parts = []
+            self.string(parts.append)
+            return ''.join(parts)
+
+        self.expect('"')
+
+        while True:
+            # Decode as much of the string as we have complete escapes for
+            end = re_string_chunk.match(self.buf, self.pos).end()
+            if self.buf[end:end + 1] == '"':
+                val, self.pos = scanstring(self.buf, self.pos)
+                write(val)
+                return
+            if end < len(self.buf) - 12:
+                self.pos = end
+                self.error('a valid string')
+            if end > self.pos:
+                write(scanstring(self.buf[self.pos:end] + '"', 0)[0])
+                self.pos = end
+            elif self.eof:
+                self.error("'\"'")
+            self.fill(13)
+
+    def value(self):
+        """
+        Consume any value and return it.
+        """
+
+        c = self.peek()
+
+        if c == '"':
+            return self.string()
+        if c == '{':
+            return {x: self.value() for x in self.keys()}
+        if c == '[':
+            return [self.value() for _ in self.items('[', ']')]
+
+        while True:
+            m = re_literal_end.search(self.buf, self.pos)
+            if m is not None or not self.fill(len(self.buf) - self.pos + 1):
+                break
+        m = re_literal.match(self.buf, self.pos)
+        if m is None:
+            self.error('a value')
+        self.pos = m.end()
+
+        return json.loads(m.group())
+
+
+class PendingDetails(object):
+    """
+    The details of a node that are still to be read. finish() reads the rest
+    of them ahead of being iterated over, so that the parser can move on to
+    the node's siblings.
+    """
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.finished = collections.deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            return self.finished.popleft()
+        return next(self.iterator)
+
+    def finish(self):
+        self.finished.extend(self.iterator)
+
 
 class JSONReaderV1(object):
-    def load(self, fp, fn):
-        raw = json.load(codecs.getreader('utf-8')(fp))
-        if JSON_FORMAT_MAGIC not in raw or raw[JSON_FORMAT_MAGIC] != 1:
+    REQUIRED_KEYS = frozenset(('source1', 'source2', 'unified_diff'))
+
+    def load(self, fp, fn, lazily=False):
+        """
+        Read a report from `fp`. If `lazily`, the details of each node are
+        only read as they are iterated over, so `fp` must be kept open until
+        the caller is done with the result. Otherwise, as the whole report is
+        read at once, all the diffs are kept in a temporary file rather than
+        in memory, unless that was disabled with --max-diff-in-memory-size.
+        """
+
+        self.spool = None
+        if not lazily and Config().max_diff_in_memory_size < float('inf'):
+            self.spool = get_named_temporary_file(mode='w+b')
+
+        difference, _ = self.load_rec(JSONParser(fp), lazily, root=True)
+
+        return difference
+
+    def load_rec(self, parser, lazily, root=False):
+        raw = {}
+        keys = parser.keys()
+
+        for key in keys:
+            if key == 'unified_diff':
+                if parser.peek() == 'n':
+                    raw[key] = parser.value()
+                    continue
+                # Large diffs, or all of them if spooling, are kept on disk
+                # rather than in memory
+                if self.spool is None:
+                    buf = DiffBuffer()
+                else:
+                    buf = DiffBuffer(0, self.spool)
+                parser.string(buf.write)
+                raw[key] = buf.getvalue()
+            elif key == 'details':
+                # We write the details last, after everything else we need
+                # to create the node. Other writers, such as json.dump with
+                # sort_keys, may not, so then read them in full here.
+                if lazily and self.REQUIRED_KEYS.issubset(raw) and \
+                        (not root or JSON_FORMAT_MAGIC in raw):
+                    break
+                raw[key] = list(self.load_details(parser, False))
+            else:
+                raw[key] = parser.value()
+        else:
+            keys = None
+
+        if root and raw.get(JSON_FORMAT_MAGIC) != 1:
             raise UnrecognizedFormatError(
                 "Magic not found in JSON: {}".format(JSON_FORMAT_MAGIC)
             )
-        return self.load_rec(raw)
-
-    def load_rec(self, raw):
-        source1 = raw['source1']
-        source2 = raw['source2']
-        unified_diff = raw['unified_diff']
-        comments = raw.get('comments', [])
-        details = [self.load_rec(child) for child in raw.get('details', [])]
-
-        return Difference(
-            unified_diff,
-            source1,
-            source2,
-            comment=comments,
-            details=details,
+
+        difference = Difference(
+            raw['unified_diff'],
+            raw['source1'],
+            raw['source2'],
+            comment=raw.get('comments', []),
+            has_internal_linenos=raw.get('has_internal_linenos', False),
         )
+
+        if keys is None:
+            difference.add_details(raw.get('details', []))
+            return difference, None
+
+        details = self.load_details(parser, lazily, keys, difference)
+        if not lazily:
+            difference.add_details(list(details))
+            return difference, None
+
+        pending = PendingDetails(details)
+        difference.add_lazy_details(pending)
+
+        return difference, pending
+
+    def load_details(self, parser, lazily, keys=(), difference=None):
+        """
+        Yield the details of a node. Any `keys` of the node that follow them
+        are then read into `difference`; of those, only comments can still
+        be added to it.
+        """
+
+        pending = None
+
+        for _ in parser.items('[', ']'):
+            # Our parser is shared, so the previous sibling must be read in
+            # full before we can move on.
+            if pending is not None:
+                pending.finish()
+            difference, pending = self.load_rec(parser, lazily)
+            yield difference
+
+        if pending is not None:
+            pending.finish()
+
+        for key in keys:
+            value = parser.value()
+            if key == 'comments':
+                for x in value:
+                    difference.add_comment(x)
@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import shutil
 import collections
 import functools
 import platform
@@ -26,14 +27,12 @@ try:
 except ImportError:
     distro = None
 
-from distutils.spawn import find_executable
-
 from .profiling import profile
 from .external_tools import EXTERNAL_TOOLS
 
-# Memoize calls to ``distutils.spawn.find_executable`` to avoid excessive stat
-# calls
-find_executable = functools.lru_cache()(find_executable)
+# Memoize calls to ``shutil.which`` to avoid excessive stat calls. (Importing
+# distutils for its find_executable costs more than most comparisons.)
+find_executable = functools.lru_cache()(shutil.which)
 
 # The output of --help and --list-tools will use the order of this dict.
 # Please keep it alphabetized.
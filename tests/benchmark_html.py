@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+
+"""
+Benchmark convert() from the HTML presenter against its original
+character-at-a-time implementation on a large side-by-side diff.
+
+Run with `python3 -m tests.benchmark_html [LINES]`.
+"""
+
+import io
+import sys
+import html
+import time
+import random
+
+from diffoscope.diff import SideBySideDiff, DIFFON, DIFFOFF
+from diffoscope.presenters.html.html import convert, LINESIZE, TABSIZE, \
+    WORDBREAK
+
+
+def convert_reference(s, ponct=0, tag=''):
+    i = 0
+    t = io.StringIO()
+    for c in s:
+        # used by diffs
+        if c == DIFFON:
+            t.write('<%s>' % tag)
+        elif c == DIFFOFF:
+            t.write('</%s>' % tag)
+
+        # special highlighted chars
+        elif c == "\t" and ponct == 1:
+            n = TABSIZE-(i%TABSIZE)
+            if n == 0:
+                n = TABSIZE
+            t.write('<span class="diffponct">\xbb</span>'+'\xa0'*(n-1))
+        elif c == " " and ponct == 1:
+            t.write('<span class="diffponct">\xb7</span>')
+        elif c == "\n" and ponct == 1:
+            t.write('<br/><span class="diffponct">\\</span>')
+        elif ord(c) < 32:
+            conv = u"\\x%x" % ord(c)
+            t.write('<em>%s</em>' % conv)
+            i += len(conv)
+        else:
+            t.write(html.escape(c))
+            i += 1
+
+        if WORDBREAK.count(c) == 1:
+            t.write('\u200b')
+            i = 0
+        if i > LINESIZE:
+            i = 0
+            t.write('\u200b')
+
+    return t.getvalue()
+
+
+def unified_diff(lines):
+    """
+    A unified diff of a hexdump and some source code in which about half of
+    the lines have changed.
+    """
+
+    rnd = random.Random(0)
+    result = ['--- a\n', '+++ b\n', '@@ -1,{0} +1,{0} @@\n'.format(lines)]
+
+    for x in range(lines):
+        if x % 2:
+            data = bytes(rnd.randrange(256) for _ in range(16))
+            line = '{:08x}: {}  {}\n'.format(x * 16, data.hex(), ''.join(
+                chr(y) if 32 <= y < 127 else '.' for y in data
+            ))
+        else:
+            line = '\tif (x->{0} < 0 && y[{1}] != "<{0}>")\t/* {1} */\n'.format(
+                'field_{}'.format(rnd.randrange(10 ** 6)), x,
+            )
+
+        if rnd.random() < 0.5:
+            result.append(' ' + line)
+            continue
+
+        changed = list(line)
+        for _ in range(3):
+            changed[rnd.randrange(len(line) - 1)] = rnd.choice('0123456789abcdef ')
+        result.append('-' + line)
+        result.append('+' + ''.join(changed))
+
+    return ''.join(result)
+
+
+def main(lines=20000):
+    rows = [
+        args for type_, args in SideBySideDiff(unified_diff(lines)).items()
+        if type_ == 'L'
+    ]
+    calls = [(s1, 'del') for _, s1, _, _, _ in rows if s1] + \
+        [(s2, 'ins') for _, _, _, s2, _ in rows if s2]
+    print("{} rows, {} calls, {} characters".format(
+        len(rows),
+        len(calls),
+        sum(len(s) for s, _ in calls),
+    ))
+
+    results = {}
+    for fn in (convert_reference, convert):
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            output = [fn(s, ponct=1, tag=tag) for s, tag in calls]
+            best = min(best, time.perf_counter() - start)
+        results[fn] = output
+        print("{:>20}: {:.3f}s".format(fn.__name__, best))
+
+    assert results[convert] == results[convert_reference]
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -19,6 +19,7 @@
 
 import os.path
 import pytest
+import collections
 import subprocess
 
 from os import mkdir, symlink
@@ -28,6 +29,7 @@ from diffoscope.tools import tool_required
 from diffoscope.exc import RequiredToolNotFound
 from diffoscope.difference import Difference
 from diffoscope.comparators.binary import FilesystemFile
+from diffoscope.comparators.utils import file as file_module
 from diffoscope.comparators.utils.file import File
 from diffoscope.comparators.missing_file import MissingFile
 from diffoscope.comparators.utils.compare import Xxd
@@ -52,6 +54,62 @@ def test_same_content(binary1):
 def test_not_same_content(binary1, binary2):
     assert binary1.has_same_content_as(binary2) is False
 
+def test_same_content_hardlink(tmpdir):
+    path1 = str(tmpdir.join('a'))
+    path2 = str(tmpdir.join('b'))
+    with open(path1, 'wb') as f:
+        f.write(b'content')
+    os.link(path1, path2)
+    assert FilesystemFile(path1).has_same_content_as(FilesystemFile(path2)) is True
+
+def test_same_content_remembers_digest(tmpdir):
+    path1 = str(tmpdir.join('a'))
+    path2 = str(tmpdir.join('b'))
+    for x in (path1, path2):
+        with open(x, 'wb') as f:
+            f.write(b'content' * 100000)
+    file1, file2 = FilesystemFile(path1), FilesystemFile(path2)
+    assert file1.has_same_content_as(file2) is True
+    assert file1._digest == file2._digest
+    assert FilesystemFile(path1).known_digest(os.stat(path1)) == file1._digest
+
+def test_not_same_content_known_digest(tmpdir, monkeypatch):
+    path1 = str(tmpdir.join('a'))
+    path2 = str(tmpdir.join('b'))
+    for x, y in ((path1, b'a'), (path2, b'b')):
+        with open(x, 'wb') as f:
+            f.write(y * 100000)
+    file1, file2 = FilesystemFile(path1), FilesystemFile(path2)
+    file1.remember_digest(os.stat(path1), 'digest')
+
+    def fail(path):
+        raise AssertionError("{} was hashed in full".format(path))
+    monkeypatch.setattr(file_module, 'file_digest', fail)
+
+    assert file1.has_same_content_as(file2) is False
+
+def test_digests_bounded(tmpdir, monkeypatch):
+    monkeypatch.setattr(file_module, 'MAX_DIGESTS', 2)
+    monkeypatch.setattr(file_module, '_digests', collections.OrderedDict())
+    for x in 'abc':
+        path = str(tmpdir.join(x))
+        with open(path, 'wb') as f:
+            f.write(x.encode('ascii'))
+        file_module.path_digest(path)
+    assert len(file_module._digests) == 2
+    assert [x[0] for x in file_module._digests] == \
+        [str(tmpdir.join(x)) for x in 'bc']
+
+@pytest.mark.skipif(not os.path.exists('/proc/version'), reason='requires /proc')
+def test_same_content_proc(tmpdir):
+    # Files in /proc report a size of 0 despite having content
+    path = str(tmpdir.join('version'))
+    with open('/proc/version', 'rb') as f, open(path, 'wb') as g:
+        g.write(f.read())
+    proc = FilesystemFile('/proc/version')
+    assert proc.has_same_content_as(FilesystemFile(path)) is True
+    assert proc.has_same_content_as(FilesystemFile('/proc/self/cmdline')) is False
+
 def test_guess_file_type():
     assert File.guess_file_type(TEST_FILE1_PATH) == 'data'
 
@@ -27,6 +27,7 @@ from diffoscope.comparators.directory import compare_directories
 from diffoscope.comparators.utils.specialize import specialize
 
 from ..utils.data import data, get_data
+from ..utils.tools import skip_unless_tools_exist
 
 
 TEST_FILE1_PATH = data('text_ascii1')
@@ -65,6 +66,56 @@ def test_content(differences):
 def test_stat(differences):
     assert 'stat' in differences[0].details[0].details[0].source1
 
+def test_directory_walk(tmpdir, monkeypatch):
+    from diffoscope.comparators.directory import DirectoryWalk
+
+    tmpdir.mkdir('a').mkdir('b').join('c').write('content')
+    tmpdir.join('d').write('content')
+    os.symlink('a', str(tmpdir.join('e')))
+
+    def os_walk(path):
+        all_files = []
+        for root, dirs, names in os.walk(path):
+            all_files.extend(os.path.relpath(os.path.join(root, x), path)
+                             for x in dirs + names)
+        return sorted(all_files)
+
+    walk = DirectoryWalk(str(tmpdir))
+    assert walk.list_files() == os_walk(str(tmpdir))
+    assert walk.list_files('a') == os_walk(str(tmpdir.join('a')))
+    assert walk.members() == ['a', 'd', 'e']
+
+    # Everything was stat'd once, while listing
+    def lstat(path):
+        raise AssertionError(path)
+    monkeypatch.setattr(os, 'lstat', lstat)
+
+    assert walk.is_directory('a/b')
+    assert not walk.is_directory('e')
+    assert walk.stat('a/b/c').st_size == 7
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_member_stat_fails(tmpdir, monkeypatch, jobs):
+    from diffoscope.config import Config
+    from diffoscope.comparators.directory import DirectoryWalk
+
+    for x in ('a', 'b'):
+        tmpdir.mkdir(x).join('file').write(x)
+        tmpdir.join(x).join('other').write('content')
+
+    # eg. it vanished or access was denied since the directory was listed
+    orig = DirectoryWalk.stat
+    def stat(self, relpath=''):
+        if relpath == 'file':
+            raise PermissionError(relpath)
+        return orig(self, relpath)
+    monkeypatch.setattr(DirectoryWalk, 'stat', stat)
+    monkeypatch.setattr(Config(), 'jobs', jobs)
+
+    difference = compare_directories(str(tmpdir.join('a')), str(tmpdir.join('b')))
+    details = [x for x in difference.details if x.source1.endswith('file')]
+    assert details[0].comments == ["Unable to read the metadata of file"]
 
 def test_compare_to_file(tmpdir):
     path = str(tmpdir.join('file'))
@@ -100,3 +151,102 @@ def test_compare_to_dangling_symlink(tmpdir):
     b = specialize(FilesystemFile(path))
 
     assert a.compare(b).unified_diff == get_data('test_directory_symlink_diff')
+
+def test_stat_text(tmpdir):
+    from diffoscope.comparators.directory import stat_text
+
+    path = str(tmpdir.join('file'))
+    with open(path, 'w') as f:
+        f.write("content")
+    os.chmod(path, 0o640)
+    os.utime(path, ns=(0, 123456789))
+
+    lines = stat_text(path).split('\n')
+    assert lines[0] == ''
+    assert lines[1].startswith('  Size: 7         \tBlocks: ')
+    assert lines[1].endswith(' regular file')
+    assert lines[2] == 'Links: 1'
+    assert lines[3].startswith('Access: (0640/-rw-r-----)  Uid: (')
+    assert lines[5] == 'Modify: 1970-01-01 00:00:00.123456789 +0000'
+    assert lines[7:] == [' Birth: -', '']
+
+@pytest.mark.skipif(not hasattr(os, 'getxattr'), reason="requires xattrs")
+def test_getfacl_text(tmpdir):
+    import struct
+    from diffoscope.comparators.directory import getfacl_text
+
+    path = str(tmpdir.join('file'))
+    open(path, 'w').close()
+    os.chmod(path, 0o640)
+
+    assert getfacl_text(path) == 'user::rw-\ngroup::r--\nother::---\n\n'
+
+    # user::rw- user:12345:rwx group::r-- mask::r-- other::---
+    acl = struct.pack('<I', 2) + b''.join(struct.pack('<HHI', *x) for x in (
+        (0x01, 6, 0xffffffff),
+        (0x02, 7, 12345),
+        (0x04, 4, 0xffffffff),
+        (0x10, 4, 0xffffffff),
+        (0x20, 0, 0xffffffff),
+    ))
+    try:
+        os.setxattr(path, 'system.posix_acl_access', acl)
+    except OSError:
+        pytest.skip("ACLs not supported here")
+
+    assert getfacl_text(path).split('\n')[1] == \
+        'user:12345:rwx\t\t\t#effective:r--'
+
+def test_ioc_read(monkeypatch):
+    import collections
+    from diffoscope.comparators.directory import ioc_read
+
+    def machine(x):
+        uname = collections.namedtuple('uname', 'machine')
+        monkeypatch.setattr(os, 'uname', lambda: uname(x))
+
+    machine('x86_64')
+    assert ioc_read('f', 1, 8) == 0x80086601
+    machine('armv7l')
+    assert ioc_read('f', 1, 4) == 0x80046601
+    machine('ppc64le')
+    assert ioc_read('f', 1, 8) == 0x40086601
+    machine('mips')
+    assert ioc_read('f', 1, 4) == 0x40046601
+    machine('parisc64')
+    assert ioc_read('f', 1, 8) is None
+
+@skip_unless_tools_exist('lsattr')
+def test_lsattr_command(tmpdir, monkeypatch):
+    from diffoscope.comparators import directory
+
+    path = str(tmpdir.join('file'))
+    open(path, 'w').close()
+
+    expected = directory.lsattr(path)
+    monkeypatch.setattr(directory, 'FS_IOC_GETFLAGS', None)
+    assert directory.lsattr(path) == expected
+
+def test_streaming(tmpdir):
+    from diffoscope.comparators.utils.container import streaming
+    from diffoscope.presenters.text import TextPresenter
+
+    for x in range(3):
+        tmpdir.join('a/dir{}/text'.format(x)).write('a', ensure=True)
+        tmpdir.join('b/dir{}/text'.format(x)).write('b', ensure=True)
+    a, b = str(tmpdir.join('a')), str(tmpdir.join('b'))
+
+    def present(difference):
+        lines = []
+        TextPresenter(lines.append, False).start(difference)
+        return lines
+
+    expected = present(compare_directories(a, b))
+
+    with streaming():
+        difference = compare_directories(a, b)
+        # Only the outermost comparison is lazy
+        assert difference._lazy_details is not None
+        assert all(x._lazy_details is None for x in difference._details)
+
+        assert present(difference) == expected
@@ -17,11 +17,16 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import io
+import time
 import pytest
 import os.path
+import collections
 
+from diffoscope import cache
 from diffoscope.config import Config
-from diffoscope.comparators.elf import ElfFile, StaticLibFile
+from diffoscope.comparators.elf import ElfFile, StaticLibFile, \
+    ReadelfDebugDump, ObjdumpDisassembleSection
 from diffoscope.comparators.binary import FilesystemFile
 from diffoscope.comparators.directory import FilesystemDirectory
 from diffoscope.comparators.missing_file import MissingFile
@@ -41,10 +46,34 @@ def test_obj_no_differences(obj1):
     difference = obj1.compare(obj1)
     assert difference is None
 
+@pytest.mark.parametrize('command', (
+    ReadelfDebugDump('info', '/tmp/lib.a'),
+    ObjdumpDisassembleSection('/tmp/lib.a', '.text'),
+))
+def test_filter_block(command):
+    block = b''.join((
+        b'File: /tmp/lib.a(foo.o)\n',
+        b'/tmp/lib.a:     file format elf64-x86-64\n',
+        b'In archive /tmp/lib.a:\n',
+        b'  401000:\t48 89 e5 \tcallq 401000 # 401000 <main>\n',
+        b' <1><2d>: Abbrev Number: 2 (DW_TAG_base_type) # \xff\n',
+        b'  DW_AT_name        : /tmp/lib.a',
+    ))
+    expected = b''.join(map(command.filter, io.BytesIO(block)))
+    assert command.filter_block(block) == expected
+
 @pytest.fixture
 def obj_differences(obj1, obj2):
     return obj1.compare(obj2).details
 
+@skip_unless_tools_exist('readelf')
+def test_obj_deadline(monkeypatch, obj1, obj2):
+    monkeypatch.setattr(cache, '_memo', collections.OrderedDict())
+    monkeypatch.setattr(Config(), 'deadline', time.monotonic())
+    difference = obj1.compare(obj2)
+    assert 'exceeded its time limit' in difference.comment
+    assert 'Falling back to binary comparison' in difference.comment
+
 @skip_unless_tools_exist('readelf')
 @skip_if_binutils_does_not_support_x86()
 def test_obj_compare_non_existing(monkeypatch, obj1):
@@ -70,3 +70,23 @@ def test_no_permissions_dir_in_tarball(monkeypatch, no_permissions_tar):
     # Comparing with non-existing file makes it easy to make sure all files are unpacked
     monkeypatch.setattr(Config(), 'new_file', True)
     no_permissions_tar.compare(MissingFile('/nonexistent', no_permissions_tar))
+
+def test_get_member_reads_archive_once(monkeypatch, tar1):
+    import libarchive
+    from diffoscope.comparators.utils import libarchive as utils_libarchive
+
+    calls = []
+    file_reader = libarchive.file_reader
+    def counting_file_reader(*args, **kwargs):
+        calls.append(args)
+        return file_reader(*args, **kwargs)
+    monkeypatch.setattr(utils_libarchive.libarchive, 'file_reader', counting_file_reader)
+
+    container = tar1.as_container
+    assert [x for x, _ in container.get_filtered_members()] == \
+        ['dir/', 'dir/text', 'dir/null', 'dir/link']
+    assert container.get_member('dir/link').symlink_destination == 'broken'
+    assert container.get_member('dir/').is_directory()
+    with pytest.raises(KeyError):
+        container.get_member('dir/missing')
+    assert len(calls) == 1
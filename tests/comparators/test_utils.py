@@ -17,12 +17,18 @@
 # You should have received a copy of the GNU General Public License
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
+import time
+import itertools
 import codecs
 import pytest
+import subprocess
 
+from diffoscope.tools import tool_required
 from diffoscope.config import Config
 from diffoscope.difference import Difference
 from diffoscope.comparators.utils.command import Command
+from diffoscope.executor import degrade, degradable
+from diffoscope.comparators.utils.container import map_comparisons, defer
 
 from ..utils.data import data, load_fixture
 from ..utils.tools import tools_missing, skip_unless_tools_exist, \
@@ -71,6 +77,138 @@ def test_fuzzy_matching_only_once(fuzzy_tar1, fuzzy_tar3):
     differences = fuzzy_tar1.compare(fuzzy_tar3).details
     assert len(differences) == 2
 
+@skip_unless_module_exists('tlsh')
+def test_fuzzy_index():
+    import tlsh
+    import random
+    from diffoscope.comparators.utils.fuzzy import FuzzyIndex
+
+    rng = random.Random(0)
+    base = bytes(rng.randrange(256) for _ in range(4096))
+
+    def mutate(x):
+        x = bytearray(x[:rng.randrange(512, len(x))])
+        for _ in range(rng.randrange(len(x) // 4)):
+            x[rng.randrange(len(x))] = rng.randrange(256)
+        return tlsh.hash(bytes(x))
+
+    digests1 = [mutate(base) for _ in range(40)]
+    digests2 = [mutate(base) for _ in range(40)]
+
+    for threshold in (30, 60, 120, 400):
+        index = FuzzyIndex(threshold)
+        for i, x in enumerate(digests2):
+            index.add(i, x)
+        remaining = list(range(len(digests2)))
+        for x in digests1:
+            expected = None
+            scores = sorted((tlsh.diff(x, digests2[i]), i) for i in remaining)
+            if scores and scores[0][0] < threshold:
+                expected = scores[0]
+            assert index.best_match(x) == expected
+            if expected is not None:
+                index.remove(expected[1])
+                remaining.remove(expected[1])
+
+def test_specialize_index():
+    import os
+    from diffoscope.comparators import ComparatorManager
+    from diffoscope.comparators.binary import FilesystemFile
+    from diffoscope.comparators.utils.specialize import specialize
+
+    def recognized_by(file):
+        for cls in ComparatorManager().load_all():
+            if cls.recognizes(file):
+                return cls.__name__
+
+    datadir = os.path.dirname(data('test1.tar'))
+    for x in sorted(os.listdir(datadir)):
+        path = os.path.join(datadir, x)
+        if not os.path.isfile(path):
+            continue
+        expected = recognized_by(FilesystemFile(path))
+        file = specialize(FilesystemFile(path))
+        assert (type(file).__name__ if expected else None) == expected, x
+
+def test_comparators_registry():
+    import os
+    from diffoscope.comparators import ComparatorManager
+    from diffoscope.comparators.binary import FilesystemFile
+    from diffoscope.comparators.utils.file import File
+    from diffoscope.comparators.utils.specialize import SpecializeIndex
+
+    def pattern(x):
+        return x and x.pattern
+
+    comparators = ComparatorManager().comparators
+    custom = {}
+    for idx, comparator in enumerate(comparators):
+        cls = comparator.load()
+        if getattr(cls.recognizes, '__func__', None) is \
+                File.recognizes.__func__:
+            assert comparator.exact or \
+                comparator.names[0].startswith('debian.'), comparator
+            continue
+        if not comparator.indexed:
+            continue
+
+        # Any tests the class declares must be those of the registry
+        declared = (
+            getattr(cls, 'FILE_EXTENSION_SUFFIX', None),
+            getattr(cls, 'FILE_TYPE_HEADER_PREFIX', None),
+            pattern(getattr(cls, 'FILE_TYPE_RE', None)),
+        )
+        if any(declared):
+            assert declared == (
+                comparator.suffix,
+                comparator.header_prefix,
+                pattern(comparator.file_type_re),
+            ), comparator
+        custom[idx] = cls
+
+    # A custom recognizes() may accept files beyond its declared tests, so
+    # also check that the registry admits every test file the class does.
+    index = SpecializeIndex(comparators)
+    accepted = set()
+    datadir = os.path.dirname(data('test1.tar'))
+    for x in sorted(os.listdir(datadir)):
+        path = os.path.join(datadir, x)
+        if not os.path.isfile(path):
+            continue
+        candidates = index.candidates(FilesystemFile(path))
+        for idx, cls in custom.items():
+            if cls.recognizes(FilesystemFile(path)):
+                assert idx in candidates, (comparators[idx], x)
+                accepted.add(idx)
+    assert accepted
+
+def test_comparators_imported_lazily(tmpdir):
+    import sys
+    import subprocess
+
+    a = tmpdir.join('a.txt')
+    b = tmpdir.join('b.txt')
+    a.write('a\n')
+    b.write('b\n')
+    script = """
+import sys
+from diffoscope.main import main
+try:
+    main([{!r}, {!r}])
+except SystemExit:
+    pass
+print(' '.join(sorted(sys.modules)), file=sys.stderr)
+""".format(str(a), str(b))
+    p = subprocess.run(
+        (sys.executable, '-c', script),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    modules = p.stderr.decode('utf-8').split()
+    assert 'diffoscope.comparators.text' in modules
+    for x in ('deb', 'elf', 'rpm', 'tar', 'zip'):
+        assert 'diffoscope.comparators.{}'.format(x) not in modules
+
 fuzzy_tar_in_tar1 = load_fixture('fuzzy-tar-in-tar1.tar')
 fuzzy_tar_in_tar2 = load_fixture('fuzzy-tar-in-tar2.tar')
 
@@ -101,3 +239,85 @@ def test_trim_stderr_in_command():
                 stdin.write('error {}\n'.format(self.path).encode('utf-8'))
     difference = Difference.from_command(FillStderr, 'dummy1', 'dummy2')
     assert '[ 1 lines ignored ]' in difference.comment
+
+class Sleep(Command):
+    @tool_required('sleep')
+    def cmdline(self):
+        return ['sleep', '10']
+
+def test_command_timeout(monkeypatch):
+    monkeypatch.setattr(Config(), 'command_timeout', 1)
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        Difference.from_command(Sleep, 'dummy1', 'dummy2')
+    assert time.monotonic() - start < 5
+
+def test_command_deadline(monkeypatch):
+    monkeypatch.setattr(Config(), 'deadline', time.monotonic())
+    with pytest.raises(subprocess.TimeoutExpired) as exc:
+        Difference.from_command(Sleep, 'dummy1', 'dummy2')
+    assert exc.value.timeout == 0
+
+def test_map_comparisons_cost(monkeypatch):
+    monkeypatch.setattr(Config(), 'jobs', 2)
+    started = []
+
+    def compare_pair(x, y, z):
+        started.append(x)
+        time.sleep(0.01)
+        return x
+
+    comparisons = [(x, None, None) for x in (1, 5, 2, 4, 3)]
+    result = list(map_comparisons(
+        compare_pair,
+        iter(comparisons),
+        lambda x, y, z: x,
+    ))
+
+    # Results are in order, but the largest were started first
+    assert result == [1, 5, 2, 4, 3]
+    assert set(started[:2]) == {4, 5}
+
+
+def test_map_comparisons_degraded(monkeypatch):
+    monkeypatch.setattr(Config(), 'jobs', 2)
+
+    def compare_pair(x, y, z):
+        if x == 3:
+            degrade()
+        return x
+
+    comparisons = [(x, None, None) for x in range(5)]
+    with degradable() as degraded:
+        results = map_comparisons(compare_pair, iter(comparisons))
+        assert list(itertools.islice(results, 3)) == [0, 1, 2]
+        assert not degraded()
+        assert list(results) == [3, 4]
+        assert degraded()
+
+def test_map_comparisons_deferred(monkeypatch):
+    monkeypatch.setattr(Config(), 'jobs', 2)
+    events = []
+
+    def comparisons():
+        for x in range(100):
+            events.append(('read', x))
+            defer(events.append, ('step', x))
+            yield x, None, None
+        defer(events.append, ('end', None))
+
+    def compare_pair(x, y, z):
+        events.append(('start', x))
+        return x
+
+    result = list(map_comparisons(compare_pair, comparisons(), lambda *x: 1))
+
+    assert result == list(range(100))
+    # Each step begins as its comparison is started, not as it is read
+    for x in range(100):
+        assert events.index(('step', x)) < events.index(('start', x))
+    for x in range(2, 100):
+        assert events.index(('step', x)) > events.index(('start', x - 2))
+    assert events[-1] == ('end', None)
+    # The look-ahead is bounded by the number of jobs
+    assert events.index(('read', 99)) > events.index(('start', 50))
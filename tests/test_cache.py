@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import pytest
+import collections
+
+from diffoscope import cache
+from diffoscope.exc import RequiredToolNotFound
+from diffoscope.tools import tool_required
+from diffoscope.config import Config
+from diffoscope.difference import Difference
+from diffoscope.comparators.tar import TarFile
+from diffoscope.comparators.utils.command import Command
+
+from .utils.data import data, load_fixture
+from .utils.tools import skip_unless_tools_exist
+
+
+tar1 = load_fixture('test1.tar')
+tar2 = load_fixture('test2.tar')
+
+
+@pytest.fixture
+def cache_dir(tmpdir, monkeypatch):
+    path = str(tmpdir.mkdir('cache'))
+    monkeypatch.setattr(Config(), 'cache_dir', path)
+    return path
+
+def cache_size(path):
+    return sum(
+        os.path.getsize(os.path.join(x, y))
+        for x, _, ys in os.walk(path) for y in ys
+    )
+
+@pytest.fixture
+def text_files(tmpdir):
+    paths = []
+    for x in ('a', 'b'):
+        path = tmpdir.join(x)
+        path.write('common\n{}\n'.format(x))
+        paths.append(str(path))
+    return paths
+
+@pytest.fixture
+def memo(monkeypatch):
+    monkeypatch.setattr(cache, '_memo', collections.OrderedDict())
+    return cache._memo
+
+def compare(file1, file2):
+    from diffoscope.comparators.utils.compare import compare_files
+
+    return compare_files(file1, file2)
+
+def test_cache_hit(tar1, tar2, cache_dir, monkeypatch):
+    expected = compare(tar1, tar2)
+    assert os.listdir(cache_dir)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Comparison was not cached")
+    monkeypatch.setattr(TarFile, 'compare', fail)
+
+    assert compare(tar1, tar2).equals(expected)
+
+def test_cache_disabled(tar1, tar2, cache_dir, monkeypatch):
+    monkeypatch.setattr(Config(), 'cache_dir', None)
+    compare(tar1, tar2)
+    assert not os.listdir(cache_dir)
+
+def test_cache_key_depends_on_config(tar1, tar2, cache_dir, monkeypatch):
+    compare(tar1, tar2)
+    size = cache_size(cache_dir)
+
+    monkeypatch.setattr(Config(), 'max_diff_block_lines_saved', 1)
+    compare(tar1, tar2)
+    assert cache_size(cache_dir) > size
+
+def test_cache_eviction(tar1, tar2, cache_dir, monkeypatch):
+    monkeypatch.setattr(Config(), 'max_cache_size', 2048)
+    compare(tar1, tar2)
+    assert cache_size(cache_dir) <= 2048
+
+@skip_unless_tools_exist('xxd')
+def test_cache_degraded(cache_dir, memo, monkeypatch):
+    from diffoscope.comparators.binary import FilesystemFile
+    from diffoscope.comparators.utils.specialize import specialize
+
+    file1 = specialize(FilesystemFile(data('binary1')))
+    file2 = specialize(FilesystemFile(data('binary2')))
+
+    # Past the --deadline, xxd is not even started
+    monkeypatch.setattr(Config(), 'deadline', time.monotonic() - 1)
+    difference = compare(file1, file2)
+    assert 'xxd exceeded its time limit' in difference.comments[0]
+    assert not cache_entries(cache_dir)
+
+    monkeypatch.setattr(Config(), 'deadline', None)
+    difference = compare(file1, file2)
+    assert not difference.comments
+    assert cache_entries(cache_dir)
+
+def test_cache_streaming(tar1, tar2, cache_dir):
+    from diffoscope.comparators.utils.container import streaming
+
+    with streaming():
+        difference = compare(tar1, tar2)
+    assert difference.has_lazy_details()
+
+    names = [x['names'] for x in cache_entries(cache_dir).values()]
+    assert [tar1.name, tar2.name] not in names
+
+    details = list(difference.iter_details())
+    assert details
+    assert len(cache_entries(cache_dir)) > len(names)
+
+def cache_entries(path):
+    result = {}
+    for x, _, ys in os.walk(path):
+        for y in ys:
+            if y.endswith('.json'):
+                with open(os.path.join(x, y)) as f:
+                    result[y[:-len('.json')]] = json.load(f)
+    return result
+
+def test_cache_members_not_repeated(tar1, tar2, cache_dir):
+    compare(tar1, tar2)
+
+    seen = set()
+    for raw in cache_entries(cache_dir).values():
+        stack = [raw['difference']]
+        while stack:
+            x = stack.pop()
+            if not x or 'ref' in x:
+                continue
+            if x['unified_diff'] is not None:
+                assert x['unified_diff'] not in seen
+                seen.add(x['unified_diff'])
+            stack.extend(x['details'])
+    assert seen
+
+def test_cache_member_evicted(tar1, tar2, cache_dir):
+    expected = compare(tar1, tar2)
+
+    for key, raw in cache_entries(cache_dir).items():
+        if raw['difference'] and not raw['difference']['details']:
+            os.unlink(cache.cache_path(key))
+
+    assert compare(tar1, tar2).equals(expected)
+
+def test_cache_size_index(tar1, tar2, cache_dir, monkeypatch):
+    compare(tar1, tar2)
+
+    def entries_size():
+        return sum(x[1] for x in cache.entries())
+
+    with open(os.path.join(cache_dir, cache.SIZE_INDEX)) as f:
+        assert int(f.read()) == entries_size()
+
+    def fail():
+        raise AssertionError("Cache directory was walked")
+    monkeypatch.setattr(cache, 'entries', fail)
+
+    compare(tar1, tar2)
+
+
+class Cat(Command):
+    @tool_required('cat')
+    def cmdline(self):
+        return ['cat', self.path]
+
+def command_not_cached(*args, **kwargs):
+    raise AssertionError("Command output was not cached")
+
+def test_command_cache_hit(text_files, cache_dir, memo, monkeypatch):
+    expected = Difference.from_command(Cat, *text_files)
+    memo.clear()
+    monkeypatch.setattr(Cat, 'start', command_not_cached)
+
+    assert Difference.from_command(Cat, *text_files).equals(expected)
+
+def test_command_memo(text_files, memo, monkeypatch):
+    expected = Difference.from_command(Cat, *text_files)
+    assert len(memo) == 2
+    monkeypatch.setattr(Cat, 'start', command_not_cached)
+
+    assert Difference.from_command(Cat, *text_files).equals(expected)
+
+class Missing(Command):
+    def cmdline(self):
+        return ['diffoscope-missing-tool', self.path]
+
+def test_command_tool_missing(text_files, cache_dir, memo):
+    with pytest.raises(RequiredToolNotFound) as exc:
+        Difference.from_command(Missing, *text_files)
+
+    assert exc.value.command == 'diffoscope-missing-tool'
+
+def test_command_cache_key_depends_on_content(text_files, cache_dir, memo):
+    Difference.from_command(Cat, *text_files)
+    memo.clear()
+    with open(text_files[1], 'a') as f:
+        f.write('more\n')
+
+    difference = Difference.from_command(Cat, *text_files)
+    assert '+more' in difference.unified_diff
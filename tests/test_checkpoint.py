@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import time
+import shutil
+import pytest
+import collections
+
+from diffoscope import cache
+from diffoscope.config import Config
+from diffoscope.checkpoint import journal
+from diffoscope.comparators.directory import compare_directories
+from diffoscope.comparators.utils import compare
+
+from .utils.data import data
+from .utils.tools import skip_unless_tools_exist
+
+
+@pytest.fixture
+def dirs(tmpdir):
+    for x in ('a', 'b'):
+        tmpdir.mkdir(x)
+    for x in range(5):
+        shutil.copy(data('text_ascii1'), str(tmpdir.join('a/{}'.format(x))))
+        shutil.copy(data('text_ascii2'), str(tmpdir.join('b/{}'.format(x))))
+    return str(tmpdir.join('a')), str(tmpdir.join('b'))
+
+@pytest.fixture
+def checkpoint(tmpdir, monkeypatch):
+    path = str(tmpdir.join('checkpoint'))
+    monkeypatch.setattr(Config(), 'checkpoint', path)
+    return path
+
+def run(path1, path2):
+    with journal(path1, path2):
+        return compare_directories(path1, path2)
+
+def count_compares(monkeypatch):
+    calls = []
+    orig = compare.compare_files
+    def fn(*args, **kwargs):
+        calls.append(args)
+        return orig(*args, **kwargs)
+    monkeypatch.setattr(compare, 'compare_files', fn)
+    return calls
+
+def test_resume(dirs, checkpoint, monkeypatch):
+    expected = run(*dirs)
+
+    calls = count_compares(monkeypatch)
+    assert run(*dirs).equals(expected)
+    assert not calls
+
+def test_resume_partial(dirs, checkpoint, monkeypatch):
+    expected = run(*dirs)
+
+    # Simulate being killed after the second member, halfway through
+    # writing the third.
+    with open(checkpoint, 'rb') as f:
+        lines = f.readlines()
+    with open(checkpoint, 'wb') as f:
+        f.writelines(lines[:3])
+        f.write(lines[3][:10])
+
+    calls = count_compares(monkeypatch)
+    assert run(*dirs).equals(expected)
+    assert len(calls) == 3
+
+    with open(checkpoint, 'rb') as f:
+        assert f.readlines() == lines
+
+def test_different_inputs(dirs, checkpoint, monkeypatch):
+    run(*dirs)
+
+    calls = count_compares(monkeypatch)
+    run(*reversed(dirs))
+    assert len(calls) == 5
+
+@skip_unless_tools_exist('xxd')
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_degraded(tmpdir, checkpoint, monkeypatch, jobs):
+    for x in ('a', 'b'):
+        tmpdir.mkdir(x)
+    for x in range(3):
+        shutil.copy(data('binary1'), str(tmpdir.join('a/{}'.format(x))))
+        shutil.copy(data('binary2'), str(tmpdir.join('b/{}'.format(x))))
+    dirs = str(tmpdir.join('a')), str(tmpdir.join('b'))
+
+    # Don't replay the output of xxd from earlier tests
+    monkeypatch.setattr(cache, '_memo', collections.OrderedDict())
+    monkeypatch.setattr(Config(), 'jobs', jobs)
+    monkeypatch.setattr(Config(), 'deadline', time.monotonic() - 1)
+    run(*dirs)
+
+    # Only the header was written
+    with open(checkpoint, 'rb') as f:
+        assert len(f.readlines()) == 1
+
+    monkeypatch.setattr(Config(), 'deadline', None)
+    calls = count_compares(monkeypatch)
+    run(*dirs)
+    assert len(calls) == 3
+
+def test_disabled(dirs, tmpdir, monkeypatch):
+    run(*dirs)
+    assert not os.path.exists(str(tmpdir.join('checkpoint')))
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import io
+import pytest
+import random
+
+from diffoscope.diff import SpilledDiff, DiffBuffer, DiffIndex, \
+    reverse_unified_diff, linediff
+from diffoscope.config import Config
+from diffoscope.difference import Difference
+from diffoscope.presenters.text import TextPresenter
+
+from .utils.tools import skip_unless_tools_exist
+
+
+def texts():
+    r = random.Random(0)
+    for _ in range(200):
+        base = [r.choice('abcde') for _ in range(r.choice((0, 3, 20, 100)))]
+        pair = []
+        for _ in range(2):
+            lines = list(base)
+            for _ in range(r.randint(0, 8)):
+                i = r.randint(0, len(lines))
+                if r.random() < 0.5:
+                    lines.insert(i, r.choice('abcxyz'))
+                elif lines:
+                    del lines[min(i, len(lines) - 1)]
+            text = '\n'.join(lines)
+            if lines and r.random() < 0.7:
+                text += '\n'
+            pair.append(text)
+        yield pair
+
+
+def compare(text1, text2):
+    difference = Difference.from_text_readers(
+        io.StringIO(text1),
+        io.StringIO(text2),
+        'a',
+        'b',
+    )
+    return difference and difference.unified_diff
+
+
+@skip_unless_tools_exist('diff')
+def test_same_output_as_diff(monkeypatch):
+    pairs = list(texts())
+
+    monkeypatch.setattr(Config(), 'max_diff_in_process_lines', 0)
+    expected = [compare(*x) for x in pairs]
+
+    monkeypatch.setattr(Config(), 'max_diff_in_process_lines', 1000)
+    assert [compare(*x) for x in pairs] == expected
+
+
+@skip_unless_tools_exist('diff')
+@pytest.mark.parametrize('limit', (0, 5, 1000))
+def test_limit(monkeypatch, limit):
+    monkeypatch.setattr(Config(), 'max_diff_in_process_lines', limit)
+    diff = compare('a\n' * 10 + 'b\n', 'a\n' * 10 + 'c\n')
+    assert diff == '@@ -4,8 +4,8 @@\n' + ' a\n' * 7 + '-b\n+c\n'
+
+
+def test_spilled_diff(monkeypatch):
+    text1 = ''.join('{}\n'.format(x) for x in range(100))
+    text2 = text1.replace('5', 'five')
+    expected = compare(text1, text2)
+
+    monkeypatch.setattr(Config(), 'max_diff_in_memory_size', 10)
+    diff = compare(text1, text2)
+
+    assert isinstance(diff, SpilledDiff)
+    assert len(diff) == len(expected)
+    assert diff == expected
+    assert str(diff) == expected
+    assert list(diff.splitlines(True)) == expected.splitlines(True)
+    assert ''.join(diff.chunks(size=10)) == expected
+    assert reverse_unified_diff(diff) == reverse_unified_diff(expected)
+
+
+def test_spilled_diff_spool(tmpdir):
+    import pickle
+
+    texts = ['', 'a\n' * 10, '\u00e9\nb\n', 'c' * 100]
+
+    with open(str(tmpdir.join('spool')), 'w+b') as spool:
+        diffs = []
+        for x in texts:
+            buf = DiffBuffer(0, spool)
+            buf.write(x[:5])
+            buf.write(x[5:])
+            diffs.append(buf.getvalue())
+
+        assert diffs[0] == ''
+        for diff, expected in zip(diffs[1:], texts[1:]):
+            assert isinstance(diff, SpilledDiff)
+            assert len(diff) == len(expected)
+            assert str(diff) == expected
+            assert ''.join(diff.chunks(size=3)) == expected
+            assert pickle.loads(pickle.dumps(diff)) == expected
+
+
+def test_spilled_diff_text_output(monkeypatch):
+    def output(difference):
+        lines = []
+        TextPresenter(lines.append, False).start(difference)
+        return lines
+
+    text1 = ''.join('{}\n'.format(x) for x in range(100)) + ' \n \n'
+    text2 = text1.replace('5', 'five  ')
+    expected = output(Difference.from_text(text1, text2, 'a', 'b'))
+
+    monkeypatch.setattr(Config(), 'max_diff_in_memory_size', 10)
+    difference = Difference.from_text(text1, text2, 'a', 'b')
+
+    assert isinstance(difference.unified_diff, SpilledDiff)
+    assert '\n'.join(output(difference)) == '\n'.join(expected)
+
+
+def test_linediff():
+    assert linediff('hello world\x03', 'hallo wurld', '[', ']') == \
+        ('h[e]llo w[o]rld[.]', 'h[a]llo w[u]rld')
+    assert linediff('', 'xyz', '[', ']') == ('', '[xyz]')
+
+
+def test_linediff_long_lines():
+    r = random.Random(0)
+    s = ''.join(r.choice('abcdef') for _ in range(20000))
+    t = s[:5000] + 'XY' + s[5001:15000] + s[15002:]
+
+    s1, t1 = linediff(s, t, '[', ']')
+
+    assert 'truncated' not in s1
+    assert s1.replace('[', '').replace(']', '') == s
+    assert t1.replace('[', '').replace(']', '') == t
+    assert len(s1) - len(s) == 4
+    assert t1 == s[:5000] + '[XY]' + s[5001:15000] + s[15002:]
+
+
+def test_diff_index():
+    text1 = ''.join('{}\n'.format(x) for x in range(30))
+    text2 = text1.replace('1', 'one')
+    difference = Difference.from_text(text1, text2, 'a', 'b')
+    index = difference.diff_index
+    diff = difference.unified_diff
+
+    assert isinstance(index, DiffIndex)
+    assert index.types == DiffIndex.from_text(diff).types
+    assert index.offsets == DiffIndex.from_text(diff).offsets
+    assert ''.join(x for _, x in index.lines(diff, keepends=True)) == diff
+    assert [chr(x) for x, _ in index.lines(diff)] == [x[0] for x in diff.splitlines()]
+
+    reverse = difference.get_reverse()
+    assert reverse.diff_index.types == \
+        DiffIndex.from_text(reverse.unified_diff).types
+    assert reverse.diff_index.offsets == \
+        DiffIndex.from_text(reverse.unified_diff).offsets
+
+
+def test_diff_index_reverse_non_canonical_header():
+    diff = '@@  -1,2 +1,2  @@\n a\n-b\n+c\n'
+    difference = Difference(diff, 'a', 'b')
+
+    reverse = difference.get_reverse()
+    assert reverse.unified_diff == '@@ -1,2 +1,2 @@\n a\n+b\n-c\n'
+    assert reverse.diff_index.offsets == \
+        DiffIndex.from_text(reverse.unified_diff).offsets
+    assert [x for _, x in reverse.diff_index.lines(reverse.unified_diff)] == \
+        reverse.unified_diff.splitlines()
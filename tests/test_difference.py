@@ -21,6 +21,7 @@ import io
 import itertools
 import pytest
 
+from diffoscope import feeders
 from diffoscope.config import Config
 from diffoscope.difference import Difference
 
@@ -43,6 +44,19 @@ def test_too_much_input_for_diff(monkeypatch):
     assert '[ Too much input for diff ' in difference.unified_diff
     assert_algebraic_properties(difference, 290)
 
+@pytest.mark.parametrize('size', (1, 3, 4096))
+def test_too_much_input_for_diff_blocks(monkeypatch, size):
+    monkeypatch.setattr(Config(), 'max_diff_input_lines', 20)
+    content = b''.join(b'%d\n' % x for x in range(21))
+    expected = io.BytesIO()
+    feeders.from_raw_reader(io.BytesIO(content))(expected)
+    out = io.BytesIO()
+    blocks = feeders.read_blocks(io.BytesIO(content), size)
+    feeders._from_blocks(blocks, lambda buf: buf)(out)
+    assert out.getvalue() == expected.getvalue()
+    assert out.getvalue().startswith(content[:content.index(b'19\n')])
+    assert b'[ Too much input for diff ' in out.getvalue()
+
 def test_too_long_diff_block_lines(monkeypatch):
     monkeypatch.setattr(Config(), 'enforce_constraints', False)
     monkeypatch.setattr(Config(), 'max_diff_block_lines_saved', 10)
@@ -97,3 +111,29 @@ def test_non_str_arguments_to_source1_source2():
 
         with pytest.raises(TypeError):
             Difference.from_text_readers(a, b, *x)
+
+def test_lazy_details():
+    def details():
+        for x in 'bc':
+            consumed.append(x)
+            yield Difference("0", "path1/" + x, "path2/" + x)
+
+    consumed = []
+    d = Difference(None, "path1", "path2")
+    d.add_details([Difference("0", "path1/a", "path2/a")])
+    d.add_lazy_details(details())
+    assert d.has_details()
+    assert consumed == []
+
+    d.add_details([Difference("0", "path1/d", "path2/d")])
+    assert consumed == ['b', 'c']
+    assert [x.source1 for x in d.details] == ['path1/' + x for x in 'abcd']
+
+def test_iter_lazy_details():
+    d = Difference(None, "path1", "path2")
+    d.add_lazy_details(Difference("0", "path1/" + x, "path2/" + x) for x in 'ab')
+    assert d.has_details()
+
+    assert [x.source1 for x in d.iter_details()] == ['path1/a', 'path1/b']
+    # Only the first was needed by has_details(), so only it was kept
+    assert [x.source1 for x in d.details] == ['path1/a']
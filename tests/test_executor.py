@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# diffoscope: in-depth comparison of files, archives, and directories
+#
+# Copyright © 2026 agent <agent@local>
+#
+# diffoscope is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# diffoscope is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import pytest
+import threading
+import subprocess
+
+from diffoscope.config import Config
+from diffoscope.executor import gather, limit_processes, degrade, \
+    degradable, check_output
+
+
+def test_gather_order(monkeypatch):
+    monkeypatch.setattr(Config(), 'jobs', 4)
+
+    def fn(x):
+        return lambda: time.sleep(0.01 * (5 - x)) or x
+
+    assert gather(*[fn(x) for x in range(5)]) == list(range(5))
+
+def test_gather_jobs(monkeypatch):
+    fn = threading.current_thread
+
+    monkeypatch.setattr(Config(), 'jobs', 1)
+    assert gather(fn, fn) == [fn(), fn()]
+
+    monkeypatch.setattr(Config(), 'jobs', 2)
+    assert fn() not in gather(fn, fn)
+
+def test_gather_first_exception():
+    def fail(x):
+        def inner():
+            raise ValueError(x)
+        return inner
+
+    with pytest.raises(ValueError) as exc:
+        gather(lambda: 1, fail('first'), fail('second'))
+
+    assert exc.value.args == ('first',)
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_gather_degraded(monkeypatch, jobs):
+    monkeypatch.setattr(Config(), 'jobs', jobs)
+
+    with degradable() as outer:
+        with degradable() as degraded:
+            gather(lambda: 1, lambda: 2)
+        assert not degraded()
+        with degradable() as degraded:
+            gather(lambda: 1, degrade)
+        assert degraded()
+        with degradable() as degraded:
+            pass
+        assert not degraded()
+    assert outer()
+
+def test_gather_nested():
+    assert gather(lambda: gather(lambda: 1, lambda: 2), lambda: 3) == [[1, 2], 3]
+
+def concurrency(fn):
+    lock = threading.Lock()
+    state = {'current': 0, 'max': 0}
+
+    def inner():
+        with lock:
+            state['current'] += 1
+            state['max'] = max(state['max'], state['current'])
+        time.sleep(0.01)
+        with lock:
+            state['current'] -= 1
+
+    threads = [threading.Thread(target=fn, args=(inner,)) for _ in range(8)]
+    for x in threads:
+        x.start()
+    for x in threads:
+        x.join()
+
+    return state['max']
+
+def test_limit_processes(monkeypatch):
+    monkeypatch.setattr(Config(), 'max_processes', 4)
+
+    def fn(inner):
+        with limit_processes(2):
+            inner()
+
+    assert concurrency(fn) == 2
+
+def test_limit_processes_tool(monkeypatch):
+    monkeypatch.setattr(Config(), 'max_processes', 0)
+
+    def fn(inner):
+        # More than the limit of the tool is capped rather than deadlocking
+        with limit_processes(2, 'tool', 1):
+            inner()
+
+    assert concurrency(fn) == 1
+
+def test_limit_processes_nested(monkeypatch):
+    monkeypatch.setattr(Config(), 'max_processes', 2)
+
+    def fn(inner):
+        # eg. diff(1) comparing the output of the two commands held for
+        with limit_processes(2):
+            with limit_processes(1):
+                inner()
+
+    assert concurrency(fn) == 1
+
+def test_check_output_limited(monkeypatch):
+    monkeypatch.setattr(Config(), 'max_processes', 2)
+    local = threading.local()
+    monkeypatch.setattr(subprocess, 'check_output', lambda cmd: local.inner())
+
+    def fn(inner):
+        local.inner = inner
+        check_output(['true'])
+
+    assert concurrency(fn) == 2
@@ -18,10 +18,13 @@
 # along with diffoscope.  If not, see <https://www.gnu.org/licenses/>.
 
 import os
+import sys
 import pytest
 import signal
 import tempfile
+import subprocess
 
+from diffoscope.config import Config
 from diffoscope.main import main
 
 TEST_TAR1_PATH = os.path.join(os.path.dirname(__file__), 'data/test1.tar')
@@ -133,3 +136,49 @@ def test_profiling(capsys):
     assert ret == 0
     assert "Profiling output for" in out
     assert err == ''
+
+def test_jobs(capsys, monkeypatch):
+    # Ensure the singleton is restored after main() modifies it
+    monkeypatch.setattr(Config(), 'jobs', 1)
+
+    _, serial, _ = run(capsys, *TEST_TARS)
+    ret, parallel, err = run(capsys, '--jobs=4', *TEST_TARS)
+
+    assert ret == 1
+    assert err == ''
+    assert parallel == serial
+
+def test_import_time():
+    # Importing diffoscope.main should not pull in the comparators or any
+    # presenters, as that is a significant part of the run time for small
+    # inputs. Run with -s to see the totals.
+    p = subprocess.run(
+        (sys.executable, '-X', 'importtime', '-c', 'import diffoscope.main'),
+        stderr=subprocess.PIPE,
+        cwd=os.path.join(os.path.dirname(__file__), '..'),
+    )
+    assert p.returncode == 0
+
+    cumulative = {}
+    for line in p.stderr.decode('utf-8').splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            cumulative[fields[2].strip()] = int(fields[1])
+
+    if 'diffoscope.main' not in cumulative:
+        pytest.skip("python -X importtime is not supported")
+
+    print("import diffoscope.main: {} us".format(cumulative['diffoscope.main']))
+    for x in sorted(cumulative, key=cumulative.get, reverse=True)[:10]:
+        print("  {:>8} us  {}".format(cumulative[x], x))
+
+    for x in (
+        'diffoscope.comparators',
+        'diffoscope.difference',
+        'diffoscope.presenters.html',
+        'diffoscope.presenters.text',
+        'diffoscope.readers',
+        'distutils',
+    ):
+        assert x not in cumulative
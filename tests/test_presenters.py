@@ -19,10 +19,13 @@
 
 import os
 import re
+import json
 import pytest
 
 from diffoscope.main import main
+from diffoscope.config import Config
 from diffoscope.presenters.utils import create_limited_print_func, PrintLimitReached, PartialString
+from diffoscope.presenters.html.html import convert
 
 from .utils.data import cwd_data, get_data
 from .utils.tools import skip_unless_tools_exist
@@ -100,6 +103,13 @@ def test_json(capsys):
 
     assert out == get_data('output.json')
 
+def test_json_compact(capsys):
+    out = run(capsys, '--json', '-', '--json-compact')
+
+    raw = json.loads(out)
+    assert raw == json.loads(get_data('output.json'))
+    assert out == json.dumps(raw, separators=(',', ':')) + '\n'
+
 def test_no_report_option(capsys):
     out = run(capsys)
 
@@ -137,6 +147,37 @@ def test_htmldir_option(tmpdir, capsys):
         body = extract_body(f.read())
         assert body.count('div class="difference"') == 4
 
+@pytest.mark.parametrize('args', [
+    (),
+    # Spilled diffs are reopened by the workers
+    ('--max-diff-in-memory-size', '64'),
+])
+def test_htmldir_jobs(tmpdir, capsys, monkeypatch, args):
+    # Spill diffs into child pages
+    monkeypatch.setattr(Config(), 'max_page_diff_block_lines', 16)
+    monkeypatch.setattr(Config(), 'jobs', 1)
+
+    pair = []
+    for x in range(2):
+        pair.append(str(tmpdir.join('file{}'.format(x))))
+        with open(pair[-1], 'w') as f:
+            f.writelines('{} {}\n'.format(x, y) for y in range(100))
+
+    def html_dir(jobs):
+        target = os.path.join(str(tmpdir), 'target{}'.format(jobs))
+        run(capsys, '--html-dir', target, '--jquery', 'disable',
+            '--jobs', str(jobs), *args, pair=tuple(pair))
+        result = {}
+        for x in os.listdir(target):
+            with open(os.path.join(target, x), 'rb') as f:
+                # The title includes the command line
+                result[x] = re.sub(rb'<title>.*</title>', b'', f.read())
+        return result
+
+    expected = html_dir(1)
+    assert any(x.endswith('-1.html') for x in expected)
+    assert html_dir(2) == expected
+
 def test_html_option_with_stdout(capsys):
     body = extract_body(run(capsys, '--html', '-'))
 
@@ -204,3 +245,20 @@ def test_partial_string_escape():
     assert esc.format({None: "0"}) == "{} 0"
     with pytest.raises(ValueError):
         PartialString("{}")
+
+@pytest.mark.parametrize('args,expected', (
+    (('x\ty\t\tz', 1), 'x<span class="diffponct">\xbb</span>' + '\xa0' * 6 +
+        '\u200by<span class="diffponct">\xbb</span>' + '\xa0' * 6 +
+        '\u200b<span class="diffponct">\xbb</span>' + '\xa0' * 7 + '\u200bz'),
+    (('a b;c', 0), 'a \u200bb;\u200bc'),
+    (('\x01<a href="x">\x02 & y', 1, 'ins'), '<ins>&lt;a<span class="diffponct">'
+        '\xb7</span>\u200bhref=&quot;x&quot;&gt;</ins><span class="diffponct">'
+        '\xb7</span>\u200b&amp;<span class="diffponct">\xb7</span>\u200by'),
+    (('z' * 45, 1), 'z' * 21 + '\u200b' + 'z' * 21 + '\u200bzzz'),
+    (('abc\x01' + 'd' * 18 + '\x02e\n', 1, 'del'), 'abc<del>' + 'd' * 18 +
+        '\u200b</del>e<br/><span class="diffponct">\\</span>'),
+    (('\x03\x1f\t\n' + 'f' * 15, 0), '<em>\\x3</em><em>\\x1f</em><em>\\x9</em>'
+        '\u200b<em>\\xa</em>' + 'f' * 15),
+))
+def test_html_convert(args, expected):
+    assert convert(*args) == expected
@@ -23,7 +23,7 @@ import pytest
 
 from diffoscope.main import main
 from diffoscope.comparators.utils.compare import compare_root_paths
-from diffoscope.readers import load_diff_from_path
+from diffoscope.readers import load_diff, load_diff_from_path
 
 from .utils.data import cwd_data, get_data
 
@@ -48,3 +48,68 @@ def run_diff_read(diffpath):
 def test_json(capsys):
     run_read_write(capsys, 'output.json', '--json', '-')
     run_diff_read('output.json')
+
+def test_json_lazily():
+    with cwd_data(), open('output.json', 'rb') as fp:
+        read = load_diff(fp, 'output.json', lazily=True)
+        assert read.equals(load_diff_from_path('output.json'))
+
+@pytest.mark.parametrize('lazily', [False, True])
+def test_json_sorted_keys(tmpdir, lazily):
+    import json
+
+    with cwd_data():
+        expected = load_diff_from_path('output.json')
+        with open('output.json') as f:
+            raw = json.load(f)
+
+    # json.dump puts "details" before "source1", "unified_diff" and the magic
+    path = str(tmpdir.join('sorted.json'))
+    with open(path, 'w') as f:
+        json.dump(raw, f, sort_keys=True)
+
+    with open(path, 'rb') as fp:
+        read = load_diff(fp, path, lazily=lazily)
+        assert read.equals(expected)
+
+def test_json_html_dir_residency(tmpdir, monkeypatch):
+    import json
+    import tracemalloc
+
+    from diffoscope.config import Config
+    from diffoscope.presenters.json import JSON_FORMAT_MAGIC
+
+    monkeypatch.setattr(Config(), 'max_page_diff_block_lines', 16)
+
+    def peak(nodes):
+        path = str(tmpdir.join('report{}.json'.format(nodes)))
+        with open(path, 'w') as f:
+            json.dump({
+                JSON_FORMAT_MAGIC: 1,
+                'source1': 'a',
+                'source2': 'b',
+                'unified_diff': None,
+                'details': [{
+                    'source1': 'a{}'.format(x),
+                    'source2': 'b{}'.format(x),
+                    'unified_diff': '@@ -1,2000 +1,4000 @@\n' + ''.join(
+                        '{}{} {}\n'.format(' +'[y % 2], y, 'x' * 250)
+                        for y in range(4000)
+                    ),
+                } for x in range(nodes)],
+            }, f)
+
+        tracemalloc.start()
+        try:
+            with pytest.raises(SystemExit):
+                main((path, '--html-dir', str(tmpdir.join(str(nodes)))))
+            return os.path.getsize(path), tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    peak(1) # import everything first
+    small, small_peak = peak(1)
+    large, large_peak = peak(8)
+
+    # The diffs are not all kept in memory
+    assert large_peak - small_peak < (large - small) / 2